@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Medicine, Pharmacy, Price, GenericBenefit
+from .models import (
+    Composition, CompositionIngredient, CompositionSavings, GenericBenefit, Ingredient, Medicine, Pharmacy, Price,
+    PriceAlert, PriceAlertNotification,
+)
 
 
 @admin.register(Medicine)
@@ -41,3 +44,48 @@ class GenericBenefitAdmin(admin.ModelAdmin):
     search_fields = ['title', 'description']
     list_filter = ['is_active']
     ordering = ['order', 'title']
+
+
+class CompositionIngredientInline(admin.TabularInline):
+    model = CompositionIngredient
+    extra = 0
+
+
+@admin.register(Composition)
+class CompositionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'key']
+    search_fields = ['name', 'canonical']
+    ordering = ['name']
+    inlines = [CompositionIngredientInline]
+
+
+@admin.register(Ingredient)
+class IngredientAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['name']
+    ordering = ['name']
+
+
+@admin.register(PriceAlert)
+class PriceAlertAdmin(admin.ModelAdmin):
+    list_display = ['email', 'medicine', 'target_price', 'created_at', 'triggered_at']
+    search_fields = ['email', 'medicine__brand_name']
+    list_filter = ['triggered_at']
+    ordering = ['-created_at']
+    autocomplete_fields = ['medicine']
+
+
+@admin.register(PriceAlertNotification)
+class PriceAlertNotificationAdmin(admin.ModelAdmin):
+    list_display = ['alert', 'price', 'pharmacy', 'created_at', 'sent_at', 'attempts']
+    list_filter = ['sent_at']
+    ordering = ['-created_at']
+    raw_id_fields = ['alert']
+
+
+@admin.register(CompositionSavings)
+class CompositionSavingsAdmin(admin.ModelAdmin):
+    list_display = ['name', 'branded_price', 'generic_price', 'savings_amount', 'savings_percentage', 'refreshed_at']
+    search_fields = ['name']
+    ordering = ['-savings_amount', 'composition_key']
+    raw_id_fields = ['branded_medicine', 'generic_medicine']
@@ -0,0 +1,320 @@
+"""
+Read-only JSON API: search, price comparison and alternatives for one
+medicine, comparisons for a batch of medicines (e.g. a prescription) and
+the generic savings leaderboard.
+
+Comparison, alternatives and batch responses carry an ETag and a
+Last-Modified (see ``core.conditional``), computed with a single query
+before the response is built, which conditional requests skip.
+"""
+from functools import partial
+from typing import Dict, List, Optional
+
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.views.decorators.http import condition, require_GET
+
+from . import cache as results_cache
+from .conditional import composition_key, etag_func, freshness, last_modified_func
+from .models import CompositionSavings, Medicine, Price
+from .services import (
+    BasketOptimizerService, MedicineSearchService, PriceComparisonService, PriceHistoryService,
+    SavingsLeaderboardService,
+)
+
+MAX_BATCH = 300
+MAX_BASKET = 100
+MAX_BASKET_PHARMACIES = 5
+MAX_HISTORY_DAYS = 3650
+DEFAULT_SAVINGS_LIMIT = 20
+
+
+def medicine_json(medicine: Medicine) -> dict:
+    return {
+        'id': medicine.pk,
+        'brand_name': medicine.brand_name,
+        'composition': medicine.composition,
+        'strength': medicine.strength,
+        'manufacturer': medicine.manufacturer,
+        'medicine_type': medicine.medicine_type,
+        'url': reverse('results', args=[medicine.pk]),
+    }
+
+
+def price_json(price: Price) -> dict:
+    return {
+        'pharmacy': price.pharmacy.name,
+        'pharmacy_id': price.pharmacy_id,
+        'price': price.price,
+        'price_type': price.price_type,
+        'last_updated': price.last_updated,
+    }
+
+
+def comparison_json(comparison: dict) -> dict:
+    return {
+        'medicine': medicine_json(comparison['medicine']),
+        'prices': [price_json(price) for price in comparison['prices']],
+        'lowest_price': comparison['lowest_price'],
+        'highest_price': comparison['highest_price'],
+        'savings_percentage': comparison['savings_percentage'],
+    }
+
+
+def alternative_json(alternative: dict) -> dict:
+    return {
+        'medicine': medicine_json(alternative['medicine']),
+        'lowest_price': alternative['lowest_price'],
+        'pharmacy': alternative['pharmacy_name'],
+        'is_generic': alternative['is_generic'],
+        'savings_amount': alternative['savings_amount'],
+        'savings_percentage': alternative['savings_percentage'],
+    }
+
+
+def savings_json(entry: CompositionSavings) -> dict:
+    return {
+        'composition_key': entry.composition_key,
+        'name': entry.name,
+        'branded': {**medicine_json(entry.branded_medicine), 'lowest_price': entry.branded_price},
+        'generic': {**medicine_json(entry.generic_medicine), 'lowest_price': entry.generic_price},
+        'savings_amount': entry.savings_amount,
+        'savings_percentage': entry.savings_percentage,
+        'branded_count': entry.branded_count,
+        'generic_count': entry.generic_count,
+        'refreshed_at': entry.refreshed_at,
+    }
+
+
+def basket_plan_json(plan: Optional[dict]) -> Optional[dict]:
+    if plan is None:
+        return None
+    return {
+        'pharmacies': [{'id': pharmacy.pk, 'name': pharmacy.name} for pharmacy in plan['pharmacies']],
+        'total': plan['total'],
+        'exact': plan['exact'],
+        'lines': [
+            {
+                'requested_id': line['requested'].pk,
+                'medicine': medicine_json(line['medicine']),
+                'pharmacy_id': line['pharmacy'].pk,
+                'quantity': line['quantity'],
+                'unit_price': line['unit_price'],
+                'subtotal': line['subtotal'],
+            }
+            for line in plan['lines']
+        ],
+    }
+
+
+def error(message: str, status: int) -> JsonResponse:
+    return JsonResponse({'error': message}, status=status)
+
+
+def _batch_ids(request) -> List[int]:
+    """
+    Medicine ids from ``?ids=1,2,3`` and/or repeated ``?ids=`` parameters,
+    in request order without duplicates
+    Raises: ValueError
+    """
+    ids = []
+    for value in request.GET.getlist('ids'):
+        ids.extend(int(part) for part in value.split(',') if part.strip())
+    return list(dict.fromkeys(ids))
+
+
+def _medicine_freshness(request, medicine_id):
+    return freshness(request, Medicine.objects.filter(pk=medicine_id))
+
+
+def _alternatives_freshness(request, medicine_id):
+    try:
+        key = composition_key(request, medicine_id)
+    except Medicine.DoesNotExist:
+        return None
+    return freshness(request, Medicine.objects.filter(composition_key=key)) if key is not None else None
+
+
+def _batch_freshness(request):
+    try:
+        ids = _batch_ids(request)
+    except ValueError:
+        return None
+    return freshness(request, Medicine.objects.filter(pk__in=ids[:MAX_BATCH])) if ids else None
+
+
+def _savings_etag(request):
+    # Every URL's response changes only when a refresh bumps the version
+    return f'savings-{results_cache.savings_leaderboard_version()}'
+
+
+@require_GET
+def search(request):
+    """
+    Best matching medicines for ``?q=`` with their lowest price, ``limit``
+    (default 50, at most 100) at a time. ``next`` is the ``after`` cursor
+    of the following page, null on the last one.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', MedicineSearchService.PAGE_SIZE))
+        page = MedicineSearchService.search_page(query, request.GET.get('after'), limit, ('price_summary',))
+    except ValueError:
+        return error('Invalid limit or after cursor', 400)
+    results = []
+    for medicine in page.medicines:
+        summary = getattr(medicine, 'price_summary', None)
+        results.append({
+            **medicine_json(medicine),
+            'lowest_price': summary.lowest_price if summary else None,
+            'price_count': summary.price_count if summary else 0,
+        })
+    return JsonResponse({
+        'query': query,
+        'results': results,
+        'count': page.count,
+        'count_exact': page.count_exact,
+        'next': page.next_cursor,
+        'next_url': f"{reverse('api_search')}?{urlencode({'q': query, 'limit': limit, 'after': page.next_cursor})}"
+        if page.next_cursor else None,
+    })
+
+
+@require_GET
+@condition(etag_func=etag_func(_medicine_freshness), last_modified_func=last_modified_func(_medicine_freshness))
+def comparison(request, medicine_id):
+    """
+    Prices of one medicine at every pharmacy, cheapest first
+    """
+    try:
+        return JsonResponse(comparison_json(results_cache.get_price_comparison(medicine_id)))
+    except Medicine.DoesNotExist:
+        return error('Medicine not found', 404)
+
+
+@require_GET
+@condition(etag_func=etag_func(_alternatives_freshness), last_modified_func=last_modified_func(_alternatives_freshness))
+def alternatives(request, medicine_id):
+    """
+    Priced medicines with the same composition, generics first
+    """
+    try:
+        found = results_cache.find_alternatives(medicine_id, partial(composition_key, request, medicine_id))
+    except Medicine.DoesNotExist:
+        return error('Medicine not found', 404)
+    return JsonResponse({'medicine_id': medicine_id, 'alternatives': [alternative_json(alt) for alt in found]})
+
+
+@require_GET
+def price_history(request, medicine_id):
+    """
+    Lowest, highest and average price of one medicine over the last
+    ``?days=`` (default 90), overall and at each pharmacy
+    """
+    try:
+        days = int(request.GET.get('days', 90))
+    except ValueError:
+        return error('days must be an integer', 400)
+    if not 1 <= days <= MAX_HISTORY_DAYS:
+        return error(f'days must be between 1 and {MAX_HISTORY_DAYS}', 400)
+    if not Medicine.objects.filter(pk=medicine_id).exists():
+        return error('Medicine not found', 404)
+
+    by_pharmacy = PriceHistoryService.stats_by_pharmacy(medicine_id, days)
+    return JsonResponse({
+        'medicine_id': medicine_id,
+        'days': days,
+        'overall': PriceHistoryService.stats(medicine_id=medicine_id, days=days),
+        'pharmacies': [{'pharmacy_id': pharmacy_id, **stats} for pharmacy_id, stats in by_pharmacy.items()],
+    })
+
+
+@require_GET
+@condition(etag_func=etag_func(_batch_freshness), last_modified_func=last_modified_func(_batch_freshness))
+def batch_comparison(request):
+    """
+    Comparisons for up to MAX_BATCH medicines (``?ids=1,2,3``) in request
+    order, computed with a constant number of queries
+    """
+    try:
+        ids = _batch_ids(request)
+    except ValueError:
+        return error('ids must be integers', 400)
+    if not ids:
+        return error('ids is required', 400)
+    if len(ids) > MAX_BATCH:
+        return error(f'At most {MAX_BATCH} ids per request', 400)
+
+    comparisons = PriceComparisonService.get_price_comparisons(ids)
+    return JsonResponse({
+        'comparisons': [comparison_json(comparisons[medicine_id]) for medicine_id in ids if medicine_id in comparisons],
+        'missing': [medicine_id for medicine_id in ids if medicine_id not in comparisons],
+    })
+
+
+def _basket_items(request) -> Dict[int, int]:
+    """
+    {medicine id: quantity} from ``?items=12,15x2`` (quantity defaults to 1)
+    Raises: ValueError
+    """
+    basket: Dict[int, int] = {}
+    for value in request.GET.getlist('items'):
+        for part in filter(None, (part.strip() for part in value.split(','))):
+            medicine_id, _, quantity = part.partition('x')
+            quantity = int(quantity) if quantity else 1
+            if quantity < 1:
+                raise ValueError(part)
+            basket[int(medicine_id)] = basket.get(int(medicine_id), 0) + quantity
+    return basket
+
+
+@require_GET
+def basket(request):
+    """
+    Cheapest pharmacy, and cheapest split across at most ``?pharmacies=``
+    (default 2), for a basket of ``?items=12,15x2``; ``?substitutes=1``
+    allows same-composition substitutes
+    """
+    try:
+        items = _basket_items(request)
+        max_pharmacies = int(request.GET.get('pharmacies', 2))
+    except ValueError:
+        return error('items and pharmacies must be integers', 400)
+    if not items:
+        return error('items is required', 400)
+    if len(items) > MAX_BASKET:
+        return error(f'At most {MAX_BASKET} items per basket', 400)
+    if not 1 <= max_pharmacies <= MAX_BASKET_PHARMACIES:
+        return error(f'pharmacies must be between 1 and {MAX_BASKET_PHARMACIES}', 400)
+
+    result = BasketOptimizerService.optimize(items, max_pharmacies, request.GET.get('substitutes') == '1')
+    return JsonResponse({
+        'items': [{'medicine': medicine_json(item['medicine']), 'quantity': item['quantity']}
+                  for item in result['items']],
+        'missing': result['missing'],
+        'unavailable': [medicine.pk for medicine in result['unavailable']],
+        'lowest_total': result['lowest_total'],
+        'single_pharmacy': basket_plan_json(result['single_pharmacy']),
+        'split': basket_plan_json(result['split']),
+    })
+
+
+@require_GET
+@condition(etag_func=_savings_etag)
+def savings_leaderboard(request):
+    """
+    Compositions where switching from the cheapest brand to the cheapest
+    generic saves the most, by ``?order=amount`` (default) or
+    ``percentage``, ``limit`` (default 20, at most 100) of them. Served from
+    the cached, periodically refreshed leaderboard.
+    """
+    order = request.GET.get('order', 'amount')
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_SAVINGS_LIMIT))
+        entries = results_cache.get_savings_leaderboard(order)
+    except ValueError:
+        return error('Invalid order or limit', 400)
+    if not 1 <= limit <= SavingsLeaderboardService.MAX_TOP:
+        return error(f'limit must be between 1 and {SavingsLeaderboardService.MAX_TOP}', 400)
+    return JsonResponse({'order': order, 'results': [savings_json(entry) for entry in entries[:limit]]})
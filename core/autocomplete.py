@@ -0,0 +1,313 @@
+"""
+Process-local typeahead index over medicine brand names and compositions.
+
+Completion keys are every word-start suffix of a label ("Dolo 650" gives
+"dolo 650" and "650"), kept sorted so a prefix lookup is one binary search
+followed by a short scan. The bulk of the keys live in a packed, immutable
+store (one string plus offset/target arrays); saves and deletes go to a small
+sorted delta list and tombstone set that are merged back into the packed
+store once they grow past ``MERGE_THRESHOLD``.
+
+The index is built from the Medicine table on first use and then kept up to
+date by the Medicine save/delete signals once their transaction commits, so
+lookups never touch the database. Those signals only reach the worker that
+made the write, and bulk inserts skip them, so the index also records the
+shared autocomplete version counter (see core.cache) it is current with;
+every ``AUTOCOMPLETE_CHECK_INTERVAL`` seconds a worker compares it with the
+shared one and rebuilds when another process changed the catalogue.
+"""
+import bisect
+import threading
+import time
+from array import array
+from typing import Callable, Iterable, List, Optional, Tuple
+
+MEDICINE = 0
+COMPOSITION = 1
+KIND_NAMES = {MEDICINE: 'medicine', COMPOSITION: 'composition'}
+
+MERGE_THRESHOLD = 2048
+MAX_SCAN = 128
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.casefold().split())
+
+
+def completion_keys(label: str) -> List[str]:
+    """
+    Every word-start suffix of the normalized label, whole label first
+    """
+    words = normalize(label).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class PackedKeys:
+    """
+    Immutable sorted (key, target) pairs: keys concatenated into one string
+    and addressed through an offset array
+    """
+    __slots__ = ('_blob', '_offsets', '_targets')
+
+    def __init__(self, pairs: List[Tuple[str, int]]):
+        offsets = array('L', [0])
+        position = 0
+        for key, _ in pairs:
+            position += len(key)
+            offsets.append(position)
+        self._blob = ''.join(key for key, _ in pairs)
+        self._offsets = offsets
+        self._targets = array('q', (target for _, target in pairs))
+
+    def __len__(self):
+        return len(self._targets)
+
+    def key(self, i: int) -> str:
+        return self._blob[self._offsets[i]:self._offsets[i + 1]]
+
+    def pairs(self):
+        for i in range(len(self)):
+            yield self.key(i), self._targets[i]
+
+    def scan(self, prefix: str, limit: int):
+        """
+        Yield up to ``limit`` targets whose key starts with ``prefix``, in key order
+        """
+        lo, hi = 0, len(self._targets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        end = min(len(self._targets), lo + limit)
+        for i in range(lo, end):
+            if not self.key(i).startswith(prefix):
+                return
+            yield self._targets[i]
+
+
+class AutocompleteIndex:
+    """
+    Prefix index returning the top-k brand name and composition completions.
+    Entries are stored column-wise; a completion key points at its entry and
+    records whether it matched the start of the label (ranked first).
+    """
+    __slots__ = (
+        '_labels', '_kinds', '_medicine_ids', '_composition_entries', '_packed',
+        '_pending', '_dead', '_by_medicine', '_compositions', '_lock',
+    )
+
+    def __init__(self):
+        self._labels: List[Optional[str]] = []
+        self._kinds = array('b')
+        self._medicine_ids = array('q')
+        self._composition_entries = array('q')
+        self._packed = PackedKeys([])
+        self._pending: List[Tuple[str, int]] = []
+        self._dead = set()
+        self._by_medicine = {}
+        self._compositions = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[int, str, str]]) -> 'AutocompleteIndex':
+        """
+        Build an index from (medicine id, brand name, composition) rows
+        """
+        index = cls()
+        pairs = []
+        for medicine_id, brand_name, composition in rows:
+            pairs.extend(index._add(medicine_id, brand_name, composition))
+        pairs.sort()
+        index._packed = PackedKeys(pairs)
+        return index
+
+    def __len__(self):
+        return len(self._by_medicine) + len(self._compositions)
+
+    def _new_entry(self, label: str, kind: int, medicine_id: int) -> List[Tuple[str, int]]:
+        entry = len(self._labels)
+        self._labels.append(label)
+        self._kinds.append(kind)
+        self._medicine_ids.append(medicine_id)
+        self._composition_entries.append(-1)
+        # Targets encode the entry and whether the key is the whole label
+        return [(key, entry * 2 + (i > 0)) for i, key in enumerate(completion_keys(label))]
+
+    def _add(self, medicine_id: int, brand_name: str, composition: str) -> List[Tuple[str, int]]:
+        pairs = self._new_entry(brand_name, MEDICINE, medicine_id)
+        brand_entry = len(self._labels) - 1
+
+        composition_key = normalize(composition)
+        shared = self._compositions.get(composition_key)
+        if shared is None:
+            pairs.extend(self._new_entry(composition, COMPOSITION, 0))
+            shared = self._compositions[composition_key] = [len(self._labels) - 1, 0]
+        shared[1] += 1
+
+        self._composition_entries[brand_entry] = shared[0]
+        self._by_medicine[medicine_id] = brand_entry
+        return pairs
+
+    def _remove(self, medicine_id: int):
+        brand_entry = self._by_medicine.pop(medicine_id, None)
+        if brand_entry is None:
+            return
+        self._kill(brand_entry)
+        composition_key = normalize(self._labels[self._composition_entries[brand_entry]])
+        shared = self._compositions[composition_key]
+        shared[1] -= 1
+        if shared[1] == 0:
+            self._kill(shared[0])
+            del self._compositions[composition_key]
+
+    def _kill(self, entry: int):
+        # Keys still in the delta list are dropped right away so they do not
+        # use up lookups' scan budget; packed keys wait for the next merge
+        for i, key in enumerate(completion_keys(self._labels[entry])):
+            pair = (key, entry * 2 + (i > 0))
+            position = bisect.bisect_left(self._pending, pair)
+            if position < len(self._pending) and self._pending[position] == pair:
+                del self._pending[position]
+        self._dead.add(entry)
+
+    def update(self, medicine_id: int, brand_name: str, composition: str):
+        """
+        Add or replace the completions for one medicine
+        """
+        with self._lock:
+            self._remove(medicine_id)
+            for pair in self._add(medicine_id, brand_name, composition):
+                bisect.insort(self._pending, pair)
+            self._maybe_merge()
+
+    def remove(self, medicine_id: int):
+        with self._lock:
+            self._remove(medicine_id)
+            self._maybe_merge()
+
+    def rows(self):
+        """
+        The live (medicine id, brand name, composition) rows
+        """
+        for medicine_id, entry in self._by_medicine.items():
+            yield medicine_id, self._labels[entry], self._labels[self._composition_entries[entry]]
+
+    def _maybe_merge(self):
+        if len(self._pending) + len(self._dead) < MERGE_THRESHOLD:
+            return
+        # Building afresh from the live rows also drops the dead entries'
+        # slots instead of keeping them as tombstones
+        rebuilt = AutocompleteIndex.build(self.rows())
+        for name in self.__slots__:
+            if name != '_lock':
+                setattr(self, name, getattr(rebuilt, name))
+
+    def _scan_pending(self, prefix: str, limit: int):
+        start = bisect.bisect_left(self._pending, (prefix, -1))
+        for key, target in self._pending[start:start + limit]:
+            if not key.startswith(prefix):
+                return
+            yield target
+
+    def lookup(self, query: str, limit: int = 8) -> List[dict]:
+        """
+        Top ``limit`` completions for ``query``: label-start matches before
+        later-word matches, then alphabetical
+        Returns: List of {'label', 'kind', 'medicine_id'} dicts
+        """
+        prefix = normalize(query)
+        if not prefix or limit <= 0:
+            return []
+        with self._lock:
+            targets = list(self._packed.scan(prefix, MAX_SCAN))
+            targets.extend(self._scan_pending(prefix, MAX_SCAN))
+            ranked = []
+            seen = set()
+            for target in targets:
+                entry = target // 2
+                if entry in self._dead or entry in seen:
+                    continue
+                seen.add(entry)
+                ranked.append((target % 2, self._labels[entry].casefold(), entry))
+            ranked.sort()
+            results = []
+            for _, _, entry in ranked[:limit]:
+                kind = self._kinds[entry]
+                results.append({
+                    'label': self._labels[entry],
+                    'kind': KIND_NAMES[kind],
+                    'medicine_id': self._medicine_ids[entry] if kind == MEDICINE else None,
+                })
+            return results
+
+
+_index: Optional[AutocompleteIndex] = None
+_index_version: Optional[int] = None
+_index_lock = threading.Lock()
+_checked_at = 0.0
+
+
+def get_index() -> AutocompleteIndex:
+    """
+    The process-wide index, built from the Medicine table on first use and
+    rebuilt once the shared autocomplete version moves past its own
+    """
+    global _index, _index_version, _checked_at
+    from django.conf import settings
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < getattr(settings, 'AUTOCOMPLETE_CHECK_INTERVAL', 1.0):
+        return _index
+    from . import cache
+    with _index_lock:
+        version = cache.autocomplete_version()
+        if _index is None or version != _index_version:
+            from .models import Medicine
+            from .routers import primary_reads
+            with primary_reads():
+                rows = Medicine.objects.values_list('id', 'brand_name', 'composition').iterator(chunk_size=5000)
+                _index = AutocompleteIndex.build(rows)
+            _index_version = version
+        _checked_at = now
+    return _index
+
+
+def reset_index():
+    """
+    Drop the process-wide index so the next lookup rebuilds it
+    """
+    global _index, _index_version
+    with _index_lock:
+        _index = _index_version = None
+
+
+def _apply(change: Callable[[AutocompleteIndex], None]):
+    """
+    Apply a committed change to this process's index and bump the shared
+    version for the other workers. The index adopts the new version when
+    no other process bumped it meanwhile, so it only rebuilds for changes
+    it has not seen.
+    """
+    global _index_version
+    from . import cache
+    version = cache.bump_autocomplete_version()
+    with _index_lock:
+        if _index is None:
+            return
+        change(_index)
+        if _index_version == version - 1:
+            _index_version = version
+
+
+def medicine_saved(medicine, using: str = 'default'):
+    from django.db import transaction
+    medicine_id, brand_name, composition = medicine.pk, medicine.brand_name, medicine.composition
+    transaction.on_commit(
+        lambda: _apply(lambda index: index.update(medicine_id, brand_name, composition)), using=using
+    )
+
+
+def medicine_deleted(medicine_id: int, using: str = 'default'):
+    from django.db import transaction
+    transaction.on_commit(lambda: _apply(lambda index: index.remove(medicine_id)), using=using)
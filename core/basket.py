@@ -0,0 +1,165 @@
+"""
+Prescription basket optimization: which pharmacies to buy a list of
+medicines from for the lowest total.
+
+A basket is loaded into a dense item x pharmacy matrix of integer paise
+(unit price times quantity, UNAVAILABLE where a pharmacy does not stock the
+item). Candidate plans are scored a whole pharmacy column at a time with
+``sum`` and ``map(min, ...)``, which loop in C, so a 30 item basket across
+hundreds of pharmacies costs a few thousand column operations.
+
+The cheapest split across at most K pharmacies is a facility location
+problem. Small instances are solved exactly by enumerating every set of up
+to K pharmacies; larger ones greedily (add the pharmacy that lowers the
+total most, K times) followed by swap moves until no single swap lowers
+the total.
+"""
+import math
+from decimal import Decimal
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Larger than any real basket total, small enough to add up without care
+UNAVAILABLE = 10 ** 15
+EXACT_EVALUATIONS = 2_000
+
+
+def to_paise(price: Decimal) -> int:
+    return int(price * 100)
+
+
+def to_rupees(paise: int) -> Decimal:
+    return Decimal(paise).scaleb(-2)
+
+
+def _cheapest(columns: Iterable[List[int]]) -> List[int]:
+    """
+    Element-wise minimum of one or more columns
+    """
+    columns = list(columns)
+    if len(columns) == 1:
+        return list(columns[0])
+    return list(map(min, *columns))
+
+
+class PriceMatrix:
+    """
+    Cost of every basket item (rows) at every pharmacy (columns), in paise
+    """
+
+    def __init__(self, item_count: int):
+        self.item_count = item_count
+        self.columns: Dict[int, List[int]] = {}
+
+    def add(self, item: int, pharmacy_id: int, paise: int):
+        """
+        Offer ``item`` at ``pharmacy_id``, keeping the cheaper of repeated offers
+        """
+        column = self.columns.get(pharmacy_id)
+        if column is None:
+            column = self.columns[pharmacy_id] = [UNAVAILABLE] * self.item_count
+        if paise < column[item]:
+            column[item] = paise
+
+    def cost(self, pharmacy_ids: Sequence[int]) -> int:
+        """
+        Total when every item is bought where it is cheapest among
+        ``pharmacy_ids``; UNAVAILABLE or more if some item is stocked by none
+        """
+        if len(pharmacy_ids) == 1:
+            return sum(self.columns[pharmacy_ids[0]])
+        return sum(map(min, *(self.columns[pharmacy_id] for pharmacy_id in pharmacy_ids)))
+
+    def lowest(self) -> List[int]:
+        """
+        Cost of every item at the pharmacy where it is cheapest
+        """
+        if not self.columns:
+            return [UNAVAILABLE] * self.item_count
+        return _cheapest(self.columns.values())
+
+    def assignment(self, pharmacy_ids: Sequence[int]) -> List[int]:
+        """
+        The pharmacy each item is bought from, the first of ``pharmacy_ids``
+        on ties
+        """
+        columns = [self.columns[pharmacy_id] for pharmacy_id in pharmacy_ids]
+        return [
+            pharmacy_ids[min(range(len(columns)), key=lambda position: columns[position][item])]
+            for item in range(self.item_count)
+        ]
+
+    def best_single(self) -> Optional[int]:
+        """
+        The pharmacy stocking every item for the lowest total (lowest id on ties)
+        """
+        best, best_total = None, UNAVAILABLE
+        for pharmacy_id in sorted(self.columns):
+            total = sum(self.columns[pharmacy_id])
+            if total < best_total:
+                best, best_total = pharmacy_id, total
+        return best
+
+    def best_split(self, max_pharmacies: int) -> Tuple[List[int], bool]:
+        """
+        The pharmacies, at most ``max_pharmacies`` of them, to split the
+        basket across for the lowest total. Pharmacies that would not
+        supply any item are left out.
+        Returns: (pharmacy ids, whether the split is known to be optimal)
+        """
+        pharmacy_ids = sorted(self.columns)
+        size = min(max_pharmacies, len(pharmacy_ids))
+        if not size:
+            return [], True
+        evaluations = sum(math.comb(len(pharmacy_ids), k) for k in range(1, size + 1))
+        if evaluations <= EXACT_EVALUATIONS:
+            # Smaller sets come first, so ties go to fewer pharmacies
+            chosen = min(
+                (candidate for k in range(1, size + 1) for candidate in combinations(pharmacy_ids, k)),
+                key=self.cost,
+            )
+            return self._used(list(chosen)), True
+        chosen = self._improve(self._greedy(pharmacy_ids, size), pharmacy_ids)
+        return self._used(chosen), False
+
+    def _greedy(self, pharmacy_ids: List[int], size: int) -> List[int]:
+        chosen: List[int] = []
+        best = [UNAVAILABLE] * self.item_count
+        total = sum(best)
+        for _ in range(size):
+            candidate = None
+            for pharmacy_id in pharmacy_ids:
+                if pharmacy_id in chosen:
+                    continue
+                candidate_total = sum(map(min, best, self.columns[pharmacy_id]))
+                if candidate_total < total:
+                    candidate, total = pharmacy_id, candidate_total
+            if candidate is None:
+                break
+            chosen.append(candidate)
+            best = list(map(min, best, self.columns[candidate]))
+        return chosen
+
+    def _improve(self, chosen: List[int], pharmacy_ids: List[int]) -> List[int]:
+        """
+        Replace chosen pharmacies one at a time while that lowers the total
+        """
+        total = self.cost(chosen)
+        improved = True
+        while improved:
+            improved = False
+            for position in range(len(chosen)):
+                rest = chosen[:position] + chosen[position + 1:]
+                others = _cheapest(self.columns[pharmacy_id] for pharmacy_id in rest) if rest else None
+                for pharmacy_id in pharmacy_ids:
+                    if pharmacy_id in chosen:
+                        continue
+                    column = self.columns[pharmacy_id]
+                    candidate_total = sum(map(min, others, column)) if others else sum(column)
+                    if candidate_total < total:
+                        chosen[position], total, improved = pharmacy_id, candidate_total, True
+        return chosen
+
+    def _used(self, pharmacy_ids: List[int]) -> List[int]:
+        used = set(self.assignment(pharmacy_ids)) if pharmacy_ids else set()
+        return [pharmacy_id for pharmacy_id in pharmacy_ids if pharmacy_id in used]
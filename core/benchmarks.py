@@ -0,0 +1,904 @@
+"""
+Benchmarks for the hot paths of the site, run with ``manage.py benchmark``.
+
+Every benchmark seeds its own synthetic catalogue (see ``core.synthetic``)
+inside a transaction that is rolled back at the end, so it can be pointed at
+a development database without disturbing its data.
+"""
+import csv
+import hashlib
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from . import search, snapshot
+from .db import current_pragmas
+from .autocomplete import AutocompleteIndex
+from .importers import CENT, ImportStats, PriceImporter, PriceSyncer
+from .models import (
+    AlternativeGroup, Medicine, MedicinePriceSummary, Pharmacy, Price, PriceAlert, PriceAlertNotification,
+)
+from .services import (
+    AlternativeFinderService, AlternativeGroupService, BasketOptimizerService, MedicineSearchService,
+    PriceAlertService, PriceComparisonService, PriceSummaryService, SavingsLeaderboardService,
+)
+from .synthetic import (
+    SALTS, STRENGTHS, add_medicines, insert_rows, search_terms, seed_catalogue, synthetic_brand_name,
+)
+
+
+@contextmanager
+def rolled_back(using='default'):
+    """
+    Run the block in a transaction that is always rolled back
+    """
+    with transaction.atomic(using=using):
+        yield
+        transaction.set_rollback(True, using=using)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples_ms):
+    """
+    Returns: {'n', 'mean_ms', 'p50_ms', 'p99_ms', 'max_ms'} for a list of timings
+    """
+    return {
+        'n': len(samples_ms),
+        'mean_ms': round(statistics.fmean(samples_ms), 3),
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+        'max_ms': round(max(samples_ms), 3),
+    }
+
+
+def time_calls(func, arguments):
+    """
+    Call ``func`` once per argument and return the wall times in milliseconds
+    """
+    samples = []
+    for argument in arguments:
+        started = time.perf_counter()
+        func(argument)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def measure(func, arguments, before=None, memory_calls=50):
+    """
+    Latency distribution, queries per call and peak Python allocations per
+    call of ``func`` over ``arguments``. Memory is traced in a separate,
+    shorter pass since tracemalloc slows every allocation down;
+    ``before`` runs ahead of each pass (e.g. to empty a cache).
+    Returns: summarize() plus query and peak memory figures
+    """
+    arguments = list(arguments)
+    samples, query_counts = [], []
+    if before:
+        before()
+    for argument in arguments:
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            func(argument)
+            samples.append((time.perf_counter() - started) * 1000)
+        query_counts.append(len(queries))
+
+    peaks = []
+    if before:
+        before()
+    tracemalloc.start()
+    try:
+        for argument in arguments[:memory_calls]:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            func(argument)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+
+    row = summarize(samples)
+    row.update({
+        'queries_mean': round(statistics.fmean(query_counts), 2),
+        'queries_max': max(query_counts),
+        'peak_kib_p50': round(percentile(peaks, 50) / 1024, 1),
+        'peak_kib_max': round(max(peaks) / 1024, 1),
+    })
+    return row
+
+
+def bench_search(options, stdout):
+    """
+    p50/p99 search latency of the full-text index versus the original
+    brand_name icontains scan, at each catalogue size
+    """
+    rng = random.Random(options['seed'])
+    terms = search_terms(options['queries'], rng)
+    results = []
+
+    def icontains(query):
+        list(Medicine.objects.filter(brand_name__icontains=query).order_by('brand_name')[:50])
+
+    def full_text(query):
+        list(MedicineSearchService.search_medicines(query))
+
+    with rolled_back():
+        seeded = 0
+        for size in sorted(options['sizes']):
+            add_medicines(size - seeded, rng)
+            seeded = size
+            search.rebuild_index()
+            for name, func in (('icontains', icontains), ('full_text', full_text)):
+                row = {'benchmark': 'search', 'path': name, 'medicines': size}
+                row.update(summarize(time_calls(func, terms)))
+                results.append(row)
+                stdout.write(
+                    f"search {name:<10} {size:>9,} medicines  "
+                    f"p50 {row['p50_ms']:>9.3f} ms  p99 {row['p99_ms']:>9.3f} ms"
+                )
+    return results
+
+
+def bench_search_pages(options, stdout, depths=(1, 10, 100)):
+    """
+    Latency of deep search result pages fetched by keyset cursor versus the
+    equivalent OFFSET, for broad queries (composition words matching a large
+    share of the catalogue), at each catalogue size
+    """
+    rng = random.Random(options['seed'])
+    terms = sorted({salt.split()[0][:6].lower() for salt in SALTS})
+    page_size = MedicineSearchService.PAGE_SIZE
+    results = []
+
+    with rolled_back():
+        seeded = 0
+        for size in sorted(options['sizes']):
+            add_medicines(size - seeded, rng)
+            seeded = size
+            search.rebuild_index()
+            # Cursors of the pages to fetch, found by walking from the first page
+            cursors = {depth: [] for depth in depths}
+            for term in terms:
+                cursor = None
+                for depth in range(1, max(depths) + 1):
+                    if depth in cursors:
+                        cursors[depth].append((term, cursor))
+                    cursor = MedicineSearchService.search_page(term, cursor).next_cursor
+                    if cursor is None:
+                        break
+            # Repeat to about --queries calls per depth
+            repeat = max(1, options['queries'] // max(1, len(terms)))
+
+            def keyset(argument):
+                term, cursor = argument
+                MedicineSearchService.search_page(term, cursor)
+
+            def offset(argument):
+                term, depth = argument
+                start = (depth - 1) * page_size
+                list(search.search_medicines(Medicine.objects.all(), term)[start:start + page_size + 1])
+
+            for depth in depths:
+                found = cursors[depth]
+                if not found:
+                    continue
+                for name, func, arguments in (
+                    ('keyset', keyset, found),
+                    ('offset', offset, [(term, depth) for term, _ in found]),
+                ):
+                    row = {'benchmark': 'search_pages', 'path': name, 'page': depth, 'medicines': size,
+                           'queries': len(found)}
+                    row.update(summarize(time_calls(func, arguments * repeat)))
+                    results.append(row)
+                    stdout.write(
+                        f"search_pages {name:<6} page {depth:>4} {size:>9,} medicines  "
+                        f"p50 {row['p50_ms']:>9.3f} ms  p99 {row['p99_ms']:>9.3f} ms"
+                    )
+    return results
+
+
+def bench_autocomplete(options, stdout):
+    """
+    Build time, memory footprint per 100k names and lookup latency of the
+    in-memory typeahead index (no database involved)
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        def rows():
+            rng = random.Random(options['seed'])
+            for medicine_id in range(1, size + 1):
+                yield medicine_id, synthetic_brand_name(rng), f'{rng.choice(SALTS)} {rng.choice(STRENGTHS)}'
+
+        # Footprint of a build whose label strings are allocated while tracing
+        tracemalloc.start()
+        index = AutocompleteIndex.build(rows())
+        memory_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del index
+
+        catalogue = list(rows())
+        started = time.perf_counter()
+        index = AutocompleteIndex.build(catalogue)
+        build_seconds = time.perf_counter() - started
+
+        rng = random.Random(options['seed'] + 1)
+        prefixes = search_terms(options['queries'], rng)
+        row = {
+            'benchmark': 'autocomplete',
+            'names': size,
+            'build_s': round(build_seconds, 3),
+            'bytes_per_100k_names': round(memory_bytes / size * 100_000),
+        }
+        row.update(summarize(time_calls(index.lookup, prefixes)))
+        results.append(row)
+        stdout.write(
+            f"autocomplete {size:>9,} names  build {row['build_s']:>7.3f} s  "
+            f"{row['bytes_per_100k_names'] / 2**20:>6.1f} MiB/100k  "
+            f"p50 {row['p50_ms']:>7.4f} ms  p99 {row['p99_ms']:>7.4f} ms"
+        )
+    return results
+
+
+def bench_price_sync(options, stdout, pharmacies=20, churn=0.01):
+    """
+    Differential sync of a feed with 1% changed prices versus upserting the
+    whole feed, at each feed size (rows spread over 20 pharmacies)
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        rng = random.Random(options['seed'])
+        with rolled_back():
+            add_medicines(max(1, size // pharmacies), rng)
+            Pharmacy.objects.bulk_create(Pharmacy(name=f'Benchmark Pharmacy {i}') for i in range(pharmacies))
+            medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+            pharmacy_ids = list(Pharmacy.objects.filter(name__startswith='Benchmark Pharmacy ').values_list('id', flat=True))
+            feed = {
+                (medicine_id, pharmacy_id): rng.randint(100, 99_999)
+                for pharmacy_id in pharmacy_ids for medicine_id in medicine_ids
+            }
+
+            def rows(prices):
+                for line, ((medicine_id, pharmacy_id), cents) in enumerate(prices.items(), start=2):
+                    yield line, {'medicine_id': str(medicine_id), 'pharmacy_id': str(pharmacy_id),
+                                 'price': f'{cents // 100}.{cents % 100:02d}'}
+
+            PriceSyncer().sync_rows(rows(feed))
+            for key in rng.sample(list(feed), round(len(feed) * churn)):
+                feed[key] += 1
+
+            for path, run in (('sync', PriceSyncer().sync_rows), ('upsert', PriceImporter().import_rows)):
+                with rolled_back():
+                    started = time.perf_counter()
+                    stats = run(rows(feed))
+                    seconds = time.perf_counter() - started
+                row = {
+                    'benchmark': 'price_sync', 'path': path, 'rows': len(feed),
+                    'churn': churn, 'seconds': round(seconds, 3),
+                    'rows_written': stats.writes if path == 'sync' else stats.imported,
+                }
+                results.append(row)
+                stdout.write(
+                    f"price_sync {path:<6} {len(feed):>9,} rows  {row['rows_written']:>9,} written  "
+                    f"{row['seconds']:>8.3f} s  ({len(feed) / seconds:>10,.0f} rows/s)"
+                )
+    return results
+
+
+def bench_import_workers(options, stdout, pharmacies=32, coverage=0.1, workers=(0, 1, 2, 4, 8)):
+    """
+    Importing one CSV feed file per pharmacy (32 files, each pricing a 10%
+    sample of the catalogue), parsed in this process (0 workers) or fanned
+    out to 1, 2, 4 and 8 worker processes while this process writes. Stage
+    rates show where the time goes; parse seconds are summed over workers.
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        rng = random.Random(options['seed'])
+        with rolled_back(), tempfile.TemporaryDirectory() as directory:
+            add_medicines(size, rng)
+            Pharmacy.objects.bulk_create(Pharmacy(name=f'Benchmark Pharmacy {i}') for i in range(pharmacies))
+            medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+            paths = []
+            for i in range(pharmacies):
+                path = Path(directory) / f'pharmacy-{i}.csv'
+                with open(path, 'w', encoding='utf-8', newline='') as handle:
+                    writer = csv.writer(handle)
+                    writer.writerow(['medicine_id', 'pharmacy', 'price', 'price_type'])
+                    for medicine_id in rng.sample(medicine_ids, max(1, round(size * coverage))):
+                        cents = rng.randint(100, 99_999)
+                        writer.writerow([medicine_id, f'Benchmark Pharmacy {i}', f'{cents // 100}.{cents % 100:02d}', 'online'])
+                paths.append(path)
+
+            for count in workers:
+                with rolled_back():
+                    importer = PriceImporter()
+                    total = ImportStats()
+                    started = time.perf_counter()
+                    if count:
+                        feeds = importer.import_files(paths, workers=count)
+                    else:
+                        feeds = ((path, importer.import_file(path)) for path in paths)
+                    for _, stats in feeds:
+                        total.merge(stats)
+                    seconds = time.perf_counter() - started
+                rates = total.stage_rates()
+                row = {
+                    'benchmark': 'import_workers', 'workers': count, 'medicines': size, 'files': len(paths),
+                    'rows': total.rows, 'seconds': round(seconds, 3), 'rows_per_s': round(total.rows / seconds),
+                    **{f'{stage}_rows_per_s': round(rate) for stage, rate in rates.items()},
+                }
+                results.append(row)
+                stdout.write(
+                    f"import_workers {count} workers {total.rows:>9,} rows  {seconds:>8.3f} s  "
+                    f"({row['rows_per_s']:>8,} rows/s)  parse {row['parse_rows_per_s']:>9,}  "
+                    f"resolve {row['resolve_rows_per_s']:>9,}  write {row['write_rows_per_s']:>8,} rows/s"
+                )
+    return results
+
+
+@contextmanager
+def scratch_database(profile, directory):
+    """
+    A migrated, empty SQLite file database using one of
+    settings.SQLITE_PROFILES, for benchmarks whose writes must really
+    commit (and so cannot run in rolled_back())
+    Yields: the database alias
+    """
+    alias = f'benchmark_{profile}'
+    connections.settings[alias] = {
+        **connections.settings['default'], 'NAME': str(Path(directory) / f'{profile}.sqlite3'),
+        **settings.SQLITE_PROFILES[profile],
+    }
+    try:
+        call_command('migrate', database=alias, verbosity=0)
+        yield alias
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+def bench_concurrency(options, stdout, writes=20_000, batch_size=1000):
+    """
+    Price comparison reads (one medicine's prices, cheapest first) in this
+    thread, first on an idle database and then while another thread
+    imports price updates in 1000 row batches, under each profile in
+    settings.SQLITE_PROFILES. Each profile gets its own seeded file
+    database since the import has to commit for readers to contend with it.
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        for profile in settings.SQLITE_PROFILES:
+            with tempfile.TemporaryDirectory() as directory, scratch_database(profile, directory) as alias:
+                seed_catalogue(size, seed=options['seed'], using=alias)
+                connections[alias].close()
+                journal_mode = current_pragmas(connections[alias], ['journal_mode'])['journal_mode']
+                rng = random.Random(options['seed'] + 5)
+                medicine_ids = list(Medicine.objects.using(alias).values_list('id', flat=True))
+                pharmacies = list(Pharmacy.objects.using(alias).values_list('name', flat=True))
+                rows = [
+                    (line, {'medicine_id': rng.choice(medicine_ids), 'pharmacy': rng.choice(pharmacies),
+                            'price': f'{rng.randint(100, 99_999) / 100:.2f}', 'price_type': 'online'})
+                    for line in range(1, writes + 1)
+                ]
+                reads = [rng.choice(medicine_ids) for _ in range(options['queries'])]
+
+                def read(medicine_id):
+                    return list(
+                        Price.objects.using(alias).filter(medicine_id=medicine_id).order_by('price')
+                        .values_list('pharmacy_id', 'price')
+                    )
+
+                def write(outcome):
+                    try:
+                        outcome['stats'] = PriceImporter(batch_size=batch_size, using=alias).import_rows(rows)
+                    except OperationalError as error:
+                        outcome['error'] = str(error)
+                    finally:
+                        connections[alias].close()
+
+                idle = summarize(time_calls(read, reads))
+                outcome, samples, errors = {}, [], 0
+                writer = threading.Thread(target=write, args=(outcome,))
+                writer.start()
+                while writer.is_alive() or not samples:
+                    for medicine_id in reads:
+                        started = time.perf_counter()
+                        try:
+                            read(medicine_id)
+                        except OperationalError:
+                            errors += 1
+                            continue
+                        samples.append((time.perf_counter() - started) * 1000)
+                        if not writer.is_alive():
+                            break
+                writer.join()
+                busy = summarize(samples)
+                stats = outcome.get('stats')
+                row = {
+                    'benchmark': 'concurrency', 'profile': profile, 'journal_mode': journal_mode, 'medicines': size,
+                    'idle_p50_ms': idle['p50_ms'], 'idle_p99_ms': idle['p99_ms'],
+                    'busy_p50_ms': busy['p50_ms'], 'busy_p99_ms': busy['p99_ms'], 'busy_max_ms': busy['max_ms'],
+                    'reads_during_import': busy['n'], 'read_errors': errors,
+                    'write_rows_per_s': round(stats.rows_per_second) if stats else 0,
+                    'write_error': outcome.get('error'),
+                }
+                results.append(row)
+                stdout.write(
+                    f"concurrency {profile:<11} {journal_mode:<7} {size:>9,} medicines  idle p99 {row['idle_p99_ms']:>7.3f} ms  "
+                    f"importing p50 {row['busy_p50_ms']:>8.3f} p99 {row['busy_p99_ms']:>8.3f} "
+                    f"max {row['busy_max_ms']:>8.1f} ms  {row['reads_during_import']:>6,} reads  "
+                    f"{errors} errors  import {row['write_rows_per_s']:>6,} rows/s"
+                    + (f"  writer failed: {row['write_error']}" if row['write_error'] else '')
+                )
+    return results
+
+
+def bench_basket(options, stdout, pharmacies=300, basket_size=30):
+    """
+    Basket optimization for 30 item baskets across 300 pharmacies: the
+    cheapest single pharmacy plus the cheapest split across at most 1 and
+    3 pharmacies, with and without same-composition substitutes
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        with rolled_back():
+            seed_catalogue(size, seed=options['seed'], pharmacies=pharmacies)
+            rng = random.Random(options['seed'] + 4)
+            medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+            baskets = [
+                {medicine_id: rng.randint(1, 3) for medicine_id in rng.sample(medicine_ids, min(basket_size, size))}
+                for _ in range(options['queries'])
+            ]
+            for substitutes in (False, True):
+                for max_pharmacies in (1, 3):
+                    row = {
+                        'benchmark': 'basket', 'path': f"{'substitutes' if substitutes else 'exact_items'}.k{max_pharmacies}",
+                        'medicines': size, 'pharmacies': pharmacies, 'items': basket_size,
+                    }
+                    row.update(measure(
+                        lambda basket: BasketOptimizerService.optimize(basket, max_pharmacies, substitutes), baskets
+                    ))
+                    results.append(row)
+                    stdout.write(
+                        f"basket {row['path']:<15} {size:>9,} medicines  p50 {row['p50_ms']:>8.3f} ms  "
+                        f"p99 {row['p99_ms']:>8.3f} ms  {row['queries_mean']:>4.1f} queries"
+                    )
+    return results
+
+
+def bench_alerts(options, stdout, alerts=1_000_000, changes=100_000):
+    """
+    Price alert matching with 1M active alerts spread over the catalogue:
+    100k prices drop 10% in one batch, then the changed medicines are matched
+    against every alert in one set-based pass. The whole import of such a
+    batch (upsert, summaries, groups, history and matching) is timed too.
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        with rolled_back():
+            seed_catalogue(size, seed=options['seed'])
+            rng = random.Random(options['seed'] + 5)
+            lowest = list(MedicinePriceSummary.objects.values_list('medicine_id', 'lowest_price'))
+            now = connection.ops.adapt_datetimefield_value(timezone.now())
+            # Targets between 70% and 100% of today's lowest price, so a 10% drop triggers about a third
+            insert_rows(PriceAlert, ['email', 'medicine_id', 'target_price', 'created_at'], (
+                (f'user{i}@example.com', medicine_id, str((price * Decimal(rng.randint(70, 100)) / 100).quantize(CENT)), now)
+                for i, (medicine_id, price) in ((i, rng.choice(lowest)) for i in range(alerts))
+            ))
+            prices = list(Price.objects.values_list('id', 'medicine_id', 'pharmacy_id', 'price'))
+            batch = rng.sample(prices, min(changes, len(prices)))
+            dropped = [(price * Decimal('0.9')).quantize(CENT) for _, _, _, price in batch]
+            medicine_ids = {medicine_id for _, medicine_id, _, _ in batch}
+
+            with rolled_back():
+                with connection.cursor() as cursor:
+                    cursor.executemany(
+                        f'UPDATE {Price._meta.db_table} SET price = %s WHERE id = %s',
+                        [(str(price), price_id) for price, (price_id, _, _, _) in zip(dropped, batch)],
+                    )
+                PriceSummaryService.rebuild(medicine_ids)
+                started = time.perf_counter()
+                queued = PriceAlertService.match(medicine_ids)
+                match_seconds = time.perf_counter() - started
+
+            with rolled_back():
+                rows = (
+                    (line, {'medicine_id': str(medicine_id), 'pharmacy_id': str(pharmacy_id), 'price': str(price)})
+                    for line, ((_, medicine_id, pharmacy_id, _), price) in enumerate(zip(batch, dropped), start=2)
+                )
+                started = time.perf_counter()
+                PriceImporter(batch_size=len(batch)).import_rows(rows)
+                import_seconds = time.perf_counter() - started
+                imported = PriceAlertNotification.objects.count()
+
+            for path, seconds, queued in (('match', match_seconds, queued), ('import', import_seconds, imported)):
+                row = {
+                    'benchmark': 'alerts', 'path': path, 'medicines': size, 'alerts': alerts,
+                    'price_changes': len(batch), 'changed_medicines': len(medicine_ids),
+                    'notifications': queued, 'seconds': round(seconds, 3),
+                }
+                results.append(row)
+                stdout.write(
+                    f"alerts {path:<6} {size:>9,} medicines  {alerts:>9,} alerts  {len(batch):>7,} changes  "
+                    f"{queued:>7,} notified  {row['seconds']:>8.3f} s"
+                )
+    return results
+
+
+def bench_leaderboard(options, stdout, repriced_groups=5, sample=1000):
+    """
+    Savings leaderboard materialization: a full refresh, an incremental one
+    after every price of a few compositions changed, and the per-medicine
+    find_alternatives pass it replaces (timed on a sample and extrapolated
+    to the catalogue)
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        with rolled_back():
+            seed_catalogue(size, seed=options['seed'])
+            rng = random.Random(options['seed'] + 6)
+            medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+
+            started = time.perf_counter()
+            full = SavingsLeaderboardService.refresh(full=True)
+            full_seconds = time.perf_counter() - started
+
+            composition_keys = rng.sample(
+                sorted(AlternativeGroup.objects.values_list('pk', flat=True)), repriced_groups
+            )
+            batch = list(
+                Price.objects.filter(medicine__composition_key__in=composition_keys)
+                .values_list('id', 'medicine_id', 'price')
+            )
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'UPDATE {Price._meta.db_table} SET price = %s WHERE id = %s',
+                    [(str((price * Decimal('0.9')).quantize(CENT)), price_id) for price_id, _, price in batch],
+                )
+            # What an import of the batch does to the derived tables
+            changed = {medicine_id for _, medicine_id, _ in batch}
+            PriceSummaryService.rebuild(changed)
+            AlternativeGroupService.rebuild_for_medicines(changed)
+            with override_settings(SAVINGS_LEADERBOARD_OVERLAP_SECONDS=0):
+                started = time.perf_counter()
+                incremental = SavingsLeaderboardService.refresh()
+                incremental_seconds = time.perf_counter() - started
+
+            sampled = rng.sample(medicine_ids, min(sample, len(medicine_ids)))
+            per_medicine_ms = statistics.fmean(time_calls(AlternativeFinderService.find_alternatives, sampled))
+            naive_seconds = per_medicine_ms * len(medicine_ids) / 1000
+
+        for path, seconds, run in (
+            ('full', full_seconds, full), ('incremental', incremental_seconds, incremental),
+            ('per_medicine', naive_seconds, None),
+        ):
+            row = {
+                'benchmark': 'leaderboard', 'path': path, 'medicines': size, 'seconds': round(seconds, 3),
+                'groups': run.groups if run else None, 'entries': run.entries if run else None,
+            }
+            results.append(row)
+            stdout.write(
+                f"leaderboard {path:<12} {size:>9,} medicines  "
+                + (f"{run.groups:>7,} groups  {run.entries:>7,} rows  " if run else f"{'(extrapolated)':>29}  ")
+                + f"{row['seconds']:>9.3f} s"
+            )
+    return results
+
+
+def bench_price_snapshot(options, stdout, instances=200_000):
+    """
+    The in-process price snapshot: build time, memory per million prices
+    next to the same prices as Django Price instances (measured on up to
+    200k and scaled), and comparison and alternatives latency answered from
+    it versus from the database
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        with rolled_back():
+            seed_catalogue(size, seed=options['seed'])
+            rng = random.Random(options['seed'] + 7)
+            medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+            queries = [rng.choice(medicine_ids) for _ in range(options['queries'])]
+
+            started = time.perf_counter()
+            snapshot.PriceSnapshot.build()
+            build_seconds = time.perf_counter() - started
+            tracemalloc.start()
+            built = snapshot.PriceSnapshot.build()
+            snapshot_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del built
+
+            tracemalloc.start()
+            loaded = list(Price.objects.select_related('pharmacy')[:instances])
+            instance_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            prices = Price.objects.count()
+            per_million = {
+                'snapshot': snapshot_bytes * 1_000_000 / max(1, prices),
+                'instances': instance_bytes * 1_000_000 / max(1, len(loaded)),
+            }
+            del loaded
+
+            timings = {}
+            for source in ('database', 'snapshot'):
+                with override_settings(PRICE_SNAPSHOT=source == 'snapshot', PRICE_SNAPSHOT_MAX_AGE=3600):
+                    if source == 'snapshot':
+                        snapshot.refresh()
+                    for name, func in (
+                        ('comparison', PriceComparisonService.get_price_comparison),
+                        ('alternatives', AlternativeFinderService.find_alternatives),
+                    ):
+                        timings[source, name] = summarize(time_calls(func, queries))
+            snapshot.reset()
+
+        row = {
+            'benchmark': 'price_snapshot', 'path': 'build', 'medicines': size, 'prices': prices,
+            'seconds': round(build_seconds, 3),
+            'snapshot_mb_per_million_prices': round(per_million['snapshot'] / 2 ** 20, 1),
+            'instances_mb_per_million_prices': round(per_million['instances'] / 2 ** 20, 1),
+        }
+        results.append(row)
+        stdout.write(
+            f"price_snapshot build      {prices:>10,} prices  {row['seconds']:>8.3f} s  "
+            f"{row['snapshot_mb_per_million_prices']:>7.1f} MB per 1M prices "
+            f"(Price instances {row['instances_mb_per_million_prices']:,.1f} MB)"
+        )
+        for (source, name), stats in timings.items():
+            row = {'benchmark': 'price_snapshot', 'path': f'{name}.{source}', 'medicines': size, **stats}
+            results.append(row)
+            stdout.write(
+                f"price_snapshot {name:<12} {source:<8} {size:>9,} medicines  "
+                f"p50 {row['p50_ms']:>8.3f} ms  p99 {row['p99_ms']:>8.3f} ms"
+            )
+    return results
+
+
+def _mapped_memory_kib():
+    """
+    (anonymous, resident) memory of this process in KiB, from
+    /proc/self/smaps_rollup
+    """
+    fields = {}
+    with open('/proc/self/smaps_rollup') as rollup:
+        for line in rollup:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0])
+    return fields['Anonymous'], fields['Rss']
+
+
+def _map_in_worker(path):
+    """
+    Fork a process that maps the snapshot file and reads every column, the
+    way a worker answering lookups eventually does
+    Returns: (anonymous KiB, resident KiB) that the worker added by it
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_end)
+            anonymous, resident = _mapped_memory_kib()
+            mapped = snapshot.PriceSnapshot.open(path)
+            for _, _, buffer in mapped._buffers():
+                hashlib.sha1(buffer).digest()
+            after = _mapped_memory_kib()
+            os.write(write_end, f'{after[0] - anonymous} {after[1] - resident}'.encode())
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        report = pipe.read()
+    os.waitpid(pid, 0)
+    anonymous, resident = report.split()
+    return int(anonymous), int(resident)
+
+
+def bench_snapshot_file(options, stdout, workers=4):
+    """
+    The exported snapshot file: export time and size, the time to map it,
+    the memory each forked worker adds by mapping and reading all of it
+    (anonymous memory is the worker's own; the rest is page cache shared by
+    all of them) and comparison and search latency answered from it
+    """
+    if not Path('/proc/self/smaps_rollup').exists() or not hasattr(os, 'fork'):
+        stdout.write('snapshot_file needs Linux (/proc/self/smaps_rollup and fork)')
+        return []
+    results = []
+    for size in sorted(options['sizes']):
+        with rolled_back(), tempfile.TemporaryDirectory() as directory:
+            seed_catalogue(size, seed=options['seed'])
+            path = str(Path(directory) / 'prices.snapshot')
+            rng = random.Random(options['seed'] + 11)
+            medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+            queries = [rng.choice(medicine_ids) for _ in range(options['queries'])]
+            terms = search_terms(options['queries'], rng)
+
+            started = time.perf_counter()
+            exported = snapshot.export(path)
+            export_seconds = time.perf_counter() - started
+            map_ms = summarize(time_calls(lambda _: snapshot.PriceSnapshot.open(path), range(20)))['p50_ms']
+            per_worker = [_map_in_worker(path) for _ in range(workers)]
+
+            timings = {}
+            for source in ('database', 'file'):
+                with override_settings(PRICE_SNAPSHOT=source == 'file', PRICE_SNAPSHOT_FILE=path):
+                    for name, func in (
+                        ('comparison', PriceComparisonService.get_price_comparison),
+                        ('search', lambda term: MedicineSearchService.search_page(
+                            term, select_related=('price_summary',))),
+                    ):
+                        timings[source, name] = summarize(time_calls(func, queries if name == 'comparison' else terms))
+            snapshot.reset()
+
+        row = {
+            'benchmark': 'snapshot_file', 'path': 'export', 'medicines': size, 'prices': len(exported),
+            'seconds': round(export_seconds, 3), 'file_mb': round(exported.nbytes() / 2 ** 20, 1),
+            'map_ms': map_ms, 'workers': workers,
+            'worker_anonymous_kib': max(anonymous for anonymous, _ in per_worker),
+            'worker_resident_kib': max(resident for _, resident in per_worker),
+        }
+        results.append(row)
+        stdout.write(
+            f"snapshot_file export    {row['prices']:>10,} prices  {row['seconds']:>8.3f} s  "
+            f"{row['file_mb']:>7.1f} MB file, mapped in {map_ms:.3f} ms; per worker "
+            f"{row['worker_anonymous_kib']:,} KiB own + {row['worker_resident_kib']:,} KiB resident (shared)"
+        )
+        for (source, name), stats in timings.items():
+            row = {'benchmark': 'snapshot_file', 'path': f'{name}.{source}', 'medicines': size, **stats}
+            results.append(row)
+            stdout.write(
+                f"snapshot_file {name:<12} {source:<8} {size:>9,} medicines  "
+                f"p50 {row['p50_ms']:>8.3f} ms  p99 {row['p99_ms']:>8.3f} ms"
+            )
+    return results
+
+
+def bench_hot_paths(options, stdout):
+    """
+    The search, price comparison and alternatives services, and the home,
+    search and results views through the test client, on a clustered
+    catalogue of each size (about ten prices per medicine). The results view
+    is measured with an empty and with a warm results cache, and as a
+    revalidation by a client that already has the page (304).
+    """
+    results = []
+    client = Client()
+    results_cache = caches[getattr(settings, 'RESULTS_CACHE_ALIAS', 'default')]
+    etags = {}
+
+    def get(path, status=200, **headers):
+        response = client.get(path, **headers)
+        if response.status_code != status:
+            raise AssertionError(f'GET {path} returned {response.status_code}')
+        return response
+
+    def revalidate(medicine_id):
+        get(reverse('results', args=[medicine_id]), 304, HTTP_IF_NONE_MATCH=etags[medicine_id])
+
+    def fetch_etags(ids):
+        for medicine_id in ids:
+            etags[medicine_id] = get(reverse('results', args=[medicine_id]))['ETag']
+
+    for size in sorted(options['sizes']):
+        with rolled_back(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            started = time.perf_counter()
+            seed_catalogue(size, seed=options['seed'])
+            seed_seconds = round(time.perf_counter() - started, 1)
+
+            rng = random.Random(options['seed'] + 2)
+            terms = search_terms(options['queries'], rng)
+            medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+            ids = rng.sample(medicine_ids, min(options['queries'], len(medicine_ids)))
+            paths = [
+                ('service.search', lambda q: list(MedicineSearchService.search_medicines(q)), terms, None),
+                ('service.price_comparison', PriceComparisonService.get_price_comparison, ids, None),
+                ('service.alternatives', AlternativeFinderService.find_alternatives, ids, None),
+                ('view.home', lambda _: get(reverse('home')), range(options['queries']), None),
+                ('view.search', lambda q: get(f"{reverse('search')}?{urlencode({'q': q})}"), terms, None),
+                ('view.results.cold', lambda i: get(reverse('results', args=[i])), ids, results_cache.clear),
+                ('view.results.warm', lambda i: get(reverse('results', args=[i])), ids, None),
+                ('view.results.304', revalidate, ids, lambda: fetch_etags(ids)),
+            ]
+            for name, func, arguments, before in paths:
+                row = {'benchmark': 'hot_paths', 'path': name, 'medicines': size, 'seed_s': seed_seconds}
+                row.update(measure(func, arguments, before))
+                results.append(row)
+                stdout.write(
+                    f"{name:<26} {size:>9,} medicines  p50 {row['p50_ms']:>8.3f} ms  "
+                    f"p99 {row['p99_ms']:>8.3f} ms  {row['queries_mean']:>5.1f} queries  "
+                    f"peak {row['peak_kib_max']:>8.1f} KiB"
+                )
+    return results
+
+
+def bench_profiling(options, stdout):
+    """
+    Cost of the request profiling middleware: the search and results views
+    with REQUEST_PROFILING on and off, plus the profiler's own accounting of
+    its overhead
+    """
+    results = []
+    for size in sorted(options['sizes']):
+        with rolled_back(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            seed_catalogue(size, seed=options['seed'])
+            rng = random.Random(options['seed'] + 3)
+            terms = search_terms(options['queries'], rng)
+            medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+            ids = rng.sample(medicine_ids, min(options['queries'], len(medicine_ids)))
+            # Untimed pass so both runs see a warm database page cache
+            warmup = Client()
+            for term in terms:
+                warmup.get(reverse('search'), {'q': term})
+            for medicine_id in ids:
+                warmup.get(reverse('results', args=[medicine_id]))
+            for enabled in (False, True):
+                with override_settings(REQUEST_PROFILING=enabled):
+                    client = Client()
+                    client.get(reverse('home'))
+                overheads = []
+
+                def get(path):
+                    response = client.get(path)
+                    timing = response.get('Server-Timing', '')
+                    if 'prof;dur=' in timing:
+                        overheads.append(float(timing.rsplit('prof;dur=', 1)[1]))
+
+                paths = [
+                    ('view.search', lambda q: get(f"{reverse('search')}?{urlencode({'q': q})}"), terms),
+                    ('view.results', lambda i: get(reverse('results', args=[i])), ids),
+                ]
+                for name, func, arguments in paths:
+                    overheads.clear()
+                    caches[getattr(settings, 'RESULTS_CACHE_ALIAS', 'default')].clear()
+                    row = {
+                        'benchmark': 'profiling', 'path': name, 'medicines': size, 'profiling': enabled,
+                    }
+                    row.update(summarize(time_calls(func, arguments)))
+                    row['self_reported_overhead_ms'] = round(statistics.fmean(overheads), 4) if overheads else 0.0
+                    results.append(row)
+                    stdout.write(
+                        f"{name:<13} profiling {'on ' if enabled else 'off'} {size:>9,} medicines  "
+                        f"p50 {row['p50_ms']:>8.3f} ms  p99 {row['p99_ms']:>8.3f} ms  "
+                        f"self-reported {row['self_reported_overhead_ms']:.4f} ms"
+                    )
+    return results
+
+
+BENCHMARKS = {
+    'alerts': bench_alerts,
+    'autocomplete': bench_autocomplete,
+    'basket': bench_basket,
+    'concurrency': bench_concurrency,
+    'hot_paths': bench_hot_paths,
+    'import_workers': bench_import_workers,
+    'leaderboard': bench_leaderboard,
+    'price_snapshot': bench_price_snapshot,
+    'price_sync': bench_price_sync,
+    'profiling': bench_profiling,
+    'search': bench_search,
+    'search_pages': bench_search_pages,
+    'snapshot_file': bench_snapshot_file,
+}
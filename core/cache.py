@@ -0,0 +1,355 @@
+"""
+Versioned cache for the results page.
+
+Price comparisons and alternatives are cached per medicine and stamped with
+the version counter of the medicine's canonical composition (its
+``composition_key``) at the time they were computed. Price and Medicine saves/deletes bump that counter (see signals),
+so an entry goes stale exactly when one of its inputs changes instead of
+on a TTL. The same counters key the pages' cached template fragments
+(fragment_context) and their ETags (see core.conditional). Works with any
+Django cache backend, including locmem and file-based caches.
+"""
+import threading
+import time
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import routers
+from . import snapshot as price_snapshot
+from .models import CompositionSavings, GenericBenefit, Medicine
+from .services import AlternativeFinderService, PriceComparisonService, SavingsLeaderboardService
+
+BENEFITS_VERSION_KEY = 'medcompare:generic-benefits:version'
+LEADERBOARD_VERSION_KEY = 'medcompare:savings-leaderboard:version'
+AUTOCOMPLETE_VERSION_KEY = 'medcompare:autocomplete:version'
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'RESULTS_CACHE_ALIAS', 'default')]
+
+
+def _timeout() -> int:
+    return getattr(settings, 'RESULTS_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _count(outcome: str):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def stats() -> dict:
+    """
+    Process-local hit/miss counters
+    Returns: {'hits': int, 'misses': int, 'hit_ratio': float}
+    """
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 4) if total else 0.0}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats['hits'] = _stats['misses'] = 0
+
+
+def composition_version_key(composition_key: Optional[int]) -> str:
+    return f'medcompare:composition:{composition_key}:version'
+
+
+def _current_version(key: str) -> int:
+    """
+    Read a version counter, starting a new one if it was never set or evicted.
+    New counters start from the clock so they never repeat an old value.
+    """
+    cache = _cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def composition_versions(composition_keys: Iterable[Optional[int]]) -> dict:
+    """
+    Current version counters of several compositions in one cache round trip
+    Returns: {composition key: version}
+    """
+    keys = {composition_version_key(composition_key): composition_key for composition_key in composition_keys}
+    found = _cache().get_many(list(keys))
+    return {
+        composition_key: found[key] if key in found else _current_version(key)
+        for key, composition_key in keys.items()
+    }
+
+
+def _bump(key: str) -> int:
+    cache = _cache()
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, timeout=None)
+    if routers.replicas():
+        # Replicas may not have the change yet for this long, see _fill_reads
+        cache.set(f'{key}:changed', True, getattr(settings, 'REPLICA_STICKY_SECONDS', 10))
+    return version
+
+
+def _fill_reads(version_key: str):
+    """
+    Where to read a value that will be cached under the counter
+    ``version_key``: wherever the request's reads go, unless the counter was
+    bumped within REPLICA_STICKY_SECONDS (the lag replicas are allowed), when
+    a replica might not have the change yet and its data would be cached
+    as current, so the primary
+    """
+    if routers.replicas() and _cache().get(f'{version_key}:changed') is not None:
+        return routers.primary_reads()
+    return nullcontext()
+
+
+def _bump_now_and_on_commit(key: str, using: str):
+    # The immediate bump covers readers in this transaction; the one on
+    # commit discards anything another process cached from pre-commit data
+    _bump(key)
+    transaction.on_commit(lambda: _bump(key), using=using)
+
+
+def benefits_version() -> int:
+    return _current_version(BENEFITS_VERSION_KEY)
+
+
+def fragment_context(composition_keys: Iterable[Optional[int]] = ()) -> dict:
+    """
+    Template context for the ``{% cache %}`` fragments of the pages: the
+    cache and timeout to use plus the version counters of the generic
+    benefits and of ``composition_keys``, so fragments are keyed to the
+    data they render and go stale with it
+    Returns: {'cache', 'timeout', 'benefits', 'compositions'}
+    """
+    versions = composition_versions(composition_keys)
+    return {
+        'cache': getattr(settings, 'RESULTS_CACHE_ALIAS', 'default'),
+        'timeout': _timeout(),
+        'benefits': benefits_version(),
+        'compositions': '.'.join(str(versions[key]) for key in sorted(versions, key=str)),
+    }
+
+
+def invalidate_composition(composition_key: Optional[int], using: str = 'default'):
+    _bump_now_and_on_commit(composition_version_key(composition_key), using)
+
+
+def invalidate_medicines(medicine_ids: Iterable[int], using: str = 'default', chunk_size: int = 2000):
+    """
+    Invalidate the compositions of many medicines at once, for bulk writes
+    that bypass model signals
+    """
+    ids = list(medicine_ids)
+    composition_keys = set()
+    for start in range(0, len(ids), chunk_size):
+        composition_keys.update(
+            Medicine.objects.using(using).filter(pk__in=ids[start:start + chunk_size])
+            .values_list('composition_key', flat=True).distinct()
+        )
+    for composition_key in composition_keys:
+        invalidate_composition(composition_key, using=using)
+
+
+def invalidate_generic_benefits(using: str = 'default'):
+    _bump_now_and_on_commit(BENEFITS_VERSION_KEY, using)
+
+
+def savings_leaderboard_version() -> int:
+    return _current_version(LEADERBOARD_VERSION_KEY)
+
+
+def invalidate_savings_leaderboard(using: str = 'default'):
+    _bump_now_and_on_commit(LEADERBOARD_VERSION_KEY, using)
+
+
+def autocomplete_version() -> int:
+    return _current_version(AUTOCOMPLETE_VERSION_KEY)
+
+
+def bump_autocomplete_version() -> int:
+    """
+    Bump the autocomplete version counter now, for a committed change
+    Returns: the new version
+    """
+    return _bump(AUTOCOMPLETE_VERSION_KEY)
+
+
+def invalidate_autocomplete(using: str = 'default'):
+    """
+    Have every worker rebuild its typeahead index (see core.autocomplete),
+    for medicine writes made elsewhere or that bypass model signals
+    """
+    _bump_now_and_on_commit(AUTOCOMPLETE_VERSION_KEY, using)
+
+
+def _medicine_key(namespace: str, medicine_id: int) -> str:
+    return f'medcompare:{namespace}:{medicine_id}'
+
+
+def medicine_composition_key(medicine_id: int) -> Optional[int]:
+    """
+    A medicine's composition key, from the price snapshot when it can vouch
+    for it, else in one query
+    Raises: Medicine.DoesNotExist
+    """
+    snapshot = price_snapshot.current()
+    composition_key = snapshot.composition_key(medicine_id) if snapshot is not None else None
+    if composition_key is None:
+        composition_key = Medicine.objects.values_list('composition_key', flat=True).get(id=medicine_id)
+    return composition_key
+
+
+KeyLookup = Optional[Callable[[], Optional[int]]]
+
+
+def _cached_for_medicine(namespace: str, medicine_id: int, compute: Callable[[int], object],
+                         lookup_key: KeyLookup = None):
+    """
+    ``compute(medicine_id)``, cached under the version of the medicine's
+    composition. On a miss the composition key comes from ``lookup_key()``
+    when given (e.g. memoized per request, see core.conditional), else from
+    medicine_composition_key().
+    """
+    cache = _cache()
+    key = _medicine_key(namespace, medicine_id)
+    entry = cache.get(key)
+    if entry is not None and cache.get(composition_version_key(entry.get('composition_key'))) == entry['version']:
+        _count('hits')
+        return entry['value']
+
+    _count('misses')
+    composition_key = lookup_key() if lookup_key else medicine_composition_key(medicine_id)
+    # Read the version before computing so a concurrent change makes the
+    # stored entry stale rather than silently current
+    version = _current_version(composition_version_key(composition_key))
+    with _fill_reads(composition_version_key(composition_key)):
+        value = compute(medicine_id)
+    cache.set(key, {'composition_key': composition_key, 'version': version, 'value': value}, _timeout())
+    return value
+
+
+async def _acached_for_medicine(namespace: str, medicine_id: int, acompute: Callable[[int], Awaitable],
+                                lookup_key: KeyLookup = None):
+    """
+    Async version of _cached_for_medicine
+    """
+    cache = _cache()
+    key = _medicine_key(namespace, medicine_id)
+    entry = await cache.aget(key)
+    if entry is not None and await cache.aget(composition_version_key(entry.get('composition_key'))) == entry['version']:
+        _count('hits')
+        return entry['value']
+
+    _count('misses')
+    composition_key = await sync_to_async(lookup_key or (lambda: medicine_composition_key(medicine_id)))()
+    version = await sync_to_async(_current_version)(composition_version_key(composition_key))
+    with await sync_to_async(_fill_reads)(composition_version_key(composition_key)):
+        value = await acompute(medicine_id)
+    await cache.aset(key, {'composition_key': composition_key, 'version': version, 'value': value}, _timeout())
+    return value
+
+
+def get_price_comparison(medicine_id: int, lookup_key: KeyLookup = None) -> dict:
+    """
+    Cached PriceComparisonService.get_price_comparison
+    """
+    return _cached_for_medicine('comparison', medicine_id, PriceComparisonService.get_price_comparison, lookup_key)
+
+
+async def aget_price_comparison(medicine_id: int, lookup_key: KeyLookup = None) -> dict:
+    return await _acached_for_medicine(
+        'comparison', medicine_id, PriceComparisonService.aget_price_comparison, lookup_key
+    )
+
+
+def find_alternatives(medicine_id: int, lookup_key: KeyLookup = None) -> List[dict]:
+    """
+    Cached AlternativeFinderService.find_alternatives
+    """
+    return _cached_for_medicine('alternatives', medicine_id, AlternativeFinderService.find_alternatives, lookup_key)
+
+
+async def afind_alternatives(medicine_id: int, lookup_key: KeyLookup = None) -> List[dict]:
+    return await _acached_for_medicine(
+        'alternatives', medicine_id, AlternativeFinderService.afind_alternatives, lookup_key
+    )
+
+
+def get_page_freshness(medicine_id: int, compute: Callable[[int], object], lookup_key: KeyLookup = None):
+    """
+    A medicine's page validators (see core.conditional), cached and
+    invalidated like its comparison
+    Raises: Medicine.DoesNotExist
+    """
+    return _cached_for_medicine('freshness', medicine_id, compute, lookup_key)
+
+
+def get_generic_benefits() -> List[GenericBenefit]:
+    """
+    Active generic benefits, cached until a benefit is saved or deleted
+    """
+    cache = _cache()
+    entry: Optional[dict] = cache.get('medcompare:generic-benefits')
+    if entry is not None and cache.get(BENEFITS_VERSION_KEY) == entry['version']:
+        _count('hits')
+        return entry['value']
+
+    _count('misses')
+    version = benefits_version()
+    with _fill_reads(BENEFITS_VERSION_KEY):
+        value = list(GenericBenefit.objects.filter(is_active=True))
+    cache.set('medcompare:generic-benefits', {'version': version, 'value': value}, _timeout())
+    return value
+
+
+async def aget_generic_benefits() -> List[GenericBenefit]:
+    cache = _cache()
+    entry: Optional[dict] = await cache.aget('medcompare:generic-benefits')
+    if entry is not None and await cache.aget(BENEFITS_VERSION_KEY) == entry['version']:
+        _count('hits')
+        return entry['value']
+
+    _count('misses')
+    version = await sync_to_async(_current_version)(BENEFITS_VERSION_KEY)
+    with await sync_to_async(_fill_reads)(BENEFITS_VERSION_KEY):
+        value = [benefit async for benefit in GenericBenefit.objects.filter(is_active=True)]
+    await cache.aset('medcompare:generic-benefits', {'version': version, 'value': value}, _timeout())
+    return value
+
+
+def get_savings_leaderboard(order: str = 'amount') -> List[CompositionSavings]:
+    """
+    SavingsLeaderboardService.top(order), cached until the next refresh
+    invalidates it
+    Raises: ValueError for an unknown order
+    """
+    if order not in SavingsLeaderboardService.ORDERS:
+        raise ValueError(f'Unknown savings order: {order!r}')
+    cache = _cache()
+    key = f'medcompare:savings-leaderboard:{order}'
+    entry: Optional[dict] = cache.get(key)
+    if entry is not None and cache.get(LEADERBOARD_VERSION_KEY) == entry['version']:
+        _count('hits')
+        return entry['value']
+
+    _count('misses')
+    version = savings_leaderboard_version()
+    with _fill_reads(LEADERBOARD_VERSION_KEY):
+        value = SavingsLeaderboardService.top(order)
+    cache.set(key, {'version': version, 'value': value}, _timeout())
+    return value
@@ -0,0 +1,216 @@
+"""
+Canonical compositions: parsing free-text composition strings such as
+"Amoxycillin 500 mg + Clavulanate Potassium 125mg" into salts and numeric
+strengths, so that different spellings of the same drug share one key.
+
+Salt names are lower-cased, stripped of salt-form suffixes ("hydrochloride",
+"sodium", ...) and mapped through SALT_SYNONYMS; strengths are converted to
+milligrams where the unit is a mass. The canonical form lists ingredients in
+name order, and its 64-bit hash is the composition key stored on Medicine.
+"""
+import hashlib
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.db import transaction
+
+SALT_SYNONYMS = {
+    'acetaminophen': 'paracetamol',
+    'albuterol': 'salbutamol',
+    'amoxycillin': 'amoxicillin',
+    'cephalexin': 'cefalexin',
+    'clavulanate': 'clavulanic acid',
+    'frusemide': 'furosemide',
+    'glibenclamide': 'glyburide',
+    'lignocaine': 'lidocaine',
+    'rifampin': 'rifampicin',
+}
+# Trailing words naming the salt form rather than the active moiety
+SALT_FORMS = {
+    'besilate', 'besylate', 'calcium', 'dihydrate', 'hcl', 'hydrochloride', 'magnesium',
+    'maleate', 'monohydrate', 'potassium', 'sodium', 'succinate', 'sulfate', 'sulphate',
+    'tartrate', 'trihydrate',
+}
+# Multipliers to milligrams; other units are kept as written
+MASS_UNITS = {'g': Decimal(1000), 'gm': Decimal(1000), 'mg': Decimal(1), 'mcg': Decimal('0.001'),
+              'ug': Decimal('0.001'), 'µg': Decimal('0.001')}
+
+_SEPARATORS = re.compile(r'\s*(?:\+|,|;|&|\band\b)\s*', re.IGNORECASE)
+_STRENGTH = re.compile(
+    r'\(?\s*(?P<value>\d+(?:\.\d+)?)\s*(?P<unit>mcg|µg|ug|mg|gm|g|iu|ml|%)?'
+    r'(?:\s*/\s*(?P<per>\d*(?:\.\d+)?)\s*(?P<per_unit>ml|g|tab|tablet|dose))?\s*\)?\s*$',
+    re.IGNORECASE,
+)
+_NAME_JUNK = re.compile(r'[^\w\s-]+')
+
+
+class Ingredient(NamedTuple):
+    name: str
+    strength: Optional[Decimal]
+    unit: str
+
+    def __str__(self):
+        if self.strength is None:
+            return self.name
+        return f'{self.name} {format(self.strength, "f")}{self.unit}'
+
+
+def canonical_salt(name: str) -> str:
+    words = _NAME_JUNK.sub(' ', name.lower()).split()
+    while len(words) > 1 and words[-1] in SALT_FORMS:
+        words.pop()
+    salt = ' '.join(words)
+    return SALT_SYNONYMS.get(salt, salt)
+
+
+def _strength(match) -> Tuple[Optional[Decimal], str]:
+    try:
+        value = Decimal(match['value'])
+    except InvalidOperation:
+        return None, ''
+    unit = (match['unit'] or 'mg').lower()
+    if unit in MASS_UNITS:
+        value, unit = value * MASS_UNITS[unit], 'mg'
+    if match['per_unit']:
+        per = Decimal(match['per']) if match['per'] else Decimal(1)
+        if per:
+            value /= per
+        unit = f"{unit}/{match['per_unit'].lower()}"
+    return value.normalize(), unit
+
+
+def parse(composition: str, strength: str = '') -> List[Ingredient]:
+    """
+    Ingredients of a composition string in canonical name order. A lone
+    ingredient without a strength takes the medicine's ``strength``.
+    """
+    ingredients = {}
+    for part in filter(None, _SEPARATORS.split(composition.strip())):
+        match = _STRENGTH.search(part)
+        name = part[:match.start()] if match else part
+        value, unit = _strength(match) if match else (None, '')
+        salt = canonical_salt(name)
+        if salt:
+            ingredients[salt] = Ingredient(salt, value, unit)
+    if len(ingredients) == 1 and strength:
+        (only,) = ingredients.values()
+        match = _STRENGTH.search(strength.strip())
+        if only.strength is None and match:
+            ingredients[only.name] = Ingredient(only.name, *_strength(match))
+    return [ingredients[name] for name in sorted(ingredients)]
+
+
+def canonical(composition: str, strength: str = '') -> str:
+    """
+    "amoxicillin 500mg + clavulanic acid 125mg" style canonical form,
+    falling back to the lower-cased string when nothing can be parsed
+    """
+    ingredients = parse(composition, strength)
+    if not ingredients:
+        return ' '.join(composition.lower().split())
+    return ' + '.join(str(ingredient) for ingredient in ingredients)
+
+
+def key_of(canonical_form: str) -> int:
+    """
+    Signed 64-bit hash of a canonical form, to fit a BigIntegerField
+    """
+    digest = hashlib.blake2b(canonical_form.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def composition_key(composition: str, strength: str = '') -> int:
+    return key_of(canonical(composition, strength))
+
+
+def display_name(canonical_form: str) -> str:
+    return ' + '.join(part[:1].upper() + part[1:] for part in canonical_form.split(' + '))
+
+
+def register(pairs: Iterable[tuple], using: str = 'default') -> Dict[tuple, int]:
+    """
+    Make sure Composition, Ingredient and CompositionIngredient rows exist for
+    (composition, strength) string pairs, with a handful of bulk statements
+    Returns: {(composition, strength): composition key}
+    """
+    from .models import Composition, CompositionIngredient, Ingredient as IngredientModel
+
+    keys, parsed = {}, {}
+    for pair in set(pairs):
+        form = canonical(*pair)
+        keys[pair] = key = key_of(form)
+        parsed[key] = (form, parse(*pair))
+    if not parsed:
+        return keys
+
+    existing = set(Composition.objects.using(using).filter(key__in=list(parsed)).values_list('key', flat=True))
+    new = {key: value for key, value in parsed.items() if key not in existing}
+    if not new:
+        return keys
+
+    with transaction.atomic(using=using):
+        names = {ingredient.name for _, ingredients in new.values() for ingredient in ingredients}
+        IngredientModel.objects.using(using).bulk_create(
+            [IngredientModel(name=name) for name in sorted(names)], ignore_conflicts=True, batch_size=500
+        )
+        ingredient_ids = dict(
+            IngredientModel.objects.using(using).filter(name__in=names).values_list('name', 'id')
+        ) if names else {}
+        Composition.objects.using(using).bulk_create(
+            [Composition(key=key, canonical=form, name=display_name(form)) for key, (form, _) in new.items()],
+            ignore_conflicts=True, batch_size=500,
+        )
+        CompositionIngredient.objects.using(using).bulk_create(
+            [
+                CompositionIngredient(
+                    composition_id=key, ingredient_id=ingredient_ids[ingredient.name],
+                    strength=ingredient.strength, unit=ingredient.unit,
+                )
+                for key, (_, ingredients) in new.items() for ingredient in ingredients
+            ],
+            ignore_conflicts=True, batch_size=500,
+        )
+    return keys
+
+
+def backfill(using: str = 'default', batch_size: int = 2000, stdout=None) -> dict:
+    """
+    Parse every distinct composition string in the catalogue, register the
+    canonical compositions and set Medicine.composition_key, one UPDATE per
+    distinct (composition, strength) pair, then rebuild the alternative
+    groups of every composition that lost or gained medicines
+    Returns: {'strings', 'compositions', 'medicines'}
+    """
+    from . import cache
+    from .models import Medicine
+    from .services import AlternativeGroupService
+
+    pairs = list(
+        Medicine.objects.using(using).order_by().values_list('composition', 'strength').distinct()
+    )
+    updated = 0
+    compositions = set()
+    rekeyed = set()
+    with transaction.atomic(using=using):
+        for start in range(0, len(pairs), batch_size):
+            keys = register(pairs[start:start + batch_size], using=using)
+            for (composition, strength), key in keys.items():
+                compositions.add(key)
+                stale = Medicine.objects.using(using).filter(
+                    composition=composition, strength=strength
+                ).exclude(composition_key=key)
+                # Both the old and the new composition change their alternatives
+                previous = set(stale.values_list('composition_key', flat=True).distinct())
+                if not previous:
+                    continue
+                updated += stale.update(composition_key=key)
+                rekeyed |= previous | {key}
+                for changed in previous | {key}:
+                    cache.invalidate_composition(changed, using=using)
+            if stdout is not None:
+                stdout.write(f'Parsed {min(start + batch_size, len(pairs)):,} of {len(pairs):,} compositions')
+        # The updates skip the signals that keep the groups in step; rebuilt
+        # groups also get a new updated_at for the leaderboard's refresh
+        AlternativeGroupService.rebuild(rekeyed, using=using)
+    return {'strings': len(pairs), 'compositions': len(compositions), 'medicines': updated}
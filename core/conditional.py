@@ -0,0 +1,150 @@
+"""
+Conditional GET for the JSON API and the HTML pages.
+
+A response's freshness is derived from what it is built from: the price
+summaries of its medicines (which follow Price.last_updated, and deletes)
+give the Last-Modified, and the ETag also covers the results cache version
+of every composition involved, so edits to medicines are picked up too.
+Both come from a single query plus cache reads (the results page caches
+even that per medicine, see ``core.cache.get_page_freshness``), so a request
+answered with 304 Not Modified never runs the view's services.
+"""
+import hashlib
+from calendar import timegm
+from functools import lru_cache, wraps
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max, QuerySet
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import cache as results_cache
+
+Freshness = Optional[Tuple[str, object]]
+
+
+@lru_cache(maxsize=None)
+def templates_stamp() -> str:
+    """
+    Digest of the project templates' modification times, so a deploy that
+    changes a page's markup changes its ETag too
+    """
+    files = sorted(
+        (str(path), path.stat().st_mtime_ns)
+        for directory in settings.TEMPLATES[0]['DIRS'] for path in Path(directory).rglob('*.html')
+    )
+    return hashlib.sha1(repr(files).encode('utf-8')).hexdigest()[:12]
+
+
+def medicines_freshness(medicines: QuerySet, extra: Iterable = ()) -> Freshness:
+    """
+    (ETag, Last-Modified) of anything built from ``medicines`` and the
+    ``extra`` version values, in one query
+    Returns: None if ``medicines`` is empty
+    """
+    rows = list(
+        medicines.order_by().values('composition_key').annotate(
+            last_changed=Max('price_summary__last_changed'),
+            priced=Count('price_summary'),
+            medicines=Count('pk'),
+        )
+    )
+    if not rows:
+        return None
+    versions = results_cache.composition_versions(row['composition_key'] for row in rows)
+    state = sorted(
+        (row['composition_key'] or 0, versions[row['composition_key']], row['medicines'], row['priced'],
+         row['last_changed'].isoformat() if row['last_changed'] else '')
+        for row in rows
+    )
+    changed = [row['last_changed'] for row in rows if row['last_changed']]
+    return (
+        hashlib.sha1(repr((state, tuple(extra))).encode('utf-8')).hexdigest(),
+        max(changed) if changed else None,
+    )
+
+
+def freshness(request, medicines: QuerySet, extra: Iterable = ()) -> Freshness:
+    """
+    medicines_freshness() for the response to ``request``, memoized on the
+    request since the condition decorator asks for each validator separately
+    """
+    if not hasattr(request, '_freshness'):
+        request._freshness = medicines_freshness(medicines, (request.get_full_path(), *extra))
+    return request._freshness
+
+
+def composition_key(request, medicine_id: int) -> Optional[int]:
+    """
+    results_cache.medicine_composition_key() memoized on the request, whose
+    validators and cached lookups all need it on a cold cache
+    Raises: Medicine.DoesNotExist
+    """
+    if not hasattr(request, '_composition_keys'):
+        request._composition_keys = {}
+    if medicine_id not in request._composition_keys:
+        request._composition_keys[medicine_id] = results_cache.medicine_composition_key(medicine_id)
+    return request._composition_keys[medicine_id]
+
+
+def etag_func(freshness_func):
+    def etag(request, *args, **kwargs):
+        found = freshness_func(request, *args, **kwargs)
+        return found[0] if found else None
+    return etag
+
+
+def last_modified_func(freshness_func):
+    def last_modified(request, *args, **kwargs):
+        found = freshness_func(request, *args, **kwargs)
+        return found[1] if found else None
+    return last_modified
+
+
+def conditional_page(freshness_func):
+    """
+    django.views.decorators.http.condition for HTML pages, with one
+    freshness function giving both validators; works on sync and async
+    views. Pages are marked ``Cache-Control: no-cache`` so browsers keep
+    them but revalidate on every visit, which is what the 304s answer.
+    """
+    def validators(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None, None
+        found = freshness_func(request, *args, **kwargs)
+        if not found:
+            return None, None
+        etag, last_modified = found
+        return quote_etag(etag), timegm(last_modified.utctimetuple()) if last_modified else None
+
+    def finish(request, response, etag, last_modified):
+        if etag:
+            response.headers.setdefault('ETag', etag)
+        if last_modified and not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(last_modified)
+        if etag or last_modified:
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                etag, last_modified = await sync_to_async(validators)(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return finish(request, response, etag, last_modified)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                etag, last_modified = validators(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return finish(request, response, etag, last_modified)
+        return wrapper
+    return decorator
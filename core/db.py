@@ -0,0 +1,60 @@
+"""
+SQLite connection tuning.
+
+Every database alias may carry a ``PRAGMAS`` dict in its DATABASES entry
+(see the profiles in medcompare/settings.py); they are applied to each new
+SQLite connection as it is created. Connections are long-lived under the
+production profile (CONN_MAX_AGE), so the cost is paid once per
+connection rather than per request.
+"""
+import re
+from typing import Dict
+
+from django.db.backends.signals import connection_created
+
+_NAME = re.compile(r'^[a-z_]+$')
+_VALUE = re.compile(r'^(-?\d+|[A-Za-z]+)$')
+
+
+def pragma_statements(pragmas: Dict[str, object]) -> list:
+    """
+    ``PRAGMA name = value`` statements, refusing anything that is not a
+    plain name and an integer or keyword value
+    Raises: ValueError
+    """
+    statements = []
+    for name, value in pragmas.items():
+        if not _NAME.match(name) or not _VALUE.match(str(value)):
+            raise ValueError(f'Invalid SQLite pragma {name!r} = {value!r}')
+        statements.append(f'PRAGMA {name} = {value}')
+    return statements
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    statements = pragma_statements(connection.settings_dict.get('PRAGMAS') or {})
+    if not statements:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def current_pragmas(connection, names) -> Dict[str, object]:
+    """
+    The connection's current value of each pragma in ``names``
+    """
+    values = {}
+    with connection.cursor() as cursor:
+        for name in names:
+            if not _NAME.match(name):
+                raise ValueError(f'Invalid SQLite pragma {name!r}')
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+    return values
+
+
+def install():
+    connection_created.connect(apply_pragmas, dispatch_uid='core.db')
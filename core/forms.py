@@ -1,4 +1,5 @@
 from django import forms
+from django.urls import reverse_lazy
 
 
 class MedicineSearchForm(forms.Form):
@@ -8,6 +9,7 @@ class MedicineSearchForm(forms.Form):
         widget=forms.TextInput(attrs={
             'class': 'form-control',
             'placeholder': 'Search for medicine by brand name...',
-            'autocomplete': 'off'
+            'autocomplete': 'off',
+            'data-autocomplete-url': reverse_lazy('autocomplete'),
         })
     )
@@ -0,0 +1,741 @@
+"""
+Streaming bulk import of pharmacy price feeds (CSV or JSON Lines).
+
+A feed is processed in three stages so that memory stays constant and each
+stage can be reused on its own:
+
+1. ``read_rows`` lazily parses the file into ``(line_number, row)`` pairs.
+2. ``validate_batch`` checks a batch of rows column by column without
+   touching the database and returns a ``PriceBatch`` plus rejected rows.
+3. ``PriceImporter`` resolves medicine/pharmacy keys through in-memory
+   lookup maps and upserts each batch on the (medicine, pharmacy) key.
+
+``PriceSyncer`` instead treats a feed as the full price list of each
+pharmacy in it and writes only the rows that changed since the last sync.
+
+Both can fan several feed files out to a process pool (``parse_feeds``):
+workers run stages 1 and 2 and stream compact columnar batches back through
+bounded queues, so memory stays constant there too, while the calling
+process stays the only one resolving keys and writing, which keeps SQLite's
+single writer.
+
+Feed columns: ``medicine_id`` or ``brand_name``; ``pharmacy`` (name) or
+``pharmacy_id``; ``price``; optional ``price_type`` (defaults to average).
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from pathlib import Path
+from queue import Empty
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import django
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import cache
+from .models import Medicine, Pharmacy, Price, PriceFeedSnapshot
+from .services import AlternativeGroupService, PriceAlertService, PriceHistoryService, PriceSummaryService
+
+PRICE_TYPES = {choice for choice, _ in Price.PRICE_TYPE_CHOICES}
+DEFAULT_PRICE_TYPE = Price._meta.get_field('price_type').default
+MAX_PRICE = Decimal(10) ** (Price._meta.get_field('price').max_digits - 2)
+CENT = Decimal('0.01')
+# Validated batches a pool worker may parse ahead of the writer, per file
+QUEUED_BATCHES = 2
+
+Row = Dict[str, str]
+Reject = Tuple[int, Row, str]
+
+
+def _open_text(path: Path):
+    if path.suffix == '.gz':
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def feed_format(path: Path) -> str:
+    suffixes = [suffix for suffix in path.suffixes if suffix != '.gz']
+    if suffixes and suffixes[-1] in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(path, fmt: Optional[str] = None) -> Iterator[Tuple[int, Row]]:
+    """
+    Lazily yield (line number, row dict) from a CSV or JSONL feed.
+    Malformed JSON lines are yielded with an '__error__' entry.
+    """
+    path = Path(path)
+    fmt = fmt or feed_format(path)
+    with _open_text(path) as handle:
+        if fmt == 'csv':
+            reader = csv.DictReader(handle)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                row = {'__error__': f'invalid JSON: {exc}'}
+            if not isinstance(row, dict):
+                row = {'__error__': 'expected a JSON object'}
+            yield line_number, row
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class PriceBatch:
+    """
+    Validated rows stored column-wise; keys are still unresolved feed values
+    """
+    __slots__ = ('line_numbers', 'rows', 'medicine_keys', 'pharmacy_keys', 'prices', 'price_types')
+
+    def __init__(self):
+        self.line_numbers: List[int] = []
+        self.rows: List[Row] = []
+        self.medicine_keys: List[object] = []
+        self.pharmacy_keys: List[object] = []
+        self.prices: List[Decimal] = []
+        self.price_types: List[str] = []
+
+    def __len__(self):
+        return len(self.line_numbers)
+
+    def pack(self) -> tuple:
+        """
+        The columns in a form that is cheap to pickle between processes:
+        prices as integer paise and no row dicts
+        """
+        return (self.line_numbers, self.medicine_keys, self.pharmacy_keys,
+                [int(price * 100) for price in self.prices], self.price_types)
+
+    @classmethod
+    def unpack(cls, packed: tuple) -> 'PriceBatch':
+        batch = cls()
+        batch.line_numbers, batch.medicine_keys, batch.pharmacy_keys, paise, batch.price_types = packed
+        batch.prices = [Decimal(value).scaleb(-2) for value in paise]
+        batch.rows = None
+        return batch
+
+    def row(self, i: int) -> Row:
+        """
+        The feed row behind entry ``i``, rebuilt from the columns after pack()
+        """
+        if self.rows is not None:
+            return self.rows[i]
+        row = {}
+        for key, id_column, name_column in ((self.medicine_keys[i], 'medicine_id', 'brand_name'),
+                                            (self.pharmacy_keys[i], 'pharmacy_id', 'pharmacy')):
+            if isinstance(key, int):
+                row[id_column] = str(key)
+            else:
+                row[name_column] = key[1]
+        row['price'] = str(self.prices[i])
+        row['price_type'] = self.price_types[i]
+        return row
+
+
+def _text(value) -> str:
+    return '' if value is None else str(value).strip()
+
+
+def _parse_price(value) -> Optional[Decimal]:
+    try:
+        price = Decimal(_text(value))
+    except InvalidOperation:
+        return None
+    if not price.is_finite() or price <= 0 or price >= MAX_PRICE or price != price.quantize(CENT):
+        return None
+    return price.quantize(CENT)
+
+
+def _key(row: Row, id_column: str, name_column: str):
+    """
+    An int id, a ('name', value) tuple, or None when neither column is usable
+    """
+    raw_id = _text(row.get(id_column))
+    if raw_id:
+        return int(raw_id) if raw_id.isdigit() else None
+    name = _text(row.get(name_column))
+    return ('name', name) if name else None
+
+
+def validate_batch(numbered_rows: List[Tuple[int, Row]]) -> Tuple[PriceBatch, List[Reject]]:
+    """
+    Validate a batch column by column without touching the database
+    Returns: (PriceBatch of valid rows, list of (line, row, reason) rejects)
+    """
+    line_numbers = [line for line, _ in numbered_rows]
+    rows = [row for _, row in numbered_rows]
+    errors = [row.get('__error__') for row in rows]
+    medicine_keys = [_key(row, 'medicine_id', 'brand_name') for row in rows]
+    pharmacy_keys = [_key(row, 'pharmacy_id', 'pharmacy') for row in rows]
+    prices = [_parse_price(row.get('price')) for row in rows]
+    price_types = [_text(row.get('price_type')).lower() or DEFAULT_PRICE_TYPE for row in rows]
+
+    batch = PriceBatch()
+    rejects = []
+    for i, line in enumerate(line_numbers):
+        if errors[i]:
+            reason = errors[i]
+        elif medicine_keys[i] is None:
+            reason = 'missing or invalid medicine_id/brand_name'
+        elif pharmacy_keys[i] is None:
+            reason = 'missing or invalid pharmacy/pharmacy_id'
+        elif prices[i] is None:
+            reason = f'invalid price {rows[i].get("price")!r}'
+        elif price_types[i] not in PRICE_TYPES:
+            reason = f'unknown price_type {price_types[i]!r}'
+        else:
+            batch.line_numbers.append(line)
+            batch.rows.append(rows[i])
+            batch.medicine_keys.append(medicine_keys[i])
+            batch.pharmacy_keys.append(pharmacy_keys[i])
+            batch.prices.append(prices[i])
+            batch.price_types.append(price_types[i])
+            continue
+        rejects.append((line, rows[i], reason))
+    return batch, rejects
+
+
+_feed_queues: list = []
+
+
+def _start_parse_worker(queues: list):
+    global _feed_queues
+    _feed_queues = queues
+    django.setup()
+
+
+def parse_feed(path: str, fmt: Optional[str], batch_size: int, slot: int) -> Tuple[int, float]:
+    """
+    Read and validate a feed file in a worker process, putting each
+    (PriceBatch.pack(), rejects) pair on feed queue ``slot`` as soon as it
+    is ready, then None. Blocks while QUEUED_BATCHES are waiting there.
+    Returns: (rows, seconds spent parsing)
+    """
+    queue = _feed_queues[slot]
+    started = time.perf_counter()
+    waited = 0.0
+    rows = 0
+    try:
+        for chunk in batched(read_rows(path, fmt), batch_size):
+            rows += len(chunk)
+            batch, rejects = validate_batch(chunk)
+            put_started = time.perf_counter()
+            queue.put((batch.pack(), rejects))
+            waited += time.perf_counter() - put_started
+    finally:
+        queue.put(None)
+    return rows, time.perf_counter() - started - waited
+
+
+class ParsedFeed:
+    """
+    A feed file parsed by a pool worker. Iterating yields its
+    (PriceBatch.pack(), rejects) pairs as they arrive; ``rows`` and
+    ``seconds`` are set once the last one has been read.
+    """
+
+    def __init__(self, queue, future):
+        self._queue = queue
+        self._future = future
+        self._done = False
+        self.rows = 0
+        self.seconds = 0.0
+
+    def __iter__(self):
+        while not self._done:
+            try:
+                item = self._queue.get(timeout=1)
+            except Empty:
+                if self._future.done() and self._future.exception() is not None:
+                    # The worker died without reaching its final None
+                    self._future.result()
+                continue
+            if item is None:
+                self._done = True
+                self.rows, self.seconds = self._future.result()
+                return
+            yield item
+
+    def drain(self):
+        """
+        Discard the batches the caller did not read, so the queue can be reused
+        """
+        if self._future.cancel():
+            self._done = True
+        for _ in self:
+            pass
+
+
+def parse_feeds(paths: Iterable, fmt: Optional[str], batch_size: int, workers: int) -> Iterator[Tuple[str, ParsedFeed]]:
+    """
+    Parse and validate feed files in a pool of ``workers`` processes, one
+    file per task, yielding them in the order given. At most two files per
+    worker are queued ahead of the caller and each holds at most
+    QUEUED_BATCHES parsed batches, so memory stays bounded whatever the size
+    of the files when writing is the slower side. Batches of a file the
+    caller leaves unread are discarded when it asks for the next one.
+    Yields: (source, ParsedFeed)
+    """
+    paths = [str(path) for path in paths]
+    slots = 2 * workers
+    queues = [multiprocessing.Queue(QUEUED_BATCHES) for _ in range(slots)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_parse_worker, initargs=(queues,)) as pool:
+        pending = deque()
+
+        def next_feed():
+            source, feed = pending[0]
+            yield source, feed
+            feed.drain()
+            pending.popleft()
+
+        try:
+            for i, path in enumerate(paths):
+                if len(pending) >= slots:
+                    yield from next_feed()
+                # Files take the queues in turn; a queue is free again once
+                # the file ``slots`` places earlier has been drained
+                slot = i % slots
+                pending.append((path, ParsedFeed(queues[slot], pool.submit(parse_feed, path, fmt, batch_size, slot))))
+            while pending:
+                yield from next_feed()
+        finally:
+            # Unblock workers still putting batches so the pool can shut down
+            for _, feed in pending:
+                with suppress(Exception):
+                    feed.drain()
+
+
+class KeyResolver:
+    """
+    In-memory maps from feed keys to medicine and pharmacy ids, loaded once
+    per import. Brand names shared by several medicines are ambiguous and
+    resolve to nothing.
+    """
+    AMBIGUOUS = -1
+
+    def __init__(self, using: str = 'default'):
+        self.medicine_ids: Set[int] = set()
+        self.medicine_names: Dict[str, int] = {}
+        for medicine_id, brand_name in Medicine.objects.using(using).values_list('id', 'brand_name').iterator(chunk_size=10000):
+            self.medicine_ids.add(medicine_id)
+            name = brand_name.casefold()
+            self.medicine_names[name] = self.AMBIGUOUS if name in self.medicine_names else medicine_id
+
+        self.pharmacy_ids: Set[int] = set()
+        self.pharmacy_names: Dict[str, int] = {}
+        for pharmacy_id, name in Pharmacy.objects.using(using).values_list('id', 'name'):
+            self.pharmacy_ids.add(pharmacy_id)
+            self.pharmacy_names[name.casefold()] = pharmacy_id
+
+    @staticmethod
+    def _resolve(key, ids: Set[int], names: Dict[str, int]) -> Optional[int]:
+        if isinstance(key, int):
+            return key if key in ids else None
+        resolved = names.get(key[1].casefold())
+        return None if resolved in (None, KeyResolver.AMBIGUOUS) else resolved
+
+    def medicine(self, key) -> Optional[int]:
+        return self._resolve(key, self.medicine_ids, self.medicine_names)
+
+    def pharmacy(self, key) -> Optional[int]:
+        return self._resolve(key, self.pharmacy_ids, self.pharmacy_names)
+
+
+class RejectWriter:
+    """
+    CSV of rejected rows (line, reason, original row as JSON), created on
+    the first rejection
+    """
+
+    def __init__(self, path):
+        self.path = Path(path) if path else None
+        self.count = 0
+        self._handle = None
+        self._writer = None
+
+    def write(self, source: str, rejects: List[Reject]):
+        self.count += len(rejects)
+        if not rejects or self.path is None:
+            return
+        if self._writer is None:
+            self._handle = open(self.path, 'w', encoding='utf-8', newline='')
+            self._writer = csv.writer(self._handle)
+            self._writer.writerow(['source', 'line', 'reason', 'row'])
+        for line, row, reason in rejects:
+            self._writer.writerow([source, line, reason, json.dumps(row, default=str)])
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+
+
+class ImportStats:
+    """
+    Row counts and timings of one import. ``stages`` holds the seconds spent
+    parsing and validating (summed over workers when parsed in a pool),
+    resolving keys and writing.
+    """
+    __slots__ = ('rows', 'imported', 'rejected', 'seconds', 'stages')
+
+    STAGES = ('parse', 'resolve', 'write')
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.stages = dict.fromkeys(self.STAGES, 0.0)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def timed(self, stage: str, started: float):
+        self.stages[stage] += time.perf_counter() - started
+
+    def merge(self, other: 'ImportStats'):
+        self.rows += other.rows
+        self.imported += other.imported
+        self.rejected += other.rejected
+        for stage, seconds in other.stages.items():
+            self.stages[stage] += seconds
+
+    def stage_rates(self) -> Dict[str, float]:
+        """
+        Rows per second of each stage on its own
+        """
+        return {stage: self.rows / seconds if seconds else 0.0 for stage, seconds in self.stages.items()}
+
+
+class PriceImporter:
+    """
+    Upserts validated batches with bulk_create(update_conflicts=True), one
+    transaction per batch, keeping price summaries and cached results in
+    step with the rows written, appending changed prices to the history
+    and queueing the price alerts they trigger
+    """
+
+    def __init__(self, batch_size: int = 5000, using: str = 'default', rejects: Optional[RejectWriter] = None):
+        self.batch_size = batch_size
+        self.using = using
+        self.rejects = rejects or RejectWriter(None)
+        self.resolver = KeyResolver(using)
+
+    def resolve(self, batch: PriceBatch) -> Tuple[Dict[Tuple[int, int], Tuple[Decimal, str]], List[Reject]]:
+        """
+        Map a validated batch onto (medicine_id, pharmacy_id) -> (price, price_type);
+        a key repeated within the batch keeps its last value
+        """
+        resolved = {}
+        rejects = []
+        for i in range(len(batch)):
+            medicine_id = self.resolver.medicine(batch.medicine_keys[i])
+            pharmacy_id = self.resolver.pharmacy(batch.pharmacy_keys[i])
+            if medicine_id is None:
+                rejects.append((batch.line_numbers[i], batch.row(i), 'unknown or ambiguous medicine'))
+            elif pharmacy_id is None:
+                rejects.append((batch.line_numbers[i], batch.row(i), 'unknown pharmacy'))
+            else:
+                resolved[(medicine_id, pharmacy_id)] = (batch.prices[i], batch.price_types[i])
+        return resolved, rejects
+
+    def write(self, resolved: Dict[Tuple[int, int], Tuple[Decimal, str]]) -> int:
+        if not resolved:
+            return 0
+        now = timezone.now()
+        objects = [
+            Price(medicine_id=medicine_id, pharmacy_id=pharmacy_id, price=price,
+                  price_type=price_type, last_updated=now)
+            for (medicine_id, pharmacy_id), (price, price_type) in resolved.items()
+        ]
+        medicine_ids = {medicine_id for medicine_id, _ in resolved}
+        pharmacy_ids = {pharmacy_id for _, pharmacy_id in resolved}
+        with transaction.atomic(using=self.using):
+            current = {
+                (medicine_id, pharmacy_id): price
+                for medicine_id, pharmacy_id, price in Price.objects.using(self.using).filter(
+                    medicine_id__in=medicine_ids, pharmacy_id__in=pharmacy_ids
+                ).values_list('medicine_id', 'pharmacy_id', 'price').iterator(chunk_size=10000)
+            }
+            PriceHistoryService.record(
+                [(medicine_id, pharmacy_id, price)
+                 for (medicine_id, pharmacy_id), (price, _) in resolved.items()
+                 if current.get((medicine_id, pharmacy_id)) != price],
+                at=now, using=self.using,
+            )
+            Price.objects.using(self.using).bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=['medicine', 'pharmacy'],
+                update_fields=['price', 'price_type', 'last_updated'],
+            )
+            # bulk_create skips model signals, so refresh derived data here
+            PriceSummaryService.rebuild(medicine_ids, using=self.using)
+            AlternativeGroupService.rebuild_for_medicines(medicine_ids, using=self.using)
+            PriceAlertService.match(medicine_ids, using=self.using)
+            cache.invalidate_medicines(medicine_ids, using=self.using)
+        return len(objects)
+
+    def _resolved(self, batch: PriceBatch, rejects: List[Reject], source: str, stats: 'ImportStats'):
+        started = time.perf_counter()
+        resolved, unresolved = self.resolve(batch)
+        rejects = rejects + unresolved
+        rejects.sort(key=lambda reject: reject[0])
+        self.rejects.write(source, rejects)
+        stats.rejected += len(rejects)
+        stats.timed('resolve', started)
+        return resolved
+
+    def resolved_batches(self, numbered_rows: Iterable[Tuple[int, Row]], source: str, stats: 'ImportStats'):
+        """
+        Validate and resolve rows batch by batch, recording rejects
+        Yields: (medicine_id, pharmacy_id) -> (price, price_type) dicts
+        """
+        chunks = batched(numbered_rows, self.batch_size)
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            stats.rows += len(chunk)
+            batch, rejects = validate_batch(chunk)
+            stats.timed('parse', started)
+            yield self._resolved(batch, rejects, source, stats)
+
+    def parsed_batches(self, feed: ParsedFeed, source: str, stats: 'ImportStats'):
+        """
+        resolved_batches() for a feed being validated by parse_feed
+        """
+        for packed, rejects in feed:
+            yield self._resolved(PriceBatch.unpack(packed), rejects, source, stats)
+        stats.rows += feed.rows
+        stats.stages['parse'] += feed.seconds
+
+    def _import(self, resolved_batches: Iterable[dict], stats: ImportStats, started: float) -> ImportStats:
+        for resolved in resolved_batches:
+            write_started = time.perf_counter()
+            stats.imported += self.write(resolved)
+            stats.timed('write', write_started)
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    def import_rows(self, numbered_rows: Iterable[Tuple[int, Row]], source: str = '') -> ImportStats:
+        stats = ImportStats()
+        return self._import(self.resolved_batches(numbered_rows, source, stats), stats, time.perf_counter())
+
+    def import_file(self, path, fmt: Optional[str] = None) -> ImportStats:
+        return self.import_rows(read_rows(path, fmt), source=str(path))
+
+    def import_files(self, paths: Iterable, fmt: Optional[str] = None,
+                     workers: int = 2) -> Iterator[Tuple[str, ImportStats]]:
+        """
+        Import feed files parsed by a pool of ``workers`` processes, writing
+        them in the order given from this process only, batch by batch as the
+        workers parse them. Each file's seconds cover resolving and writing
+        it and waiting for batches not parsed yet.
+        Yields: (source, ImportStats) per file
+        """
+        for source, feed in parse_feeds(paths, fmt, self.batch_size, workers):
+            stats = ImportStats()
+            yield source, self._import(self.parsed_batches(feed, source, stats), stats, time.perf_counter())
+
+
+def feed_digest(rows: Dict[int, Tuple[Decimal, str]]) -> str:
+    """
+    Order-independent digest of one pharmacy's (medicine, price, price_type) rows
+    """
+    digest = hashlib.sha256()
+    for medicine_id in sorted(rows):
+        price, price_type = rows[medicine_id]
+        digest.update(f'{medicine_id}|{price}|{price_type}\n'.encode())
+    return digest.hexdigest()
+
+
+class ChangeLog:
+    """
+    JSON Lines record of every row a sync inserted, updated or deleted
+    """
+
+    def __init__(self, path):
+        self.path = Path(path) if path else None
+        self._handle = open(self.path, 'a', encoding='utf-8') if self.path else None
+
+    def write(self, action: str, medicine_id: int, pharmacy_id: int, old: Optional[Tuple[Decimal, str]],
+              new: Optional[Tuple[Decimal, str]], at: str):
+        if self._handle is None:
+            return
+        self._handle.write(json.dumps({
+            'action': action,
+            'medicine_id': medicine_id,
+            'pharmacy_id': pharmacy_id,
+            'old_price': str(old[0]) if old else None,
+            'new_price': str(new[0]) if new else None,
+            'price_type': (new or old)[1],
+            'at': at,
+        }) + '\n')
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+
+
+class SyncStats(ImportStats):
+    __slots__ = ('inserted', 'updated', 'deleted', 'unchanged', 'pharmacies', 'skipped_pharmacies')
+
+    def __init__(self):
+        super().__init__()
+        self.inserted = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.pharmacies = 0
+        self.skipped_pharmacies = 0
+
+    @property
+    def writes(self) -> int:
+        return self.inserted + self.updated + self.deleted
+
+
+class PriceSyncer(PriceImporter):
+    """
+    Differential sync: a feed is the complete price list of every pharmacy it
+    mentions. A pharmacy whose feed digest matches the one stored at its last
+    sync is skipped outright; the others are diffed against their current
+    rows and only inserts, updates and deletes are written, so unchanged
+    rows keep their last_updated and downstream caches stay warm.
+
+    Unlike plain imports, the feed is held in memory grouped by pharmacy.
+    """
+
+    def __init__(self, batch_size: int = 5000, using: str = 'default', rejects: Optional[RejectWriter] = None,
+                 changelog: Optional[ChangeLog] = None, full_diff: bool = False):
+        super().__init__(batch_size=batch_size, using=using, rejects=rejects)
+        self.changelog = changelog or ChangeLog(None)
+        self.full_diff = full_diff
+
+    def sync_rows(self, numbered_rows: Iterable[Tuple[int, Row]], source: str = '') -> SyncStats:
+        stats = SyncStats()
+        return self._sync(self.resolved_batches(numbered_rows, source, stats), stats, time.perf_counter())
+
+    def sync_files(self, paths: Iterable, fmt: Optional[str] = None,
+                   workers: int = 2) -> Iterator[Tuple[str, SyncStats]]:
+        """
+        sync_file() for each of ``paths``, parsed by a pool of ``workers``
+        processes (see import_files)
+        Yields: (source, SyncStats) per file
+        """
+        for source, parsed in parse_feeds(paths, fmt, self.batch_size, workers):
+            stats = SyncStats()
+            yield source, self._sync(self.parsed_batches(parsed, source, stats), stats, time.perf_counter())
+
+    def _sync(self, resolved_batches: Iterable[dict], stats: SyncStats, started: float) -> SyncStats:
+        feed: Dict[int, Dict[int, Tuple[Decimal, str]]] = defaultdict(dict)
+        for resolved in resolved_batches:
+            for (medicine_id, pharmacy_id), value in resolved.items():
+                feed[pharmacy_id][medicine_id] = value
+
+        snapshots = dict(
+            PriceFeedSnapshot.objects.using(self.using)
+            .filter(pharmacy_id__in=list(feed)).values_list('pharmacy_id', 'digest')
+        )
+        for pharmacy_id, rows in feed.items():
+            stats.pharmacies += 1
+            digest = feed_digest(rows)
+            if not self.full_diff and snapshots.get(pharmacy_id) == digest:
+                stats.skipped_pharmacies += 1
+                stats.unchanged += len(rows)
+                continue
+            write_started = time.perf_counter()
+            self.sync_pharmacy(pharmacy_id, rows, digest, stats)
+            stats.timed('write', write_started)
+        stats.imported = stats.inserted + stats.updated
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    def sync_pharmacy(self, pharmacy_id: int, rows: Dict[int, Tuple[Decimal, str]], digest: str, stats: SyncStats):
+        current = {
+            medicine_id: (price_id, (price, price_type))
+            for price_id, medicine_id, price, price_type in Price.objects.using(self.using)
+            .filter(pharmacy_id=pharmacy_id).values_list('id', 'medicine_id', 'price', 'price_type')
+            .iterator(chunk_size=10000)
+        }
+        now = timezone.now()
+        at = now.isoformat()
+        upserts = []
+        changes = []
+        for medicine_id, new in rows.items():
+            existing = current.pop(medicine_id, None)
+            if existing is not None and existing[1] == new:
+                stats.unchanged += 1
+                continue
+            action = 'insert' if existing is None else 'update'
+            if existing is None:
+                stats.inserted += 1
+            else:
+                stats.updated += 1
+            self.changelog.write(action, medicine_id, pharmacy_id, existing and existing[1], new, at)
+            if existing is None or existing[1][0] != new[0]:
+                changes.append((medicine_id, pharmacy_id, new[0]))
+            upserts.append(Price(
+                medicine_id=medicine_id, pharmacy_id=pharmacy_id, price=new[0],
+                price_type=new[1], last_updated=now,
+            ))
+        for medicine_id, (_, old) in current.items():
+            self.changelog.write('delete', medicine_id, pharmacy_id, old, None, at)
+        stats.deleted += len(current)
+
+        delete_ids = [price_id for price_id, _ in current.values()]
+        touched = {price.medicine_id for price in upserts} | set(current)
+        with transaction.atomic(using=self.using):
+            for start in range(0, len(upserts), self.batch_size):
+                Price.objects.using(self.using).bulk_create(
+                    upserts[start:start + self.batch_size],
+                    update_conflicts=True,
+                    unique_fields=['medicine', 'pharmacy'],
+                    update_fields=['price', 'price_type', 'last_updated'],
+                )
+            # Deleted rows are accounted for below, so skip the per-row
+            # delete signals a queryset delete would send
+            with connections[self.using].cursor() as cursor:
+                for start in range(0, len(delete_ids), self.batch_size):
+                    chunk = delete_ids[start:start + self.batch_size]
+                    cursor.execute(
+                        f'DELETE FROM {Price._meta.db_table} WHERE id IN ({", ".join(["%s"] * len(chunk))})',
+                        chunk,
+                    )
+            PriceHistoryService.record(changes, at=now, using=self.using)
+            if touched:
+                PriceSummaryService.rebuild(touched, using=self.using)
+                AlternativeGroupService.rebuild_for_medicines(touched, using=self.using)
+                PriceAlertService.match(touched, using=self.using)
+                cache.invalidate_medicines(touched, using=self.using)
+            PriceFeedSnapshot.objects.using(self.using).update_or_create(
+                pharmacy_id=pharmacy_id,
+                defaults={'digest': digest, 'row_count': len(rows), 'synced_at': now},
+            )
+
+    def sync_file(self, path, fmt: Optional[str] = None) -> SyncStats:
+        return self.sync_rows(read_rows(path, fmt), source=str(path))
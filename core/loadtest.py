@@ -0,0 +1,213 @@
+"""
+Closed-loop HTTP load generation for ``manage.py loadtest``.
+
+Each simulated client sends its next request as soon as the previous one is
+answered, so throughput and latency are measured at a fixed concurrency.
+Targets are either a running deployment (any WSGI or ASGI server, driven over
+keep-alive HTTP/1.1 connections with nothing but asyncio) or Django's own
+WSGI and ASGI handlers in this process.
+"""
+import asyncio
+import random
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+from urllib.parse import urlsplit
+
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.urls import include, path
+from django.utils.http import urlencode
+
+from .benchmarks import percentile
+from .models import Medicine
+from .synthetic import search_terms
+
+SCENARIOS = {
+    'results': {'results': 1.0},
+    'search': {'search': 1.0},
+    'home': {'home': 1.0},
+    'mixed': {'results': 0.6, 'search': 0.3, 'home': 0.1},
+}
+
+
+def request_paths(scenario: str, count: int, seed: int) -> List[str]:
+    """
+    ``count`` request paths for a scenario, drawn from the current catalogue
+    """
+    rng = random.Random(seed)
+    medicine_ids = list(Medicine.objects.values_list('id', flat=True))
+    medicine_ids = rng.sample(medicine_ids, min(count, len(medicine_ids)))
+    terms = search_terms(count, rng)
+    kinds, weights = zip(*SCENARIOS[scenario].items())
+    paths = []
+    for i, kind in enumerate(rng.choices(kinds, weights, k=count)):
+        if kind == 'results' and medicine_ids:
+            paths.append(f'/results/{medicine_ids[i % len(medicine_ids)]}/')
+        elif kind == 'search':
+            paths.append(f"/search/?{urlencode({'q': terms[i]})}")
+        else:
+            paths.append('/')
+    return paths
+
+
+def report(samples: List[Tuple[float, int]], seconds: float) -> dict:
+    """
+    Returns: {'requests', 'errors', 'seconds', 'requests_per_second', 'p50_ms', 'p99_ms', 'max_ms'}
+    for (latency in seconds, status) samples
+    """
+    latencies = [latency * 1000 for latency, _ in samples] or [0.0]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status in samples if not 200 <= status < 400),
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(samples) / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(max(latencies), 3),
+    }
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, bool]:
+    """
+    Read one HTTP/1.1 response
+    Returns: (status, whether the connection can be reused)
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed by server')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def load_url(base_url: str, paths: List[str], concurrency: int, timeout: float = 30.0):
+    """
+    Replay ``paths`` against a running server with ``concurrency`` keep-alive clients
+    Returns: report() of the run
+    """
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or (443 if url.scheme == 'https' else 80)
+    host_header = url.netloc
+    pending: Iterator[str] = iter(paths)
+    samples = []
+
+    async def client():
+        reader = writer = None
+        for request_path in pending:
+            started = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port, ssl=url.scheme == 'https')
+                writer.write(
+                    f'GET {request_path} HTTP/1.1\r\nHost: {host_header}\r\n'
+                    f'Connection: keep-alive\r\n\r\n'.encode('latin-1')
+                )
+                await writer.drain()
+                status, reusable = await asyncio.wait_for(_read_response(reader), timeout)
+            except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                status, reusable = 599, False
+            samples.append((time.perf_counter() - started, status))
+            if not reusable and writer is not None:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return report(samples, time.perf_counter() - started)
+
+
+def load_wsgi(paths: List[str], concurrency: int) -> dict:
+    """
+    Drive Django's WSGI handler from ``concurrency`` threads, like a threaded
+    WSGI server would
+    """
+    pending = iter(paths)
+    lock = threading.Lock()
+    samples = []
+
+    def client():
+        handler = Client()
+        while True:
+            with lock:
+                request_path = next(pending, None)
+            if request_path is None:
+                return
+            started = time.perf_counter()
+            status = handler.get(request_path).status_code
+            samples.append((time.perf_counter() - started, status))
+
+    def run_client():
+        try:
+            client()
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run_client) for _ in range(concurrency)]:
+            future.result()
+    return report(samples, time.perf_counter() - started)
+
+
+def load_asgi(paths: List[str], concurrency: int) -> dict:
+    """
+    Drive Django's ASGI handler from ``concurrency`` tasks on one event loop,
+    like a single ASGI server worker would
+    """
+    pending = iter(paths)
+    samples = []
+
+    async def client():
+        handler = AsyncClient()
+        for request_path in pending:
+            started = time.perf_counter()
+            status = (await handler.get(request_path)).status_code
+            samples.append((time.perf_counter() - started, status))
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return report(samples, time.perf_counter() - started)
+
+    return asyncio.run(run())
+
+
+def urlconf(async_views: bool) -> types.ModuleType:
+    """
+    A root URLconf serving the sync or the async page views, so both can be
+    loaded in one process regardless of ``ASYNC_VIEWS``
+    """
+    from . import urls
+    module = types.ModuleType(f"loadtest_{'async' if async_views else 'sync'}_urls")
+    module.urlpatterns = [path('', include(urls.patterns(async_views)))]
+    return module
+
+
+# In-process deployments: the handler driver and whether to serve the async views
+IN_PROCESS = {
+    'wsgi': (load_wsgi, False),
+    'asgi': (load_asgi, True),
+}
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from core import compositions
+
+
+class Command(BaseCommand):
+    help = 'Parse medicine composition strings into canonical compositions and set Medicine.composition_key'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Distinct compositions parsed per batch')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to use')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = compositions.backfill(
+            using=options['database'], batch_size=options['batch_size'], stdout=self.stdout
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Parsed {result['strings']:,} composition strings into {result['compositions']:,} canonical "
+            f"compositions; re-keyed {result['medicines']:,} medicines in {time.perf_counter() - started:.2f}s"
+        ))
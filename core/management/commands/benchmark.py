@@ -0,0 +1,54 @@
+import json
+import platform
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks against synthetic catalogues (all data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'benchmarks', nargs='*', metavar='benchmark',
+            help=f'Benchmarks to run (default: all of {", ".join(sorted(BENCHMARKS))})'
+        )
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000],
+            help='Catalogue sizes (number of medicines) to measure at'
+        )
+        parser.add_argument('--queries', type=int, default=200, help='Timed calls per measurement')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for synthetic data')
+        parser.add_argument('--output', help='Write all results to this file as JSON, for diffing between commits')
+
+    def handle(self, *args, **options):
+        names = options['benchmarks'] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(
+                f'Unknown benchmark {", ".join(unknown)} (choose from {", ".join(sorted(BENCHMARKS))})'
+            )
+        results = []
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'Running {name} benchmark...'))
+            results.extend(BENCHMARKS[name](options, self.stdout))
+
+        if options['output']:
+            report = {
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': f'{connection.vendor} {connection.Database.sqlite_version}'
+                if connection.vendor == 'sqlite' else connection.vendor,
+                'options': {key: options[key] for key in ('sizes', 'queries', 'seed')},
+                'benchmarks': names,
+                'results': results,
+            }
+            Path(options['output']).write_text(json.dumps(report, indent=2) + '\n', encoding='utf-8')
+            self.stdout.write(f"Wrote {len(results)} results to {options['output']}")
+        self.stdout.write(self.style.SUCCESS('Benchmarks completed'))
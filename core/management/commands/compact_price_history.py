@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from core.services import PriceHistoryService
+
+
+class Command(BaseCommand):
+    help = 'Roll price history older than the retention window into daily aggregates, and drop old aggregates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=90,
+                            help='Days of raw price changes to keep (default 90)')
+        parser.add_argument('--keep-daily-days', type=int, default=730,
+                            help='Days of daily aggregates to keep; 0 keeps them forever (default 730)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Daily aggregates written per statement')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to use')
+
+    def handle(self, *args, **options):
+        keep_days, keep_daily_days = options['keep_days'], options['keep_daily_days']
+        if keep_days < 1:
+            raise CommandError('--keep-days must be at least 1')
+        if keep_daily_days and keep_daily_days < keep_days:
+            raise CommandError('--keep-daily-days must not be shorter than --keep-days')
+
+        using = options['database']
+        today = timezone.now().date()
+        started = time.perf_counter()
+        removed, written = PriceHistoryService.compact(
+            today - timedelta(days=keep_days), using=using, batch_size=options['batch_size']
+        )
+        dropped = 0
+        if keep_daily_days:
+            dropped = PriceHistoryService.drop_daily(today - timedelta(days=keep_daily_days), using=using)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled {removed:,} price changes into {written:,} daily aggregates and dropped '
+            f'{dropped:,} old aggregates in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core import snapshot
+
+
+class Command(BaseCommand):
+    help = ('Export the catalogue and price list as a snapshot file that the workers map and share '
+            '(PRICE_SNAPSHOT_FILE unless --output is given)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Snapshot file to replace')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, exporting every --interval seconds')
+        parser.add_argument('--interval', type=float, default=300.0, help='Seconds between exports with --loop')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to use')
+
+    def handle(self, *args, **options):
+        path = options['output'] or getattr(settings, 'PRICE_SNAPSHOT_FILE', '')
+        if not path:
+            raise CommandError('Set PRICE_SNAPSHOT_FILE or pass --output')
+        while True:
+            started = time.perf_counter()
+            exported = snapshot.export(path, using=options['database'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Exported price snapshot {exported.version} to {path}: {len(exported):,} prices, '
+                f'{exported.nbytes() / 2 ** 20:.1f} MB in {time.perf_counter() - started:.2f}s'
+            ))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
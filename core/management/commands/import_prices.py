@@ -0,0 +1,115 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.importers import ChangeLog, ImportStats, PriceImporter, PriceSyncer, RejectWriter
+
+
+class Command(BaseCommand):
+    help = 'Stream pharmacy price feeds (CSV or JSONL) into the Price table with batched upserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Feed files (.csv, .jsonl, optionally .gz compressed)')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Feed format (default: from file extension)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows validated and upserted per batch')
+        parser.add_argument(
+            '--rejects', help='CSV file for rejected rows (default: <first file>.rejected.csv)'
+        )
+        parser.add_argument(
+            '--sync', action='store_true',
+            help='Treat each feed as the full price list of its pharmacies: write only changed rows '
+                 'and delete prices missing from the feed'
+        )
+        parser.add_argument(
+            '--full-diff', action='store_true',
+            help='With --sync, diff every pharmacy even if its feed digest is unchanged'
+        )
+        parser.add_argument('--changelog', help='With --sync, append every insert/update/delete to this JSONL file')
+        parser.add_argument(
+            '--workers', type=int, default=0,
+            help='Parse and validate files in this many worker processes while this process writes '
+                 '(default 0: parse in this process)'
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to import into')
+
+    def handle(self, *args, **options):
+        paths = [Path(name) for name in options['files']]
+        missing = [str(path) for path in paths if not path.is_file()]
+        if missing:
+            raise CommandError(f'Feed file not found: {", ".join(missing)}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['workers'] < 0:
+            raise CommandError('--workers must not be negative')
+
+        if (options['full_diff'] or options['changelog']) and not options['sync']:
+            raise CommandError('--full-diff and --changelog require --sync')
+
+        rejects = RejectWriter(options['rejects'] or f'{paths[0]}.rejected.csv')
+        if options['sync']:
+            changelog = ChangeLog(options['changelog'])
+            try:
+                self.sync(paths, options, rejects, changelog)
+            finally:
+                changelog.close()
+                rejects.close()
+        else:
+            self.upsert(paths, options, rejects)
+
+        if rejects.count:
+            self.stdout.write(self.style.WARNING(f'{rejects.count:,} rejected rows written to {rejects.path}'))
+
+    def feeds(self, paths, options, process_file, process_files):
+        """
+        (path, stats) per feed file, parsed here or by the worker pool
+        """
+        if options['workers']:
+            self.stdout.write(f'Parsing {len(paths):,} files in {options["workers"]} worker processes...')
+            yield from process_files(paths, options['format'], workers=options['workers'])
+            return
+        for path in paths:
+            yield path, process_file(path, options['format'])
+
+    def report_stages(self, total, started):
+        elapsed = time.perf_counter() - started
+        rates = total.stage_rates()
+        stages = ', '.join(
+            f'{stage} {seconds:.2f}s ({rates[stage]:,.0f} rows/s)' for stage, seconds in total.stages.items()
+        )
+        self.stdout.write(f'{total.rows:,} rows in {elapsed:.2f}s ({total.rows / max(elapsed, 1e-9):,.0f} rows/s); {stages}')
+
+    def upsert(self, paths, options, rejects):
+        importer = PriceImporter(
+            batch_size=options['batch_size'], using=options['database'], rejects=rejects
+        )
+        started = time.perf_counter()
+        total = ImportStats()
+        try:
+            for path, stats in self.feeds(paths, options, importer.import_file, importer.import_files):
+                total.merge(stats)
+                self.stdout.write(self.style.SUCCESS(
+                    f'{path}: {stats.rows:,} rows: {stats.imported:,} upserted, {stats.rejected:,} rejected '
+                    f'in {stats.seconds:.2f}s ({stats.rows_per_second:,.0f} rows/s)'
+                ))
+        finally:
+            rejects.close()
+        self.report_stages(total, started)
+
+    def sync(self, paths, options, rejects, changelog):
+        syncer = PriceSyncer(
+            batch_size=options['batch_size'], using=options['database'], rejects=rejects,
+            changelog=changelog, full_diff=options['full_diff'],
+        )
+        started = time.perf_counter()
+        total = ImportStats()
+        for path, stats in self.feeds(paths, options, syncer.sync_file, syncer.sync_files):
+            total.merge(stats)
+            self.stdout.write(self.style.SUCCESS(
+                f'{path}: {stats.rows:,} rows: {stats.inserted:,} inserted, {stats.updated:,} updated, '
+                f'{stats.deleted:,} deleted, {stats.unchanged:,} unchanged, {stats.rejected:,} rejected; '
+                f'{stats.skipped_pharmacies:,} of {stats.pharmacies:,} pharmacies unchanged '
+                f'in {stats.seconds:.2f}s ({stats.rows_per_second:,.0f} rows/s)'
+            ))
+        self.report_stages(total, started)
@@ -0,0 +1,60 @@
+import asyncio
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from core.loadtest import IN_PROCESS, SCENARIOS, load_url, request_paths, urlconf
+
+
+class Command(BaseCommand):
+    help = 'Closed-loop load test comparing WSGI and ASGI deployments (requests/sec and latency percentiles)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', action='append', default=[], metavar='NAME=URL',
+            help='Running deployment to load, e.g. wsgi=http://127.0.0.1:8000 (repeatable). '
+                 "Without targets, Django's WSGI and ASGI handlers are driven in this process"
+        )
+        parser.add_argument('--concurrency', type=int, default=200, help='Simultaneous clients')
+        parser.add_argument('--requests', type=int, default=5000, help='Requests per target')
+        parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed', help='Pages to request')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the request mix')
+        parser.add_argument('--output', help='Write the results to this file as JSON')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+        targets = []
+        for target in options['target']:
+            name, separator, url = target.partition('=')
+            if not separator or not url.startswith(('http://', 'https://')):
+                raise CommandError(f'Invalid --target {target!r}; expected NAME=http://host:port')
+            targets.append((name, url.rstrip('/')))
+
+        paths = request_paths(options['scenario'], options['requests'], options['seed'])
+        results = []
+        for name, url in targets or [(deployment, None) for deployment in IN_PROCESS]:
+            self.stdout.write(f"Loading {name} ({url or 'in process'}) with {options['concurrency']} clients...")
+            if url:
+                row = asyncio.run(load_url(url, paths, options['concurrency']))
+            else:
+                load, async_views = IN_PROCESS[name]
+                with override_settings(
+                    ROOT_URLCONF=urlconf(async_views), ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+                ):
+                    row = load(paths, options['concurrency'])
+            row = {'target': name, 'url': url, 'scenario': options['scenario'],
+                   'concurrency': options['concurrency'], **row}
+            results.append(row)
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: {row['requests_per_second']:,.1f} req/s  p50 {row['p50_ms']:.1f} ms  "
+                f"p99 {row['p99_ms']:.1f} ms  max {row['max_ms']:.1f} ms  "
+                f"{row['errors']} errors of {row['requests']:,}"
+            ))
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2) + '\n', encoding='utf-8')
+            self.stdout.write(f"Wrote results to {options['output']}")
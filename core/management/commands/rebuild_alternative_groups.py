@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from core import cache
+from core.models import AlternativeGroup
+from core.services import AlternativeGroupService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed alternative groups (one per composition) from the price summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Groups written per statement')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to use')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        started = time.perf_counter()
+        groups, members = AlternativeGroupService.rebuild(using=using, batch_size=options['batch_size'])
+        # Every group may have changed, so cached alternatives are all suspect
+        for composition_key in AlternativeGroup.objects.using(using).values_list('pk', flat=True).iterator():
+            cache.invalidate_composition(composition_key, using=using)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {groups:,} alternative groups ({members:,} medicines) in {elapsed:.2f}s '
+            f'({members / max(elapsed, 1e-9):,.0f} medicines/s)'
+        ))
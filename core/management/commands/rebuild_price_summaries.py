@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from core.services import PriceSummaryService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the precomputed per-medicine price summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare summaries against live price aggregates; exit non-zero on mismatch'
+        )
+        parser.add_argument('--batch-size', type=int, default=2000, help='Summaries written per statement')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to use')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        started = time.perf_counter()
+
+        if options['verify']:
+            mismatched = PriceSummaryService.verify(using=using)
+            if mismatched:
+                preview = ', '.join(str(medicine_id) for medicine_id in mismatched[:20])
+                self.stderr.write(self.style.ERROR(
+                    f'{len(mismatched)} summaries out of date (medicine ids: {preview}'
+                    f'{", ..." if len(mismatched) > 20 else ""})'
+                ))
+                raise SystemExit(1)
+            self.stdout.write(self.style.SUCCESS('All price summaries match live prices'))
+            return
+
+        with transaction.atomic(using=using):
+            written = PriceSummaryService.rebuild(using=using, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {written} price summaries in {elapsed:.2f}s ({written / max(elapsed, 1e-9):,.0f}/s)'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the medicine full-text search index from the Medicine table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.is_supported(connections[using]):
+            self.stdout.write(self.style.WARNING(
+                f'{connections[using].vendor} has no full-text index; searches use icontains'
+            ))
+            return
+
+        with transaction.atomic(using=using):
+            count = search.rebuild_index(using)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} medicines'))
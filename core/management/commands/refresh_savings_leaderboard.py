@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from core import cache
+from core.services import SavingsLeaderboardService
+
+
+class Command(BaseCommand):
+    help = ('Refresh the generic savings leaderboard for the compositions whose prices changed since the last run '
+            '(all of them with --full)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every composition')
+        parser.add_argument('--batch-size', type=int, default=500, help='Compositions recomputed per statement')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, refreshing every --interval seconds')
+        parser.add_argument('--interval', type=float, default=300.0, help='Seconds between refreshes with --loop')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to use')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        full = options['full']
+        while True:
+            started = time.perf_counter()
+            run = SavingsLeaderboardService.refresh(full=full, using=using, batch_size=options['batch_size'])
+            if run.groups:
+                cache.invalidate_savings_leaderboard(using=using)
+            self.stdout.write(self.style.SUCCESS(
+                f'{"Rebuilt" if run.full else "Refreshed"} the savings leaderboard: {run.groups:,} compositions '
+                f'recomputed, {run.entries:,} rows written in {time.perf_counter() - started:.2f}s'
+            ))
+            if not options['loop']:
+                return
+            full = False
+            time.sleep(options['interval'])
@@ -1,5 +1,7 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
 from core.models import Medicine, Pharmacy, Price, GenericBenefit
+from core.synthetic import seed_catalogue
 from decimal import Decimal
 import random
 
@@ -7,7 +9,38 @@ import random
 class Command(BaseCommand):
     help = 'Seed the database with comprehensive medicine data including generic alternatives'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', type=int,
+            help='Replace the catalogue with this many synthetic medicines (about 10 prices each) '
+                 'instead of the curated sample data'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the synthetic catalogue')
+        parser.add_argument('--pharmacies', type=int, default=20, help='Number of synthetic pharmacies')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to seed')
+
+    def handle(self, *args, **options):
+        if options['scale'] is None:
+            self.seed_sample_data()
+            return
+        if options['scale'] < 1 or options['pharmacies'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--scale, --pharmacies and --batch-size must be positive')
+
+        self.stdout.write(
+            f"Seeding {options['scale']:,} synthetic medicines across {options['pharmacies']} pharmacies "
+            f"(seed {options['seed']})..."
+        )
+        created = seed_catalogue(
+            options['scale'], seed=options['seed'], pharmacies=options['pharmacies'],
+            batch_size=options['batch_size'], using=options['database'], stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created['medicines']:,} medicines, {created['pharmacies']:,} pharmacies and "
+            f"{created['prices']:,} prices in {created['seconds']:.1f}s"
+        ))
+
+    def seed_sample_data(self):
         self.stdout.write('Clearing existing data...')
         Price.objects.all().delete()
         Medicine.objects.all().delete()
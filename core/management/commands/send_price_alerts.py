@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from core.services import PriceAlertService
+
+
+class Command(BaseCommand):
+    help = 'Email the pending price alert notifications from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Notifications sent per batch')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, polling the outbox every --interval seconds')
+        parser.add_argument('--interval', type=float, default=10.0, help='Seconds between polls with --loop')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to use')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = self.drain(options)
+            if sent or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent:,} price alerts ({failed:,} failed)'))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def drain(self, options):
+        """
+        Send batches until the outbox is empty, or until a batch has
+        failures, which are left for the next poll to retry
+        """
+        sent = failed = 0
+        while True:
+            batch_sent, batch_failed = PriceAlertService.send_pending(options['batch_size'], using=options['database'])
+            sent, failed = sent + batch_sent, failed + batch_failed
+            if batch_failed or batch_sent < options['batch_size']:
+                return sent, failed
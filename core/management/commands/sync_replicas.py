@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database into each configured replica (local stand-ins for real '
+            'replication; run it again to let the replicas catch up)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'replicas', nargs='*', help='Replica aliases to refresh (default: all of DATABASE_REPLICAS)'
+        )
+
+    def handle(self, *args, **options):
+        aliases = options['replicas'] or settings.DATABASE_REPLICAS
+        if not aliases:
+            raise CommandError('No replicas configured; set MEDCOMPARE_DB_REPLICAS')
+        unknown = [alias for alias in aliases if alias not in settings.DATABASE_REPLICAS]
+        if unknown:
+            raise CommandError(f'Not a replica: {", ".join(unknown)}')
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite' or any(connections[alias].vendor != 'sqlite' for alias in aliases):
+            raise CommandError('sync_replicas only copies SQLite databases; use the database\'s own replication')
+
+        primary.ensure_connection()
+        for alias in aliases:
+            started = time.perf_counter()
+            replica = connections[alias]
+            replica.ensure_connection()
+            # SQLite's online backup API copies a consistent snapshot even
+            # while the primary is in use
+            primary.connection.backup(replica.connection)
+            self.stdout.write(self.style.SUCCESS(
+                f'Copied {primary.settings_dict["NAME"]} to {alias} in {time.perf_counter() - started:.2f}s'
+            ))
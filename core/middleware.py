@@ -0,0 +1,137 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import profiling, routers
+
+logger = logging.getLogger('core.profiling')
+
+
+class RequestProfilingMiddleware:
+    """
+    Records wall time, query count and time, template render time and
+    repeated SQL for every request, aggregates them per view (see
+    ``core.profiling.stats``), adds a ``Server-Timing`` header and logs
+    slow requests. Disabled unless ``REQUEST_PROFILING`` is set.
+
+    Works in both sync and async stacks; under ASGI the profile is carried
+    by a context variable into the threads the async ORM runs queries in,
+    whose connections carry the profiler's execute wrapper too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'REQUEST_PROFILING_SLOW_MS', 500)
+        self.duplicate_threshold = getattr(settings, 'REQUEST_PROFILING_DUPLICATE_THRESHOLD', 3)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        profiling.install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = profiling.RequestProfile()
+        token = profiling.activate(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiling.deactivate(token)
+        self.finish(request, response, profile)
+        return response
+
+    async def __acall__(self, request):
+        profile = profiling.RequestProfile()
+        token = profiling.activate(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.deactivate(token)
+        self.finish(request, response, profile)
+        return response
+
+    def finish(self, request, response, profile):
+        wall_ms = (time.perf_counter() - profile.started) * 1000
+        started = time.perf_counter()
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        duplicates = profile.duplicates(self.duplicate_threshold)
+        slow = wall_ms >= self.slow_ms
+        profile.overhead += time.perf_counter() - started
+        profiling.record(view, wall_ms, profile, list(duplicates), slow)
+        if slow or duplicates:
+            logger.warning(
+                '%s %s (%s) took %.1f ms: %d queries in %.1f ms, templates %.1f ms%s',
+                request.method, request.path, view, wall_ms, profile.queries,
+                profile.query_seconds * 1000, profile.template_seconds * 1000,
+                ''.join(f'\n  repeated {count}x: {sql}' for sql, count in duplicates.items()),
+            )
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={wall_ms:.2f}',
+            f'db;dur={profile.query_seconds * 1000:.2f};desc="{profile.queries} queries"',
+            f'tpl;dur={profile.template_seconds * 1000:.2f}',
+            f'prof;dur={profile.overhead * 1000:.3f}',
+        ])
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Scopes replica routing (see ``core.routers``) to each request and makes
+    it sticky after writes: a request that writes sets a cookie that keeps
+    the client's reads on the primary for ``REPLICA_STICKY_SECONDS``, longer
+    than the replicas are expected to lag. Disabled unless
+    ``DATABASE_REPLICAS`` is set.
+    """
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'primary_reads'
+
+    def __init__(self, get_response):
+        if not routers.replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+        self.primary_paths = tuple(getattr(settings, 'REPLICA_PRIMARY_PATHS', ()))
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def state(self, request):
+        return routers.RoutingState(pinned=(
+            request.method not in ('GET', 'HEAD', 'OPTIONS')
+            or request.path.startswith(self.primary_paths)
+            or self.cookie_name in request.COOKIES
+        ))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.state(request)
+        token = routers.activate(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        self.finish(state, response)
+        return response
+
+    async def __acall__(self, request):
+        state = self.state(request)
+        token = routers.activate(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        self.finish(state, response)
+        return response
+
+    def finish(self, state, response):
+        if state.wrote:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax'
+            )
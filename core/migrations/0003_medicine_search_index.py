@@ -0,0 +1,39 @@
+import core.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_index(apps, schema_editor):
+    from core import search
+    search.create_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    from core import search
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_genericbenefit_medicine_description_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineSearchIndex',
+            fields=[
+                ('medicine', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='core.medicine')),
+                ('brand_name', models.TextField()),
+                ('composition', models.TextField()),
+                ('manufacturer', models.TextField()),
+                ('document', core.models.SearchDocumentField(db_column='core_medicine_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'core_medicine_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
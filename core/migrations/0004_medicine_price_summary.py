@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+
+
+def backfill_price_summaries(apps, schema_editor):
+    Medicine = apps.get_model('core', 'Medicine')
+    Price = apps.get_model('core', 'Price')
+    MedicinePriceSummary = apps.get_model('core', 'MedicinePriceSummary')
+    prices = Price.objects.filter(medicine_id=models.OuterRef('pk')).order_by()
+    per_medicine = prices.values('medicine_id')
+    rows = Medicine.objects.annotate(
+        lowest=models.Subquery(prices.order_by('price', 'pk').values('price')[:1]),
+        highest=models.Subquery(prices.order_by('-price', '-pk').values('price')[:1]),
+        lowest_pharmacy_id=models.Subquery(prices.order_by('price', 'pk').values('pharmacy_id')[:1]),
+        count=models.Subquery(per_medicine.annotate(count=models.Count('pk')).values('count')),
+        last_updated=models.Subquery(per_medicine.annotate(latest=models.Max('last_updated')).values('latest')),
+    ).filter(lowest__isnull=False)
+    summaries = [
+        MedicinePriceSummary(
+            medicine_id=row.pk,
+            lowest_price=row.lowest,
+            highest_price=row.highest,
+            lowest_pharmacy_id=row.lowest_pharmacy_id,
+            price_count=row.count,
+            savings_percentage=round((row.highest - row.lowest) / row.highest * 100, 2) if row.highest > 0 else Decimal('0.00'),
+            last_changed=row.last_updated,
+        )
+        for row in rows.iterator(chunk_size=2000)
+    ]
+    MedicinePriceSummary.objects.bulk_create(summaries, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_medicine_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicinePriceSummary',
+            fields=[
+                ('medicine', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='price_summary', serialize=False, to='core.medicine')),
+                ('lowest_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('highest_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('price_count', models.PositiveIntegerField()),
+                ('savings_percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('last_changed', models.DateTimeField()),
+                ('lowest_pharmacy', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.pharmacy')),
+            ],
+            options={
+                'verbose_name_plural': 'Medicine price summaries',
+            },
+        ),
+        migrations.RunPython(backfill_price_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_medicine_price_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceFeedSnapshot',
+            fields=[
+                ('pharmacy', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed_snapshot', serialize=False, to='core.pharmacy')),
+                ('digest', models.CharField(max_length=64)),
+                ('row_count', models.PositiveIntegerField()),
+                ('synced_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+from core.compositions import composition_key
+
+
+def set_composition_keys(apps, schema_editor):
+    # Keys only; manage.py backfill_compositions also fills the Composition tables
+    Medicine = apps.get_model('core', 'Medicine')
+    using = schema_editor.connection.alias
+    pairs = Medicine.objects.using(using).order_by().values_list('composition', 'strength').distinct()
+    for composition, strength in list(pairs):
+        Medicine.objects.using(using).filter(composition=composition, strength=strength).update(
+            composition_key=composition_key(composition, strength)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_price_feed_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Composition',
+            fields=[
+                ('key', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('canonical', models.CharField(max_length=500)),
+                ('name', models.CharField(max_length=500)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='composition_key',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, help_text='Hash of the canonical composition; equal for interchangeable medicines', null=True),
+        ),
+        migrations.CreateModel(
+            name='CompositionIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strength', models.DecimalField(blank=True, decimal_places=6, help_text='In milligrams for masses', max_digits=16, null=True)),
+                ('unit', models.CharField(blank=True, max_length=20)),
+                ('composition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='components', to='core.composition')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='components', to='core.ingredient')),
+            ],
+            options={
+                'unique_together': {('composition', 'ingredient')},
+            },
+        ),
+        migrations.AddField(
+            model_name='composition',
+            name='ingredients',
+            field=models.ManyToManyField(related_name='compositions', through='core.CompositionIngredient', to='core.ingredient'),
+        ),
+        migrations.RunPython(set_composition_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_composition_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlternativeGroup',
+            fields=[
+                ('composition_key', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('members', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
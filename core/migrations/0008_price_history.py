@@ -0,0 +1,45 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_alternative_group'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.PositiveIntegerField()),
+                ('recorded_at', models.DateTimeField()),
+                ('price_paise', models.PositiveIntegerField()),
+                ('medicine', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.medicine')),
+                ('pharmacy', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.pharmacy')),
+            ],
+            options={
+                'verbose_name_plural': 'price history',
+                'indexes': [models.Index(fields=['medicine', 'recorded_at'], name='core_priceh_medicin_ed298f_idx'), models.Index(fields=['pharmacy', 'recorded_at'], name='core_priceh_pharmac_666683_idx'), models.Index(fields=['month', 'recorded_at'], name='core_priceh_month_c811b8_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('low_paise', models.PositiveIntegerField()),
+                ('high_paise', models.PositiveIntegerField()),
+                ('close_paise', models.PositiveIntegerField()),
+                ('total_paise', models.PositiveBigIntegerField()),
+                ('changes', models.PositiveIntegerField()),
+                ('medicine', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.medicine')),
+                ('pharmacy', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.pharmacy')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['pharmacy', 'day'], name='core_priced_pharmac_57fdd6_idx')],
+                'unique_together': {('medicine', 'day', 'pharmacy')},
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_price_alerts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavingsLeaderboardRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(db_index=True)),
+                ('finished_at', models.DateTimeField()),
+                ('full', models.BooleanField(default=False)),
+                ('groups', models.PositiveIntegerField(help_text='Compositions recomputed')),
+                ('entries', models.PositiveIntegerField(help_text='Leaderboard rows written')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CompositionSavings',
+            fields=[
+                ('composition_key', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=500)),
+                ('branded_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('generic_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('savings_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('savings_percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('branded_count', models.PositiveIntegerField()),
+                ('generic_count', models.PositiveIntegerField()),
+                ('refreshed_at', models.DateTimeField()),
+                ('branded_medicine', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.medicine')),
+                ('generic_medicine', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.medicine')),
+            ],
+            options={
+                'verbose_name_plural': 'composition savings',
+                'indexes': [models.Index(fields=['-savings_amount', 'composition_key'], name='core_savings_amount_idx'), models.Index(fields=['-savings_percentage', 'composition_key'], name='core_savings_percentage_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def backfill_missing_price_summaries(apps, schema_editor):
+    """
+    Summaries for priced medicines that have none. 0004 reads and writes the
+    ``default`` database whichever one is being migrated, so any other
+    database is left without summaries.
+    """
+    Medicine = apps.get_model('core', 'Medicine')
+    Price = apps.get_model('core', 'Price')
+    MedicinePriceSummary = apps.get_model('core', 'MedicinePriceSummary')
+    using = schema_editor.connection.alias
+    prices = Price.objects.using(using).filter(medicine_id=models.OuterRef('pk')).order_by()
+    per_medicine = prices.values('medicine_id')
+    rows = Medicine.objects.using(using).filter(price_summary__isnull=True).annotate(
+        lowest=models.Subquery(prices.order_by('price', 'pk').values('price')[:1]),
+        highest=models.Subquery(prices.order_by('-price', '-pk').values('price')[:1]),
+        lowest_pharmacy_id=models.Subquery(prices.order_by('price', 'pk').values('pharmacy_id')[:1]),
+        count=models.Subquery(per_medicine.annotate(count=models.Count('pk')).values('count')),
+        last_updated=models.Subquery(per_medicine.annotate(latest=models.Max('last_updated')).values('latest')),
+    ).filter(lowest__isnull=False)
+    summaries = [
+        MedicinePriceSummary(
+            medicine_id=row.pk,
+            lowest_price=row.lowest,
+            highest_price=row.highest,
+            lowest_pharmacy_id=row.lowest_pharmacy_id,
+            price_count=row.count,
+            savings_percentage=round((row.highest - row.lowest) / row.highest * 100, 2) if row.highest > 0 else Decimal('0.00'),
+            last_changed=row.last_updated,
+        )
+        for row in rows.iterator(chunk_size=2000)
+    ]
+    MedicinePriceSummary.objects.using(using).bulk_create(summaries, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_savings_leaderboard'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_missing_price_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def forget_leaderboard_runs(apps, schema_editor):
+    """
+    Rows written before the leaderboard priced brands at their cheapest, as
+    the results page does, are recomputed by the next refresh, which is a
+    full one when there is no previous run.
+    """
+    SavingsLeaderboardRun = apps.get_model('core', 'SavingsLeaderboardRun')
+    SavingsLeaderboardRun.objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_backfill_missing_price_summaries'),
+    ]
+
+    operations = [
+        migrations.RunPython(forget_leaderboard_runs, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.core.exceptions import ValidationError
 
+from .compositions import composition_key
+
 
 class Medicine(models.Model):
     MEDICINE_TYPE_CHOICES = [
@@ -10,6 +12,10 @@ class Medicine(models.Model):
     
     brand_name = models.CharField(max_length=200, db_index=True)
     composition = models.CharField(max_length=500, db_index=True)
+    composition_key = models.BigIntegerField(
+        null=True, blank=True, editable=False, db_index=True,
+        help_text="Hash of the canonical composition; equal for interchangeable medicines"
+    )
     strength = models.CharField(max_length=100)
     manufacturer = models.CharField(max_length=200)
     medicine_type = models.CharField(max_length=10, choices=MEDICINE_TYPE_CHOICES, default='branded')
@@ -26,6 +32,7 @@ class Medicine(models.Model):
     
     def save(self, *args, **kwargs):
         self.full_clean()
+        self.composition_key = composition_key(self.composition, self.strength)
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -35,6 +42,45 @@ class Medicine(models.Model):
         return self.medicine_type == 'generic'
 
 
+class Ingredient(models.Model):
+    """
+    An active salt under its canonical name (see core.compositions)
+    """
+    name = models.CharField(max_length=200, unique=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class Composition(models.Model):
+    """
+    A canonical composition: its ingredients with numeric strengths, keyed
+    by the hash stored in Medicine.composition_key
+    """
+    key = models.BigIntegerField(primary_key=True)
+    canonical = models.CharField(max_length=500)
+    name = models.CharField(max_length=500)
+    ingredients = models.ManyToManyField(Ingredient, through='CompositionIngredient', related_name='compositions')
+    
+    def __str__(self):
+        return self.name
+
+
+class CompositionIngredient(models.Model):
+    composition = models.ForeignKey(Composition, on_delete=models.CASCADE, related_name='components')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='components')
+    strength = models.DecimalField(
+        max_digits=16, decimal_places=6, null=True, blank=True, help_text="In milligrams for masses"
+    )
+    unit = models.CharField(max_length=20, blank=True)
+    
+    class Meta:
+        unique_together = [['composition', 'ingredient']]
+    
+    def __str__(self):
+        return f"{self.ingredient.name} {self.strength or ''}{self.unit}"
+
+
 class Pharmacy(models.Model):
     name = models.CharField(max_length=200, unique=True)
     website_url = models.URLField(blank=True, null=True)
@@ -80,12 +126,226 @@ class Price(models.Model):
     
     def save(self, *args, **kwargs):
         self.full_clean()
-        super().save(*args, **kwargs)
+        # Keep the post_save price summary refresh in the same transaction
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Price, instance=self)):
+            super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.medicine.brand_name} at {self.pharmacy.name}: ₹{self.price}"
 
 
+class MedicinePriceSummary(models.Model):
+    """
+    Precomputed price aggregates for one medicine, refreshed in the same
+    transaction as every Price save and delete. Medicines without any
+    prices have no summary.
+    """
+    medicine = models.OneToOneField(
+        Medicine, primary_key=True, on_delete=models.CASCADE, related_name='price_summary'
+    )
+    lowest_price = models.DecimalField(max_digits=10, decimal_places=2)
+    highest_price = models.DecimalField(max_digits=10, decimal_places=2)
+    lowest_pharmacy = models.ForeignKey(
+        Pharmacy, on_delete=models.SET_NULL, null=True, related_name='+'
+    )
+    price_count = models.PositiveIntegerField()
+    savings_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    last_changed = models.DateTimeField()
+    
+    class Meta:
+        verbose_name_plural = 'Medicine price summaries'
+    
+    def __str__(self):
+        return f"{self.medicine_id}: ₹{self.lowest_price}-₹{self.highest_price} ({self.price_count} prices)"
+
+
+class AlternativeGroup(models.Model):
+    """
+    The priced medicines sharing a composition key, pre-sorted the way the
+    alternatives list shows them (generics first, then by lowest price),
+    each stored as MEMBER_COLUMNS. Kept current by AlternativeGroupService
+    on every price summary and medicine change.
+    """
+    MEMBER_COLUMNS = [
+        'id', 'brand_name', 'composition', 'strength', 'manufacturer', 'medicine_type',
+        'lowest_price', 'pharmacy_name',
+    ]
+    
+    composition_key = models.BigIntegerField(primary_key=True)
+    members = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.composition_key}: {len(self.members)} medicines"
+
+
+class CompositionSavings(models.Model):
+    """
+    Savings leaderboard row of one composition: its cheapest branded medicine
+    against its cheapest generic, each at its lowest price as on the results
+    page, i.e. the saving find_alternatives offers whoever already buys the
+    cheapest brand. Only compositions whose generic is cheaper have a row. Materialized in bulk by
+    SavingsLeaderboardService.refresh, indexed for top-N by either measure.
+    """
+    composition_key = models.BigIntegerField(primary_key=True)
+    name = models.CharField(max_length=500)
+    branded_medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='+', db_index=False)
+    branded_price = models.DecimalField(max_digits=10, decimal_places=2)
+    generic_medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='+', db_index=False)
+    generic_price = models.DecimalField(max_digits=10, decimal_places=2)
+    savings_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    savings_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    branded_count = models.PositiveIntegerField()
+    generic_count = models.PositiveIntegerField()
+    refreshed_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name_plural = 'composition savings'
+        indexes = [
+            models.Index(fields=['-savings_amount', 'composition_key'], name='core_savings_amount_idx'),
+            models.Index(fields=['-savings_percentage', 'composition_key'], name='core_savings_percentage_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name}: save ₹{self.savings_amount} ({self.savings_percentage}%)"
+
+
+class SavingsLeaderboardRun(models.Model):
+    """
+    One refresh of the savings leaderboard; the last run's start is where
+    the next incremental refresh looks for changed groups from
+    """
+    started_at = models.DateTimeField(db_index=True)
+    finished_at = models.DateTimeField()
+    full = models.BooleanField(default=False)
+    groups = models.PositiveIntegerField(help_text="Compositions recomputed")
+    entries = models.PositiveIntegerField(help_text="Leaderboard rows written")
+    
+    def __str__(self):
+        kind = 'full' if self.full else 'incremental'
+        return f"{kind} refresh at {self.started_at:%Y-%m-%d %H:%M}: {self.groups} groups, {self.entries} rows"
+
+
+class PriceHistory(models.Model):
+    """
+    Append-only log of price changes, one row per change, in integer paise.
+    ``month`` (YYYYMM) partitions the log: compaction rolls rows older than
+    the retention window up into PriceDailyAggregate a month at a time.
+    """
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='+', db_index=False)
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='+', db_index=False)
+    month = models.PositiveIntegerField()
+    recorded_at = models.DateTimeField()
+    price_paise = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name_plural = 'price history'
+        indexes = [
+            models.Index(fields=['medicine', 'recorded_at']),
+            models.Index(fields=['pharmacy', 'recorded_at']),
+            models.Index(fields=['month', 'recorded_at']),
+        ]
+
+    @staticmethod
+    def month_of(moment) -> int:
+        return moment.year * 100 + moment.month
+
+    def __str__(self):
+        return f"{self.medicine_id} at {self.pharmacy_id}: {self.price_paise} paise on {self.recorded_at:%Y-%m-%d %H:%M}"
+
+
+class PriceDailyAggregate(models.Model):
+    """
+    One (UTC) day of compacted price history for a medicine at a pharmacy
+    """
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='+', db_index=False)
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='+', db_index=False)
+    day = models.DateField()
+    low_paise = models.PositiveIntegerField()
+    high_paise = models.PositiveIntegerField()
+    close_paise = models.PositiveIntegerField()
+    total_paise = models.PositiveBigIntegerField()
+    changes = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['medicine', 'day', 'pharmacy']]
+        indexes = [
+            models.Index(fields=['pharmacy', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.medicine_id} at {self.pharmacy_id} on {self.day}: {self.low_paise}-{self.high_paise} paise"
+
+
+class PriceAlert(models.Model):
+    """
+    A request to be emailed once when a medicine's lowest price falls to
+    ``target_price`` or below. Active alerts (not yet triggered) are
+    indexed by (medicine, target_price) for set-based matching.
+    """
+    email = models.EmailField()
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='price_alerts', db_index=False)
+    target_price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    triggered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['medicine', 'target_price'], condition=models.Q(triggered_at__isnull=True),
+                name='core_pricealert_active_idx',
+            ),
+        ]
+
+    def clean(self):
+        if self.target_price is not None and self.target_price <= 0:
+            raise ValidationError({'target_price': 'Target price must be greater than zero'})
+
+    def __str__(self):
+        return f"{self.email}: {self.medicine_id} at ₹{self.target_price} or less"
+
+
+class PriceAlertNotification(models.Model):
+    """
+    Outbox of triggered alerts, written in the same transaction as the price
+    change that triggered them and sent by the ``send_price_alerts`` worker
+    """
+    MAX_ATTEMPTS = 5
+
+    alert = models.ForeignKey(PriceAlert, on_delete=models.CASCADE, related_name='notifications')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.SET_NULL, null=True, related_name='+', db_index=False)
+    created_at = models.DateTimeField()
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(sent_at__isnull=True), name='core_alert_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        state = f"sent {self.sent_at:%Y-%m-%d %H:%M}" if self.sent_at else f"pending ({self.attempts} attempts)"
+        return f"Alert {self.alert_id} at ₹{self.price}: {state}"
+
+
+class PriceFeedSnapshot(models.Model):
+    """
+    Digest of the last price feed synced for a pharmacy, used to skip
+    pharmacies whose feed has not changed
+    """
+    pharmacy = models.OneToOneField(
+        Pharmacy, primary_key=True, on_delete=models.CASCADE, related_name='feed_snapshot'
+    )
+    digest = models.CharField(max_length=64)
+    row_count = models.PositiveIntegerField()
+    synced_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.pharmacy_id}: {self.row_count} rows synced {self.synced_at:%Y-%m-%d %H:%M}"
+
+
 class GenericBenefit(models.Model):
     """
     Stores information about benefits of choosing generic medicines
@@ -102,3 +362,43 @@ class GenericBenefit(models.Model):
     
     def __str__(self):
         return self.title
+
+
+class SearchDocumentField(models.TextField):
+    """
+    The whole-row column of the medicine full-text index, only usable
+    through the ``match`` lookup
+    """
+
+
+@SearchDocumentField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+    
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        if connection.vendor == 'postgresql':
+            return f"{lhs} @@ to_tsquery('simple', {rhs})", lhs_params + rhs_params
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class MedicineSearchIndex(models.Model):
+    """
+    Full-text index over brand name, composition and manufacturer.
+    An FTS5 virtual table on SQLite and a tsvector/GIN table on PostgreSQL,
+    created by migration and kept in sync with Medicine by signals.
+    """
+    medicine = models.OneToOneField(
+        Medicine, primary_key=True, db_column='rowid',
+        on_delete=models.DO_NOTHING, related_name='search_index'
+    )
+    brand_name = models.TextField()
+    composition = models.TextField()
+    manufacturer = models.TextField()
+    document = SearchDocumentField(db_column='core_medicine_fts')
+    rank = models.FloatField()
+    
+    class Meta:
+        managed = False
+        db_table = 'core_medicine_fts'
@@ -0,0 +1,200 @@
+"""
+Per-request profiling: wall time, database queries and time, template render
+time and repeated SQL, collected by ``core.middleware.RequestProfilingMiddleware``
+and aggregated per view in this process.
+
+The request being profiled is kept in a context variable so the database
+execute wrapper and the template backend below can charge their time to it
+without any plumbing through views or services. Context variables follow
+async views into the threads their ORM calls run in, which have their own
+connections, so the execute wrapper is installed on every connection as it
+is opened rather than around each request.
+"""
+import bisect
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+HISTOGRAM_BOUNDS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+TOP_DUPLICATES = 10
+
+_current: ContextVar[Optional['RequestProfile']] = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """
+    Measurements for one request. ``overhead`` is the time the profiler
+    itself spent bookkeeping, so its cost shows up next to what it measures.
+    """
+    __slots__ = ('started', 'queries', 'query_seconds', 'template_seconds', 'overhead', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.overhead = 0.0
+        self.statements = Counter()
+
+    def duplicates(self, threshold: int) -> Dict[str, int]:
+        """
+        SQL statements executed at least ``threshold`` times, i.e. the same
+        query issued once per row instead of once per request (N+1)
+        """
+        return {sql: count for sql, count in self.statements.most_common() if count >= threshold}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            finished = time.perf_counter()
+            self.queries += 1
+            self.query_seconds += finished - started
+            self.statements[sql] += 1
+            self.overhead += time.perf_counter() - finished
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def _add_wrapper(connection, **kwargs):
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+def wrap_open_connections(**kwargs):
+    for connection in connections.all(initialized_only=True):
+        _add_wrapper(connection)
+
+
+def install():
+    """
+    Profile queries on every connection opened from now on, and on those
+    already open in the thread handling each request (request_started runs
+    in the thread the async ORM uses under ASGI)
+    """
+    connection_created.connect(_add_wrapper, dispatch_uid='core.profiling')
+    request_started.connect(wrap_open_connections, dispatch_uid='core.profiling')
+
+
+def current() -> Optional[RequestProfile]:
+    return _current.get()
+
+
+def activate(profile: RequestProfile):
+    return _current.set(profile)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+class ViewStats:
+    __slots__ = (
+        'requests', 'slow', 'wall_ms', 'max_wall_ms', 'db_ms', 'queries', 'template_ms',
+        'overhead_ms', 'histogram', 'duplicates',
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.slow = 0
+        self.wall_ms = 0.0
+        self.max_wall_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.template_ms = 0.0
+        self.overhead_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.duplicates = Counter()
+
+    def as_dict(self) -> dict:
+        requests = self.requests or 1
+        labels = [f'<={bound}ms' for bound in HISTOGRAM_BOUNDS_MS] + [f'>{HISTOGRAM_BOUNDS_MS[-1]}ms']
+        return {
+            'requests': self.requests,
+            'slow': self.slow,
+            'mean_ms': round(self.wall_ms / requests, 3),
+            'max_ms': round(self.max_wall_ms, 3),
+            'mean_db_ms': round(self.db_ms / requests, 3),
+            'mean_queries': round(self.queries / requests, 2),
+            'mean_template_ms': round(self.template_ms / requests, 3),
+            'mean_overhead_ms': round(self.overhead_ms / requests, 4),
+            'histogram': dict(zip(labels, self.histogram)),
+            'duplicate_sql': [
+                {'sql': sql, 'requests': count} for sql, count in self.duplicates.most_common(TOP_DUPLICATES)
+            ],
+        }
+
+
+_stats: Dict[str, ViewStats] = {}
+_stats_lock = threading.Lock()
+
+
+def record(view: str, wall_ms: float, profile: RequestProfile, duplicates: List[str], slow: bool):
+    with _stats_lock:
+        stats = _stats.get(view)
+        if stats is None:
+            stats = _stats[view] = ViewStats()
+        stats.requests += 1
+        stats.slow += slow
+        stats.wall_ms += wall_ms
+        stats.max_wall_ms = max(stats.max_wall_ms, wall_ms)
+        stats.db_ms += profile.query_seconds * 1000
+        stats.queries += profile.queries
+        stats.template_ms += profile.template_seconds * 1000
+        stats.overhead_ms += profile.overhead * 1000
+        stats.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, wall_ms)] += 1
+        stats.duplicates.update(duplicates)
+        # Keep the per-view pattern list bounded
+        if len(stats.duplicates) > TOP_DUPLICATES * 10:
+            stats.duplicates = Counter(dict(stats.duplicates.most_common(TOP_DUPLICATES)))
+
+
+def stats() -> dict:
+    """
+    Aggregated measurements per view name in this worker process
+    """
+    with _stats_lock:
+        return {view: view_stats.as_dict() for view, view_stats in sorted(_stats.items())}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class ProfiledTemplate(Template):
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.template_seconds += time.perf_counter() - started
+
+
+class ProfilingDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing top-level renders for the request
+    profiler (includes and extends are part of their parent's render)
+    """
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name).template, self)
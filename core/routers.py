@@ -0,0 +1,114 @@
+"""
+Primary/replica database routing.
+
+Reads of the catalogue (``core`` models) made while serving a request go to
+a random alias in ``settings.DATABASE_REPLICAS``; everything else, and every
+write, goes to ``default``. Reads leave the replicas for the primary when:
+
+- they run outside a request (management commands, imports, seeding, the
+  shell), since those usually read what they are about to write;
+- they run inside a transaction opened on the primary during the request;
+- the request is pinned: an unsafe method, a path under
+  ``REPLICA_PRIMARY_PATHS`` (the admin), a client that wrote within the last
+  ``REPLICA_STICKY_SECONDS`` (see ``core.middleware.ReplicaRoutingMiddleware``),
+  or a request that has already written.
+
+The last two keep a user's own changes visible to them while the replicas
+catch up. Values cached across requests are read from the replicas too,
+except within ``REPLICA_STICKY_SECONDS`` of an invalidation of what they
+depend on: those fills run under ``primary_reads()`` (see
+``core.cache._fill_reads``), so a fill made while a replica lags cannot
+outlive the invalidation that preceded it.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_APPS = {'core'}
+
+
+class RoutingState:
+    """
+    Per-request routing: ``pinned`` sends reads to the primary, ``wrote``
+    is set once the request writes anything (and pins it from then on).
+    Transactions on the primary opened after the state was created also
+    send reads there; ``atomic_depth`` is how many were already open.
+    """
+    def __init__(self, pinned: bool = False):
+        self.pinned = pinned
+        self.wrote = False
+        self.atomic_depth = len(connections[DEFAULT_DB_ALIAS].atomic_blocks)
+
+    def in_transaction(self) -> bool:
+        return len(connections[DEFAULT_DB_ALIAS].atomic_blocks) > self.atomic_depth
+
+
+_current: ContextVar[Optional[RoutingState]] = ContextVar('replica_routing', default=None)
+# Set inside primary_reads(); per task, so concurrent lookups of one request
+# (e.g. under asyncio.gather) cannot end each other's block
+_primary_reads: ContextVar[bool] = ContextVar('primary_reads', default=False)
+
+
+def current() -> Optional[RoutingState]:
+    return _current.get()
+
+
+def activate(state: RoutingState):
+    return _current.set(state)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Route the block's reads to the primary, e.g. to compute a value that
+    will be cached past the replicas' lag
+    """
+    token = _primary_reads.set(True)
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = current()
+        if state is None or state.pinned or _primary_reads.get() or model._meta.app_label not in REPLICA_APPS:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        aliases = replicas()
+        if not aliases or state.in_transaction():
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        state = current()
+        if state is not None:
+            state.wrote = state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary along with the data
+        if db in replicas():
+            return False
+        return None
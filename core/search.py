@@ -0,0 +1,213 @@
+"""
+Full-text search index for medicines.
+
+On SQLite the index is an FTS5 virtual table ranked with BM25; on PostgreSQL
+it is a side table holding a weighted tsvector behind a GIN index. Both live
+in the ``core_medicine_fts`` table described by ``MedicineSearchIndex``.
+Other database backends fall back to a brand name ``icontains`` scan.
+
+Results are paged by keyset on their sort key (rank, brand name, id): a page
+is "the next N rows after this key", so it costs the same however deep it
+is, and rows added or removed between requests never shift a page.
+"""
+import base64
+import json
+import re
+from typing import Iterable, NamedTuple
+
+from django.db import connections
+from django.db.models import F, FloatField, Q, QuerySet, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'core_medicine_fts'
+
+# Relative weight of brand_name, composition and manufacturer matches
+BM25_WEIGHTS = (10.0, 2.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce({brand_name}, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce({composition}, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce({manufacturer}, '')), 'C')"
+)
+
+
+def is_supported(connection) -> bool:
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def create_index(connection):
+    """
+    Create the index table for the given connection and fill it from the
+    current Medicine rows
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"brand_name, composition, manufacturer, "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', %s)",
+                [f'bm25({weights})']
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {FTS_TABLE} ("
+                f"rowid bigint PRIMARY KEY REFERENCES core_medicine (id) ON DELETE CASCADE, "
+                f"brand_name text NOT NULL, composition text NOT NULL, "
+                f"manufacturer text NOT NULL, {FTS_TABLE} tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {FTS_TABLE}_gin ON {FTS_TABLE} USING GIN ({FTS_TABLE})"
+            )
+        else:
+            return
+    rebuild_index(connection.alias)
+
+
+def drop_index(connection):
+    if is_supported(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def _insert_sql(connection, source: str) -> str:
+    columns = 'rowid, brand_name, composition, manufacturer'
+    if connection.vendor == 'postgresql':
+        document = _POSTGRES_DOCUMENT.format(
+            brand_name='brand_name', composition='composition', manufacturer='manufacturer'
+        )
+        return (
+            f'INSERT INTO {FTS_TABLE} ({columns}, {FTS_TABLE}) '
+            f'SELECT id, brand_name, composition, manufacturer, {document} FROM {source}'
+        )
+    return (
+        f'INSERT INTO {FTS_TABLE} ({columns}) '
+        f'SELECT id, brand_name, composition, manufacturer FROM {source}'
+    )
+
+
+def rebuild_index(using: str = 'default') -> int:
+    """
+    Repopulate the whole index from the Medicine table in one statement
+    Returns: number of indexed medicines
+    """
+    connection = connections[using]
+    if not is_supported(connection):
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(_insert_sql(connection, 'core_medicine'))
+        cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def index_medicines(medicine_ids: Iterable[int], using: str = 'default'):
+    """
+    (Re)index the given medicines, dropping ids that no longer exist
+    """
+    connection = connections[using]
+    ids = list(medicine_ids)
+    if not ids or not is_supported(connection):
+        return
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', ids)
+        cursor.execute(
+            _insert_sql(connection, f'core_medicine WHERE id IN ({placeholders})'), ids
+        )
+
+
+def remove_medicines(medicine_ids: Iterable[int], using: str = 'default'):
+    connection = connections[using]
+    ids = list(medicine_ids)
+    if not ids or not is_supported(connection):
+        return
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', ids)
+
+
+def build_match_query(query: str, vendor: str) -> str:
+    """
+    Turn free text into a prefix query matching every word, e.g.
+    'dolo 65' -> '"dolo"* "65"*' (FTS5) or 'dolo:* & 65:*' (tsquery)
+    Returns: empty string when the text has no searchable words
+    """
+    tokens = _TOKEN_RE.findall(query.lower())
+    if vendor == 'postgresql':
+        return ' & '.join(f'{token}:*' for token in tokens)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_medicines(queryset: QuerySet, query: str) -> QuerySet:
+    """
+    Filter a Medicine queryset down to full-text matches for ``query``.
+    Every row is annotated with ``search_rank`` (lower is better).
+    Returns: QuerySet ordered by rank, then brand name
+    """
+    connection = connections[queryset.db]
+    if not is_supported(connection):
+        return queryset.filter(brand_name__icontains=query).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).order_by('brand_name', 'id')
+
+    match = build_match_query(query, connection.vendor)
+    if not match:
+        return queryset.none()
+
+    queryset = queryset.filter(search_index__document__match=match)
+    if connection.vendor == 'postgresql':
+        rank = RawSQL(
+            f"-ts_rank({FTS_TABLE}.{FTS_TABLE}, to_tsquery('simple', %s))", [match],
+            output_field=FloatField()
+        )
+    else:
+        rank = F('search_index__rank')
+    return queryset.annotate(search_rank=rank).order_by('search_rank', 'brand_name', 'id')
+
+
+class Position(NamedTuple):
+    """
+    Sort key of a search result, the keyset pagination cursor
+    """
+    rank: float
+    brand_name: str
+    id: int
+
+    @classmethod
+    def of(cls, medicine) -> 'Position':
+        return cls(medicine.search_rank, medicine.brand_name, medicine.pk)
+
+    def encode(self) -> str:
+        data = json.dumps([self.rank, self.brand_name, self.id], separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    @classmethod
+    def decode(cls, token: str) -> 'Position':
+        """
+        Raises: ValueError for anything encode() did not produce
+        """
+        try:
+            rank, brand_name, medicine_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise ValueError(f'Invalid search cursor {token!r}')
+        if (not isinstance(rank, (int, float)) or isinstance(rank, bool) or not isinstance(brand_name, str)
+                or not isinstance(medicine_id, int) or isinstance(medicine_id, bool)):
+            raise ValueError(f'Invalid search cursor {token!r}')
+        return cls(float(rank), brand_name, medicine_id)
+
+
+def after(queryset: QuerySet, position: Position) -> QuerySet:
+    """
+    The rows of a search_medicines() queryset that sort after ``position``
+    """
+    return queryset.filter(
+        Q(search_rank__gt=position.rank)
+        | Q(search_rank=position.rank, brand_name__gt=position.brand_name)
+        | Q(search_rank=position.rank, brand_name=position.brand_name, id__gt=position.id)
+    )
@@ -1,28 +1,143 @@
-from typing import List
-from django.db.models import QuerySet
-from .models import Medicine, Price
+from collections import defaultdict
+from datetime import datetime, time as datetime_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+import hashlib
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import (
+    Case, Count, F, IntegerField, Max, Min, OuterRef, Q, QuerySet, Subquery, Sum, Value, When,
+)
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections, transaction
+from django.urls import reverse
+from django.utils import timezone
+from . import search
+from . import snapshot as price_snapshot
+from .basket import UNAVAILABLE, PriceMatrix, to_paise, to_rupees
+from .models import (
+    AlternativeGroup, Composition, CompositionSavings, Medicine, MedicinePriceSummary, Price, PriceAlert,
+    PriceAlertNotification, PriceDailyAggregate, PriceHistory, SavingsLeaderboardRun,
+)
+
+
+class SearchPage(NamedTuple):
+    medicines: List[Medicine]
+    next_cursor: Optional[str]
+    count: int
+    count_exact: bool
 
 
 class MedicineSearchService:
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 100
+    # Matches are counted up to this many; broader queries report "1,000+"
+    COUNT_LIMIT = 1000
+    
     @staticmethod
     def search_medicines(query: str) -> QuerySet[Medicine]:
         """
-        Search for medicines by brand name (case-insensitive, partial match)
+        Search for medicines by brand name, composition or manufacturer
+        (case-insensitive, every word matched as a prefix), best matches first.
+        Only the first page; use search_page for the rest.
         Returns: QuerySet of matching Medicine objects
         """
         if not query:
             return Medicine.objects.none()
         
-        return Medicine.objects.filter(
-            brand_name__icontains=query
-        ).order_by('brand_name')[:50]
+        return search.search_medicines(Medicine.objects.all(), query)[:MedicineSearchService.PAGE_SIZE]
+    
+    @staticmethod
+    def search_page(query: str, cursor: Optional[str] = None, page_size: int = PAGE_SIZE,
+                    select_related: Tuple[str, ...] = ()) -> SearchPage:
+        """
+        One page of search_medicines results, starting after ``cursor`` (the
+        ``next_cursor`` of the previous page). Pages are fetched by keyset on
+        (rank, brand name, id), so every page costs the same as the first.
+        With the price snapshot enabled the medicines and their price
+        summaries are read from it (see core.snapshot).
+        Raises: ValueError for a malformed cursor
+        """
+        page_size = max(1, min(page_size, MedicineSearchService.MAX_PAGE_SIZE))
+        position = search.Position.decode(cursor) if cursor else None
+        if not query:
+            return SearchPage([], None, 0, True)
+        
+        queryset = search.search_medicines(Medicine.objects.select_related(*select_related), query)
+        if position is not None:
+            queryset = search.after(queryset, position)
+        snapshot = price_snapshot.current()
+        if snapshot is not None and set(select_related) <= {'price_summary'}:
+            medicines = MedicineSearchService._from_snapshot(snapshot, queryset[:page_size + 1], select_related)
+        else:
+            medicines = list(queryset[:page_size + 1])
+        next_cursor = None
+        if len(medicines) > page_size:
+            medicines = medicines[:page_size]
+            next_cursor = search.Position.of(medicines[-1]).encode()
+        count, exact = MedicineSearchService.count_matches(query)
+        return SearchPage(medicines, next_cursor, count, exact)
+    
+    @staticmethod
+    def _from_snapshot(snapshot: price_snapshot.PriceSnapshot, queryset: QuerySet[Medicine],
+                       select_related: Tuple[str, ...]) -> List[Medicine]:
+        """
+        The queryset's medicines read from the price snapshot (which also
+        gives their price summaries), the query only returning ids and ranks.
+        Those the snapshot cannot vouch for are fetched by id.
+        """
+        ranks = dict(queryset.values_list('pk', 'search_rank'))
+        found = snapshot.medicines(ranks)
+        missing = [medicine_id for medicine_id in ranks if medicine_id not in found]
+        if missing:
+            found.update(Medicine.objects.select_related(*select_related).in_bulk(missing))
+        medicines = []
+        for medicine_id, rank in ranks.items():
+            # Left out if deleted in between
+            if medicine_id in found:
+                medicine = found[medicine_id]
+                medicine.search_rank = rank
+                medicines.append(medicine)
+        return medicines
+    
+    @staticmethod
+    async def asearch_page(query: str, cursor: Optional[str] = None, page_size: int = PAGE_SIZE,
+                           select_related: Tuple[str, ...] = ()) -> SearchPage:
+        """
+        Async version of search_page
+        """
+        return await sync_to_async(MedicineSearchService.search_page)(query, cursor, page_size, select_related)
+    
+    @staticmethod
+    def count_matches(query: str) -> Tuple[int, bool]:
+        """
+        Number of medicines matching ``query``, counted up to COUNT_LIMIT and
+        cached for SEARCH_COUNT_CACHE_TIMEOUT seconds, so it is approximate
+        while the catalogue changes
+        Returns: (count, whether it is exact rather than capped)
+        """
+        cache = caches[getattr(settings, 'RESULTS_CACHE_ALIAS', 'default')]
+        normalized = ' '.join(query.lower().split())
+        key = f"medcompare:search-count:{hashlib.sha1(normalized.encode('utf-8')).hexdigest()}"
+        count = cache.get(key)
+        if count is None:
+            limit = MedicineSearchService.COUNT_LIMIT
+            count = search.search_medicines(Medicine.objects.all(), query).order_by().values('pk')[:limit + 1].count()
+            cache.set(key, count, getattr(settings, 'SEARCH_COUNT_CACHE_TIMEOUT', 300))
+        return min(count, MedicineSearchService.COUNT_LIMIT), count <= MedicineSearchService.COUNT_LIMIT
 
 
 class PriceComparisonService:
     @staticmethod
     def get_price_comparison(medicine_id: int) -> dict:
         """
-        Get all prices for a medicine, sorted by price ascending
+        Get all prices for a medicine, sorted by price ascending.
+        Lowest/highest price and savings come from the precomputed summary.
+        Answered from the price snapshot without any query when
+        it is enabled and current for the medicine (see core.snapshot).
         Returns: {
             'medicine': Medicine object,
             'prices': List of Price objects sorted by price,
@@ -31,10 +146,80 @@ class PriceComparisonService:
             'savings_percentage': Decimal
         }
         """
-        medicine = Medicine.objects.get(id=medicine_id)
-        prices = medicine.prices.select_related('pharmacy').order_by('price')
+        found = PriceComparisonService._from_snapshot([medicine_id])
+        if medicine_id in found:
+            return found[medicine_id]
+        
+        medicine = Medicine.objects.select_related('price_summary').get(id=medicine_id)
+        summary = getattr(medicine, 'price_summary', None)
+        prices = list(PriceComparisonService._prices(medicine)) if summary else []
+        return PriceComparisonService._comparison(medicine, summary, prices)
+    
+    @staticmethod
+    async def aget_price_comparison(medicine_id: int) -> dict:
+        """
+        Async version of get_price_comparison
+        """
+        found = PriceComparisonService._from_snapshot([medicine_id])
+        if medicine_id in found:
+            return found[medicine_id]
         
-        if not prices.exists():
+        medicine = await Medicine.objects.select_related('price_summary').aget(id=medicine_id)
+        summary = getattr(medicine, 'price_summary', None)
+        prices = [price async for price in PriceComparisonService._prices(medicine)] if summary else []
+        return PriceComparisonService._comparison(medicine, summary, prices)
+    
+    @staticmethod
+    def get_price_comparisons(medicine_ids: Iterable[int]) -> Dict[int, dict]:
+        """
+        get_price_comparison for many medicines in two queries, whatever
+        their number (none for those the price snapshot answers). Unknown
+        ids are left out.
+        Returns: {medicine id: comparison dict}
+        """
+        found = PriceComparisonService._from_snapshot(set(medicine_ids))
+        medicine_ids = [medicine_id for medicine_id in set(medicine_ids) if medicine_id not in found]
+        if not medicine_ids:
+            return found
+        
+        medicines = Medicine.objects.select_related('price_summary').in_bulk(medicine_ids)
+        prices: Dict[int, List[Price]] = {medicine_id: [] for medicine_id in medicines}
+        priced = [m.pk for m in medicines.values() if getattr(m, 'price_summary', None) is not None]
+        if priced:
+            for price in Price.objects.filter(medicine_id__in=priced).select_related('pharmacy').order_by(
+                'medicine_id', 'price', 'pk'
+            ):
+                prices[price.medicine_id].append(price)
+        found.update(
+            (medicine_id, PriceComparisonService._comparison(
+                medicine, getattr(medicine, 'price_summary', None), prices[medicine_id]
+            ))
+            for medicine_id, medicine in medicines.items()
+        )
+        return found
+    
+    @staticmethod
+    def _from_snapshot(medicine_ids: Iterable[int]) -> Dict[int, dict]:
+        """
+        Comparisons of the medicines the price snapshot is current for
+        """
+        snapshot = price_snapshot.current()
+        if snapshot is None:
+            return {}
+        return {
+            medicine_id: PriceComparisonService._comparison(
+                medicine, getattr(medicine, 'price_summary', None), prices
+            )
+            for medicine_id, (medicine, prices) in snapshot.prices(medicine_ids).items()
+        }
+    
+    @staticmethod
+    def _prices(medicine: Medicine) -> QuerySet[Price]:
+        return medicine.prices.select_related('pharmacy').order_by('price', 'pk')
+    
+    @staticmethod
+    def _comparison(medicine: Medicine, summary: Optional[MedicinePriceSummary], prices: List[Price]) -> dict:
+        if summary is None:
             return {
                 'medicine': medicine,
                 'prices': [],
@@ -43,29 +228,33 @@ class PriceComparisonService:
                 'savings_percentage': 0
             }
         
-        lowest = prices.first().price
-        highest = prices.last().price
-        
-        if highest > 0:
-            savings = ((highest - lowest) / highest) * 100
-        else:
-            savings = 0
-        
         return {
             'medicine': medicine,
-            'prices': list(prices),
-            'lowest_price': lowest,
-            'highest_price': highest,
-            'savings_percentage': round(savings, 2)
+            'prices': prices,
+            'lowest_price': summary.lowest_price,
+            'highest_price': summary.highest_price,
+            'savings_percentage': summary.savings_percentage
         }
 
 
+def _generic_rank() -> Case:
+    return Case(
+        When(medicine_type='generic', then=Value(0)),
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+
+
 class AlternativeFinderService:
     @staticmethod
     def find_alternatives(medicine_id: int) -> List[dict]:
         """
         Find alternative medicines with same composition, excluding the original.
         Prioritizes generic alternatives and calculates savings.
+        Answered from the price snapshot when it is enabled and
+        current for the medicine's composition (see core.snapshot), else
+        reads the medicine's precomputed AlternativeGroup in one query, and
+        only falls back to querying medicines when it has none.
         Returns: List of dicts with {
             'medicine': Medicine object,
             'lowest_price': Decimal,
@@ -75,41 +264,893 @@ class AlternativeFinderService:
             'savings_percentage': Decimal
         } sorted by lowest_price ascending
         """
-        medicine = Medicine.objects.get(id=medicine_id)
+        found = AlternativeFinderService._from_snapshot(medicine_id)
+        if found is not None:
+            return found
+        
+        group = AlternativeFinderService._group(medicine_id).first()
+        if group is not None:
+            return AlternativeFinderService._group_results(medicine_id, group)
+        
+        medicine = Medicine.objects.select_related('price_summary').get(id=medicine_id)
+        alternatives = AlternativeFinderService._alternatives(medicine)
+        return AlternativeFinderService._results(medicine, alternatives)
+    
+    @staticmethod
+    async def afind_alternatives(medicine_id: int) -> List[dict]:
+        """
+        Async version of find_alternatives
+        """
+        found = AlternativeFinderService._from_snapshot(medicine_id)
+        if found is not None:
+            return found
+        
+        group = await AlternativeFinderService._group(medicine_id).afirst()
+        if group is not None:
+            return AlternativeFinderService._group_results(medicine_id, group)
         
+        medicine = await Medicine.objects.select_related('price_summary').aget(id=medicine_id)
+        alternatives = [alt async for alt in AlternativeFinderService._alternatives(medicine)]
+        return AlternativeFinderService._results(medicine, alternatives)
+    
+    @staticmethod
+    def _from_snapshot(medicine_id: int) -> Optional[List[dict]]:
+        snapshot = price_snapshot.current()
+        found = snapshot.alternatives(medicine_id) if snapshot is not None else None
+        if found is None:
+            return None
+        original_price, members = found
+        return [
+            AlternativeFinderService._result(original_price, alt, lowest_price, pharmacy_name)
+            for alt, lowest_price, pharmacy_name in members
+        ]
+    
+    @staticmethod
+    def _group(medicine_id: int) -> QuerySet[AlternativeGroup]:
+        return AlternativeGroup.objects.filter(
+            composition_key=Subquery(Medicine.objects.filter(pk=medicine_id).values('composition_key'))
+        )
+    
+    @staticmethod
+    def _alternatives(medicine: Medicine) -> QuerySet[Medicine]:
+        # Find priced medicines with the same canonical composition, excluding
+        # current medicine. Sort: generics first, then by lowest price
+        if medicine.composition_key is None:
+            same_composition = Q(composition=medicine.composition)
+        else:
+            same_composition = Q(composition_key=medicine.composition_key)
+        return Medicine.objects.filter(
+            same_composition,
+            price_summary__isnull=False
+        ).exclude(id=medicine.id).select_related(
+            'price_summary__lowest_pharmacy'
+        ).annotate(
+            generic_rank=_generic_rank(),
+        ).order_by('generic_rank', 'price_summary__lowest_price', 'pk')
+    
+    @staticmethod
+    def _results(medicine: Medicine, alternatives: Iterable[Medicine]) -> List[dict]:
         # Get the original medicine's lowest price for comparison
-        original_lowest = medicine.prices.order_by('price').first()
-        original_price = original_lowest.price if original_lowest else None
-        
-        # Find medicines with same composition, excluding current medicine
-        alternatives = Medicine.objects.filter(
-            composition=medicine.composition
-        ).exclude(id=medicine_id)
-        
-        # For each alternative, get the lowest price
-        results = []
-        for alt in alternatives:
-            lowest_price_record = alt.prices.select_related('pharmacy').order_by('price').first()
-            
-            if lowest_price_record:
-                savings_amount = 0
-                savings_percentage = 0
-                
-                if original_price:
-                    savings_amount = original_price - lowest_price_record.price
-                    if original_price > 0:
-                        savings_percentage = (savings_amount / original_price) * 100
+        original_summary = getattr(medicine, 'price_summary', None)
+        original_price = original_summary.lowest_price if original_summary else None
+        return [
+            AlternativeFinderService._result(
+                original_price, alt, alt.price_summary.lowest_price,
+                alt.price_summary.lowest_pharmacy.name if alt.price_summary.lowest_pharmacy else '',
+            )
+            for alt in alternatives
+        ]
+    
+    @staticmethod
+    def _group_results(medicine_id: int, group: AlternativeGroup) -> List[dict]:
+        # Members are already in display order and carry everything shown,
+        # so the medicines are rebuilt from the row rather than queried
+        original_price = next(
+            (Decimal(member[6]) for member in group.members if member[0] == medicine_id), None
+        )
+        fields = AlternativeGroup.MEMBER_COLUMNS[:6]
+        return [
+            AlternativeFinderService._result(
+                original_price, Medicine.from_db(group._state.db, fields, member[:6]),
+                Decimal(member[6]), member[7],
+            )
+            for member in group.members if member[0] != medicine_id
+        ]
+    
+    @staticmethod
+    def _result(original_price: Optional[Decimal], alt: Medicine, lowest_price: Decimal,
+                pharmacy_name: str) -> dict:
+        savings_amount = 0
+        savings_percentage = 0
+        
+        if original_price:
+            savings_amount = original_price - lowest_price
+            if original_price > 0:
+                savings_percentage = (savings_amount / original_price) * 100
+        
+        return {
+            'medicine': alt,
+            'lowest_price': lowest_price,
+            'pharmacy_name': pharmacy_name,
+            'is_generic': alt.is_generic(),
+            'savings_amount': round(savings_amount, 2),
+            'savings_percentage': round(savings_percentage, 2)
+        }
+
+
+class AlternativeGroupService:
+    @staticmethod
+    def _member_rows(medicines: QuerySet) -> QuerySet:
+        """
+        (composition_key, *MEMBER_COLUMNS) rows of priced medicines
+        """
+        return medicines.filter(price_summary__isnull=False, composition_key__isnull=False).values_list(
+            'composition_key', 'pk', 'brand_name', 'composition', 'strength', 'manufacturer', 'medicine_type',
+            'price_summary__lowest_price', 'price_summary__lowest_pharmacy__name',
+        )
+    
+    @staticmethod
+    def _member(row: tuple) -> list:
+        member = list(row[1:])
+        member[6] = str(member[6])
+        member[7] = member[7] or ''
+        return member
+    
+    @staticmethod
+    def _sort_key(member: list) -> tuple:
+        return member[5] != 'generic', Decimal(member[6]), member[0]
+    
+    @staticmethod
+    def rebuild(composition_keys: Optional[Iterable[int]] = None, using: str = 'default',
+                batch_size: int = 500) -> Tuple[int, int]:
+        """
+        Recompute groups from the price summaries in bulk, for every
+        composition or only the given ones, one ordered scan per chunk of keys
+        Returns: (groups written, members written)
+        """
+        if composition_keys is None:
+            chunks = [None]
+        else:
+            composition_keys = sorted({key for key in composition_keys if key is not None})
+            chunks = [composition_keys[i:i + batch_size] for i in range(0, len(composition_keys), batch_size)]
+        
+        groups_written = members_written = 0
+        with transaction.atomic(using=using):
+            for chunk in chunks:
+                groups = AlternativeGroup.objects.using(using)
+                medicines = Medicine.objects.using(using)
+                if chunk is not None:
+                    groups = groups.filter(pk__in=chunk)
+                    medicines = medicines.filter(composition_key__in=chunk)
+                groups.delete()
                 
-                results.append({
-                    'medicine': alt,
-                    'lowest_price': lowest_price_record.price,
-                    'pharmacy_name': lowest_price_record.pharmacy.name,
-                    'is_generic': alt.is_generic(),
-                    'savings_amount': round(savings_amount, 2),
-                    'savings_percentage': round(savings_percentage, 2)
+                rows = AlternativeGroupService._member_rows(medicines).order_by(
+                    'composition_key', _generic_rank(), 'price_summary__lowest_price', 'pk'
+                )
+                batch: List[AlternativeGroup] = []
+                for key, members in groupby(rows.iterator(chunk_size=5000), key=itemgetter(0)):
+                    group = AlternativeGroup(
+                        composition_key=key, members=[AlternativeGroupService._member(row) for row in members]
+                    )
+                    batch.append(group)
+                    members_written += len(group.members)
+                    if len(batch) >= batch_size:
+                        AlternativeGroup.objects.using(using).bulk_create(batch)
+                        groups_written += len(batch)
+                        batch = []
+                if batch:
+                    AlternativeGroup.objects.using(using).bulk_create(batch)
+                    groups_written += len(batch)
+        return groups_written, members_written
+    
+    @staticmethod
+    def rebuild_for_medicines(medicine_ids: Iterable[int], using: str = 'default', chunk_size: int = 2000):
+        """
+        Rebuild the groups of many medicines, for bulk writes that bypass
+        model signals
+        """
+        ids = list(medicine_ids)
+        composition_keys = set()
+        for start in range(0, len(ids), chunk_size):
+            composition_keys.update(
+                Medicine.objects.using(using).filter(pk__in=ids[start:start + chunk_size])
+                .values_list('composition_key', flat=True).distinct()
+            )
+        AlternativeGroupService.rebuild(composition_keys, using=using)
+    
+    @staticmethod
+    def refresh_members(medicine_ids: Iterable[int], previous_keys: Iterable[Optional[int]] = (),
+                        using: str = 'default'):
+        """
+        Re-place a few medicines in their groups after a price, type or
+        composition change, removing them from ``previous_keys`` groups and
+        from their own if they are no longer priced or no longer exist
+        """
+        ids = set(medicine_ids)
+        current = Medicine.objects.using(using).filter(pk__in=ids)
+        rows = list(AlternativeGroupService._member_rows(current))
+        keys = {row[0] for row in rows}
+        keys.update(current.filter(composition_key__isnull=False).values_list('composition_key', flat=True))
+        keys.update(key for key in previous_keys if key is not None)
+        if not keys:
+            return
+        
+        with transaction.atomic(using=using):
+            groups = {
+                group.pk: group
+                for group in AlternativeGroup.objects.using(using).select_for_update().filter(pk__in=keys)
+            }
+            for key in keys:
+                group = groups.get(key) or AlternativeGroup(composition_key=key)
+                members = [member for member in group.members if member[0] not in ids]
+                members.extend(AlternativeGroupService._member(row) for row in rows if row[0] == key)
+                if members:
+                    group.members = sorted(members, key=AlternativeGroupService._sort_key)
+                    group.save(using=using)
+                elif group.pk in groups:
+                    group.delete(using=using)
+
+
+class SavingsLeaderboardService:
+    ORDERS = {'amount': 'savings_amount', 'percentage': 'savings_percentage'}
+    MAX_TOP = 100
+    
+    @staticmethod
+    def _insert(cursor, using: str, composition_keys: Optional[List[int]], now) -> int:
+        """
+        Compute and write the leaderboard rows of ``composition_keys`` (or of
+        every composition) in one INSERT ... SELECT grouping the priced
+        medicines by composition
+        Returns: number of rows written
+        """
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        medicines = quote(Medicine._meta.db_table)
+        summaries = quote(MedicinePriceSummary._meta.db_table)
+        compositions = quote(Composition._meta.db_table)
+        leaderboard = quote(CompositionSavings._meta.db_table)
+        keys_filter = ''
+        if composition_keys is not None:
+            keys_filter = f'AND m.composition_key IN ({", ".join(["%s"] * len(composition_keys))}) '
+        # The medicine priced at the group's branded or generic price, the
+        # cheapest of its type as PriceComparisonService prices them
+        pick = (
+            f'(SELECT pm.id FROM {medicines} pm INNER JOIN {summaries} ps ON ps.medicine_id = pm.id '
+            f'WHERE pm.composition_key = g.composition_key AND pm.medicine_type = %s '
+            f'ORDER BY ps.lowest_price, pm.id LIMIT 1)'
+        )
+        cursor.execute(
+            f'INSERT INTO {leaderboard} (composition_key, name, branded_medicine_id, branded_price, '
+            f'generic_medicine_id, generic_price, savings_amount, savings_percentage, branded_count, '
+            f'generic_count, refreshed_at) '
+            f'SELECT g.composition_key, COALESCE(c.name, g.composition), {pick}, g.branded_price, '
+            f'{pick}, g.generic_price, ROUND(g.branded_price - g.generic_price, 2), '
+            f'ROUND((g.branded_price - g.generic_price) * 100.0 / g.branded_price, 2), '
+            f'g.branded_count, g.generic_count, %s '
+            f'FROM (SELECT m.composition_key, MIN(m.composition) AS composition, '
+            f'MIN(CASE WHEN m.medicine_type = %s THEN s.lowest_price END) AS branded_price, '
+            f'MIN(CASE WHEN m.medicine_type = %s THEN s.lowest_price END) AS generic_price, '
+            f'SUM(CASE WHEN m.medicine_type = %s THEN 1 ELSE 0 END) AS branded_count, '
+            f'SUM(CASE WHEN m.medicine_type = %s THEN 1 ELSE 0 END) AS generic_count '
+            f'FROM {medicines} m INNER JOIN {summaries} s ON s.medicine_id = m.id '
+            f'WHERE m.composition_key IS NOT NULL {keys_filter}GROUP BY m.composition_key) g '
+            f'LEFT OUTER JOIN {compositions} c ON c.{quote("key")} = g.composition_key '
+            f'WHERE g.generic_price < g.branded_price',
+            [
+                'branded', 'generic', connection.ops.adapt_datetimefield_value(now),
+                'branded', 'generic', 'branded', 'generic', *(composition_keys or []),
+            ],
+        )
+        return cursor.rowcount
+    
+    @staticmethod
+    def refresh(full: bool = False, using: str = 'default', batch_size: int = 500) -> SavingsLeaderboardRun:
+        """
+        Recompute the leaderboard rows of the compositions whose alternative
+        group changed (AlternativeGroup.updated_at) or disappeared since the
+        previous run, or of every composition on the first run and with
+        ``full``, in one transaction. Call cache.invalidate_savings_leaderboard
+        afterwards.
+        Returns: the recorded SavingsLeaderboardRun
+        """
+        started = timezone.now()
+        entries = CompositionSavings.objects.using(using)
+        groups = AlternativeGroup.objects.using(using)
+        previous = SavingsLeaderboardRun.objects.using(using).order_by('-started_at').first()
+        full = full or previous is None
+        # Groups changed shortly before the previous run started are looked
+        # at again, for transactions that were still open when it read them
+        overlap = timedelta(seconds=getattr(settings, 'SAVINGS_LEADERBOARD_OVERLAP_SECONDS', 300))
+        written = 0
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            if full:
+                recomputed = groups.count()
+                entries.delete()
+                written = SavingsLeaderboardService._insert(cursor, using, None, started)
+            else:
+                changed = set(groups.filter(
+                    updated_at__gte=previous.started_at - overlap
+                ).values_list('pk', flat=True))
+                # Groups are deleted once none of their medicines is priced
+                changed.update(entries.exclude(composition_key__in=groups.values('pk')).values_list('pk', flat=True))
+                keys = sorted(changed)
+                recomputed = len(keys)
+                for start in range(0, len(keys), batch_size):
+                    chunk = keys[start:start + batch_size]
+                    entries.filter(pk__in=chunk).delete()
+                    written += SavingsLeaderboardService._insert(cursor, using, chunk, started)
+            return SavingsLeaderboardRun.objects.using(using).create(
+                started_at=started, finished_at=timezone.now(), full=full, groups=recomputed, entries=written,
+            )
+    
+    @staticmethod
+    def top(order: str = 'amount', limit: int = MAX_TOP) -> List[CompositionSavings]:
+        """
+        The leaderboard's first ``limit`` rows by savings ``order``
+        ('amount' or 'percentage'), read by a scan of its index
+        Raises: ValueError for an unknown order
+        """
+        if order not in SavingsLeaderboardService.ORDERS:
+            raise ValueError(f'Unknown savings order: {order!r}')
+        return list(
+            CompositionSavings.objects.select_related('branded_medicine', 'generic_medicine')
+            .order_by(f'-{SavingsLeaderboardService.ORDERS[order]}', 'composition_key')[:limit]
+        )
+
+
+class BasketOptimizerService:
+    @staticmethod
+    def optimize(basket: Dict[int, int], max_pharmacies: int = 3, substitutes: bool = False) -> dict:
+        """
+        Cheapest way to buy a basket of {medicine id: quantity}: everything
+        from one pharmacy, and split across at most ``max_pharmacies``.
+        With ``substitutes`` any medicine of the same composition may stand in
+        for a basket item (the alternatives AlternativeFinderService lists).
+        Runs three queries whatever the basket size.
+        Returns: {
+            'items': List of {'medicine': Medicine, 'quantity': int} that can be bought,
+            'missing': List of unknown medicine ids,
+            'unavailable': List of Medicine objects no pharmacy stocks,
+            'lowest_total': Decimal, every item at its cheapest pharmacy (or None),
+            'single_pharmacy': plan, or None if no pharmacy stocks every item,
+            'split': plan, or None if no ``max_pharmacies`` pharmacies stock every item
+        } where a plan is {
+            'pharmacies': List of Pharmacy objects,
+            'total': Decimal,
+            'lines': List of {'requested': Medicine, 'medicine': Medicine, 'pharmacy': Pharmacy,
+                              'quantity': int, 'unit_price': Decimal, 'subtotal': Decimal},
+            'exact': bool, False if the split was found heuristically
+        }
+        """
+        if max_pharmacies < 1:
+            raise ValueError('max_pharmacies must be at least 1')
+        medicines = Medicine.objects.in_bulk(list(basket))
+        requested = [medicines[medicine_id] for medicine_id in basket if medicine_id in medicines]
+        missing = [medicine_id for medicine_id in basket if medicine_id not in medicines]
+        
+        # Items are matched to price cells by medicine, or with substitutes by
+        # (composition key, None). Like AlternativeFinderService, medicines
+        # without a composition key have no substitutes: theirs is (None, id).
+        key = BasketOptimizerService._substitute_key if substitutes else (lambda medicine: medicine.pk)
+        if not requested:
+            cells = []
+        elif substitutes:
+            own = Case(When(medicine__composition_key__isnull=True, then=F('medicine_id')))
+            cells = [
+                ((composition_key, medicine_id), pharmacy_id, lowest)
+                for composition_key, medicine_id, pharmacy_id, lowest in Price.objects.filter(
+                    Q(medicine__composition_key__in={m.composition_key for m in requested})
+                    | Q(medicine_id__in=[m.pk for m in requested if m.composition_key is None])
+                ).annotate(own=own).values_list('medicine__composition_key', 'own', 'pharmacy_id')
+                .annotate(lowest=Min('price')).order_by()
+            ]
+        else:
+            cells = list(
+                Price.objects.filter(medicine_id__in=[m.pk for m in requested])
+                .values_list('medicine_id', 'pharmacy_id', 'price')
+            )
+        stocked = {cell[0] for cell in cells}
+        items = [m for m in requested if key(m) in stocked]
+        
+        positions: Dict[object, List[int]] = {}
+        for position, medicine in enumerate(items):
+            positions.setdefault(key(medicine), []).append(position)
+        matrix = PriceMatrix(len(items))
+        for cell_key, pharmacy_id, price in cells:
+            paise = to_paise(price)
+            for position in positions[cell_key]:
+                matrix.add(position, pharmacy_id, paise * basket[items[position].pk])
+        
+        single = matrix.best_single()
+        split, exact = matrix.best_split(max_pharmacies)
+        plans = {
+            'single_pharmacy': ([single], True) if single is not None else None,
+            'split': (split, exact) if split and matrix.cost(split) < UNAVAILABLE else None,
+        }
+        return {
+            'items': [{'medicine': m, 'quantity': basket[m.pk]} for m in items],
+            'missing': missing,
+            'unavailable': [m for m in requested if key(m) not in stocked],
+            'lowest_total': to_rupees(sum(matrix.lowest())) if items else None,
+            **BasketOptimizerService._plans(plans, items, basket, matrix, key, substitutes),
+        }
+    
+    @staticmethod
+    def _substitute_key(medicine: Medicine) -> tuple:
+        return medicine.composition_key, medicine.pk if medicine.composition_key is None else None
+    
+    @staticmethod
+    def _plans(plans: dict, items: List[Medicine], basket: Dict[int, int], matrix: PriceMatrix,
+               key, substitutes: bool) -> dict:
+        # Which medicine and pharmacy row backs every chosen cell, in one query
+        assignments = {name: matrix.assignment(chosen[0]) for name, chosen in plans.items() if chosen}
+        cells = {
+            (key(items[position]), pharmacy_id, matrix.columns[pharmacy_id][position] // basket[items[position].pk])
+            for assignment in assignments.values() for position, pharmacy_id in enumerate(assignment)
+        }
+        candidates: Dict[tuple, List[Price]] = {}
+        if cells:
+            condition = Q()
+            for cell_key, pharmacy_id, paise in cells:
+                if not substitutes:
+                    medicines = Q(medicine_id=cell_key)
+                elif cell_key[1] is not None:
+                    medicines = Q(medicine_id=cell_key[1])
+                else:
+                    medicines = Q(medicine__composition_key=cell_key[0])
+                condition |= medicines & Q(pharmacy_id=pharmacy_id, price=to_rupees(paise))
+            for price in Price.objects.filter(condition).select_related('medicine', 'pharmacy').order_by('pk'):
+                candidates.setdefault((key(price.medicine), price.pharmacy_id), []).append(price)
+        
+        result = {}
+        for name, chosen in plans.items():
+            if not chosen:
+                result[name] = None
+                continue
+            pharmacy_ids, exact = chosen
+            lines = []
+            for position, pharmacy_id in enumerate(assignments[name]):
+                requested = items[position]
+                offers = candidates[key(requested), pharmacy_id]
+                # Keep the prescribed medicine when a substitute only ties on price
+                price = next((offer for offer in offers if offer.medicine_id == requested.pk), offers[0])
+                quantity = basket[requested.pk]
+                lines.append({
+                    'requested': requested,
+                    'medicine': price.medicine,
+                    'pharmacy': price.pharmacy,
+                    'quantity': quantity,
+                    'unit_price': price.price,
+                    'subtotal': price.price * quantity,
                 })
+            pharmacies = {line['pharmacy'].pk: line['pharmacy'] for line in lines}
+            result[name] = {
+                'pharmacies': [pharmacies[pharmacy_id] for pharmacy_id in pharmacy_ids],
+                'total': sum((line['subtotal'] for line in lines), Decimal('0.00')),
+                'lines': lines,
+                'exact': exact,
+            }
+        return result
+
+
+SUMMARY_FIELDS = [
+    'lowest_price', 'highest_price', 'lowest_pharmacy', 'price_count',
+    'savings_percentage', 'last_changed',
+]
+
+
+def savings_percentage(lowest: Decimal, highest: Decimal) -> Decimal:
+    """
+    How much cheaper the lowest price is than the highest, in percent
+    """
+    if not highest or highest <= 0:
+        return Decimal('0.00')
+    return round(((highest - lowest) / highest) * 100, 2)
+
+
+class PriceSummaryService:
+    @staticmethod
+    def live_aggregates(medicine_ids: Optional[Iterable[int]] = None, using: str = 'default') -> QuerySet:
+        """
+        Aggregates computed straight from the Price table, one row per priced
+        medicine, each resolved by seeks on the (medicine, price) index
+        Returns: QuerySet of dicts with medicine_id, lowest, highest, count,
+        lowest_pharmacy_id and last_updated
+        """
+        prices = Price.objects.using(using).filter(medicine_id=OuterRef('pk')).order_by()
+        per_medicine = prices.values('medicine_id')
+        
+        medicines = Medicine.objects.using(using)
+        if medicine_ids is not None:
+            medicines = medicines.filter(pk__in=list(medicine_ids))
+        return medicines.annotate(
+            lowest=Subquery(prices.order_by('price', 'pk').values('price')[:1]),
+            highest=Subquery(prices.order_by('-price', '-pk').values('price')[:1]),
+            lowest_pharmacy_id=Subquery(prices.order_by('price', 'pk').values('pharmacy_id')[:1]),
+            count=Subquery(per_medicine.annotate(count=Count('pk')).values('count')),
+            last_updated=Subquery(per_medicine.annotate(latest=Max('last_updated')).values('latest')),
+        ).filter(lowest__isnull=False).order_by('pk').values(
+            'lowest', 'highest', 'lowest_pharmacy_id', 'count', 'last_updated', medicine_id=F('pk')
+        )
+    
+    @staticmethod
+    def _summary(row: dict, last_changed) -> MedicinePriceSummary:
+        return MedicinePriceSummary(
+            medicine_id=row['medicine_id'],
+            lowest_price=row['lowest'],
+            highest_price=row['highest'],
+            lowest_pharmacy_id=row['lowest_pharmacy_id'],
+            price_count=row['count'],
+            savings_percentage=savings_percentage(row['lowest'], row['highest']),
+            last_changed=last_changed,
+        )
+    
+    @staticmethod
+    def _upsert(summaries: List[MedicinePriceSummary], using: str):
+        MedicinePriceSummary.objects.using(using).bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=['medicine'],
+            update_fields=SUMMARY_FIELDS,
+        )
+    
+    @staticmethod
+    def refresh(medicine_id: int, using: str = 'default') -> Optional[MedicinePriceSummary]:
+        """
+        Recompute one medicine's summary from its prices, deleting it when
+        no prices are left
+        Returns: the stored MedicinePriceSummary, or None
+        """
+        row = PriceSummaryService.live_aggregates([medicine_id], using).first()
+        if row is None:
+            MedicinePriceSummary.objects.using(using).filter(medicine_id=medicine_id).delete()
+            return None
         
-        # Sort: generics first, then by lowest price
-        results.sort(key=lambda x: (not x['is_generic'], x['lowest_price']))
+        summary = PriceSummaryService._summary(row, timezone.now())
+        PriceSummaryService._upsert([summary], using)
+        return summary
+    
+    @staticmethod
+    def rebuild(medicine_ids: Optional[Iterable[int]] = None, using: str = 'default',
+                batch_size: int = 2000) -> int:
+        """
+        Recompute summaries in bulk, for all medicines or only the given ones,
+        and drop summaries of medicines that no longer have prices
+        Returns: number of summaries written
+        """
+        if medicine_ids is None:
+            chunks = [None]
+        else:
+            medicine_ids = sorted(set(medicine_ids))
+            chunks = [medicine_ids[i:i + batch_size] for i in range(0, len(medicine_ids), batch_size)]
         
-        return results
+        written = 0
+        for chunk in chunks:
+            batch = []
+            for row in PriceSummaryService.live_aggregates(chunk, using).iterator(chunk_size=batch_size):
+                batch.append(PriceSummaryService._summary(row, row['last_updated']))
+                if len(batch) >= batch_size:
+                    PriceSummaryService._upsert(batch, using)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                PriceSummaryService._upsert(batch, using)
+                written += len(batch)
+            
+            stale = MedicinePriceSummary.objects.using(using).exclude(
+                medicine_id__in=Price.objects.using(using).values('medicine_id')
+            )
+            if chunk is not None:
+                stale = stale.filter(medicine_id__in=chunk)
+            stale.delete()
+        return written
+    
+    @staticmethod
+    def verify(using: str = 'default') -> List[int]:
+        """
+        Compare every stored summary against the live Price aggregates
+        Returns: ids of medicines whose summary is missing, stale or orphaned
+        """
+        stored = {
+            summary.medicine_id: summary
+            for summary in MedicinePriceSummary.objects.using(using).iterator(chunk_size=2000)
+        }
+        mismatched = []
+        for row in PriceSummaryService.live_aggregates(using=using).iterator(chunk_size=2000):
+            summary = stored.pop(row['medicine_id'], None)
+            if summary is None or (
+                summary.lowest_price,
+                summary.highest_price,
+                summary.lowest_pharmacy_id,
+                summary.price_count,
+                summary.savings_percentage,
+            ) != (
+                row['lowest'],
+                row['highest'],
+                row['lowest_pharmacy_id'],
+                row['count'],
+                savings_percentage(row['lowest'], row['highest']),
+            ):
+                mismatched.append(row['medicine_id'])
+        mismatched.extend(stored)
+        return sorted(mismatched)
+
+
+class PriceHistoryService:
+    @staticmethod
+    def record(changes: Iterable[Tuple[int, int, Decimal]], at=None, using: str = 'default') -> int:
+        """
+        Append (medicine_id, pharmacy_id, new price) changes to the history
+        Returns: number of rows written
+        """
+        at = at or timezone.now()
+        month = PriceHistory.month_of(at)
+        rows = [
+            PriceHistory(medicine_id=medicine_id, pharmacy_id=pharmacy_id, month=month, recorded_at=at,
+                         price_paise=to_paise(price))
+            for medicine_id, pharmacy_id, price in changes
+        ]
+        PriceHistory.objects.using(using).bulk_create(rows, batch_size=2000)
+        return len(rows)
+    
+    @staticmethod
+    def _windows(days: int, using: str, filters: dict) -> Tuple[QuerySet, QuerySet]:
+        """
+        Raw changes and daily aggregates of the last ``days`` days. A day is
+        either still raw or compacted, never both, so the two never overlap.
+        """
+        since = timezone.now() - timedelta(days=days)
+        return (
+            PriceHistory.objects.using(using).filter(recorded_at__gte=since, **filters).order_by(),
+            PriceDailyAggregate.objects.using(using).filter(day__gte=since.date(), **filters).order_by(),
+        )
+    
+    @staticmethod
+    def stats(medicine_id: Optional[int] = None, pharmacy_id: Optional[int] = None, days: int = 90,
+              using: str = 'default') -> Optional[dict]:
+        """
+        Lowest, highest and average recorded price over the last ``days`` days
+        for a medicine, a pharmacy, or a medicine at one pharmacy, in two
+        index range scans. The average is over recorded changes, not
+        weighted by how long each price lasted.
+        Returns: {'lowest', 'highest', 'average', 'changes'}, or None if
+        nothing was recorded
+        """
+        filters = {}
+        if medicine_id is not None:
+            filters['medicine_id'] = medicine_id
+        if pharmacy_id is not None:
+            filters['pharmacy_id'] = pharmacy_id
+        raw, daily = PriceHistoryService._windows(days, using, filters)
+        raw = raw.aggregate(low=Min('price_paise'), high=Max('price_paise'), total=Sum('price_paise'), changes=Count('pk'))
+        daily = daily.aggregate(low=Min('low_paise'), high=Max('high_paise'), total=Sum('total_paise'),
+                                changes=Sum('changes'))
+        return PriceHistoryService._combine(raw, daily)
+    
+    @staticmethod
+    def stats_by_pharmacy(medicine_id: int, days: int = 90, using: str = 'default') -> Dict[int, dict]:
+        """
+        stats() of one medicine at each pharmacy that changed its price
+        Returns: {pharmacy_id: stats}
+        """
+        raw, daily = PriceHistoryService._windows(days, using, {'medicine_id': medicine_id})
+        found: Dict[int, list] = defaultdict(list)
+        for row in raw.values('pharmacy_id').annotate(
+            low=Min('price_paise'), high=Max('price_paise'), total=Sum('price_paise'), changes=Count('pk')
+        ):
+            found[row['pharmacy_id']].append(row)
+        for row in daily.values('pharmacy_id').annotate(
+            low=Min('low_paise'), high=Max('high_paise'), total=Sum('total_paise'), changes=Sum('changes')
+        ):
+            found[row['pharmacy_id']].append(row)
+        return {pharmacy_id: PriceHistoryService._combine(*rows) for pharmacy_id, rows in sorted(found.items())}
+    
+    @staticmethod
+    def _combine(*rows: dict) -> Optional[dict]:
+        rows = [row for row in rows if row['changes']]
+        if not rows:
+            return None
+        changes = sum(row['changes'] for row in rows)
+        return {
+            'lowest': to_rupees(min(row['low'] for row in rows)),
+            'highest': to_rupees(max(row['high'] for row in rows)),
+            'average': to_rupees(round(sum(row['total'] for row in rows) / changes)),
+            'changes': changes,
+        }
+    
+    @staticmethod
+    def compact(before, using: str = 'default', batch_size: int = 5000) -> Tuple[int, int]:
+        """
+        Roll the raw history recorded before midnight UTC of the date
+        ``before`` into daily aggregates, one month partition per
+        transaction, merging into aggregates that already exist
+        Returns: (raw rows removed, daily aggregates written)
+        """
+        cutoff = datetime.combine(before, datetime_time.min, tzinfo=dt_timezone.utc)
+        history = PriceHistory.objects.using(using).filter(recorded_at__lt=cutoff)
+        months = sorted(set(history.order_by().values_list('month', flat=True).distinct()))
+        removed = written = 0
+        for month in months:
+            with transaction.atomic(using=using):
+                rows = history.filter(month=month)
+                days: Dict[tuple, list] = {}
+                for medicine_id, pharmacy_id, recorded_at, paise in rows.order_by(
+                    'medicine_id', 'pharmacy_id', 'recorded_at', 'pk'
+                ).values_list('medicine_id', 'pharmacy_id', 'recorded_at', 'price_paise').iterator(chunk_size=batch_size):
+                    key = (medicine_id, pharmacy_id, recorded_at.date())
+                    day = days.get(key)
+                    if day is None:
+                        if len(days) >= batch_size:
+                            written += PriceHistoryService._merge_days(days, using)
+                            days = {}
+                        days[key] = [paise, paise, paise, paise, 1]
+                    else:
+                        day[0] = min(day[0], paise)
+                        day[1] = max(day[1], paise)
+                        day[2] = paise
+                        day[3] += paise
+                        day[4] += 1
+                written += PriceHistoryService._merge_days(days, using)
+                # No signals or relations point at history rows, so this is one DELETE
+                removed += rows.delete()[0]
+        return removed, written
+    
+    @staticmethod
+    def _merge_days(days: Dict[tuple, list], using: str) -> int:
+        """
+        Upsert {(medicine_id, pharmacy_id, day): [low, high, close, total, changes]}
+        """
+        if not days:
+            return 0
+        existing = {
+            (aggregate.medicine_id, aggregate.pharmacy_id, aggregate.day): aggregate
+            for aggregate in PriceDailyAggregate.objects.using(using).filter(
+                medicine_id__in={medicine_id for medicine_id, _, _ in days},
+                day__range=(min(day for _, _, day in days), max(day for _, _, day in days)),
+            )
+        }
+        aggregates = []
+        for key, (low, high, close, total, changes) in days.items():
+            previous = existing.get(key)
+            if previous is not None:
+                # Earlier compaction of the same day only saw earlier changes
+                low, high = min(low, previous.low_paise), max(high, previous.high_paise)
+                total, changes = total + previous.total_paise, changes + previous.changes
+            aggregates.append(PriceDailyAggregate(
+                medicine_id=key[0], pharmacy_id=key[1], day=key[2], low_paise=low, high_paise=high,
+                close_paise=close, total_paise=total, changes=changes,
+            ))
+        PriceDailyAggregate.objects.using(using).bulk_create(
+            aggregates,
+            update_conflicts=True,
+            unique_fields=['medicine', 'day', 'pharmacy'],
+            update_fields=['low_paise', 'high_paise', 'close_paise', 'total_paise', 'changes'],
+        )
+        return len(aggregates)
+    
+    @staticmethod
+    def drop_daily(before, using: str = 'default') -> int:
+        """
+        Delete daily aggregates older than the date ``before``
+        Returns: number of aggregates deleted
+        """
+        return PriceDailyAggregate.objects.using(using).filter(day__lt=before).delete()[0]
+
+
+class PriceAlertService:
+    @staticmethod
+    def subscribe(email: str, medicine_id: int, target_price: Decimal, using: str = 'default') -> PriceAlert:
+        """
+        Save a new alert, triggering it at once if the medicine already sells
+        at or below the target
+        """
+        alert = PriceAlert(email=email, medicine_id=medicine_id, target_price=target_price)
+        alert.full_clean()
+        with transaction.atomic(using=using):
+            alert.save(using=using)
+            if PriceAlertService.match([medicine_id], using=using):
+                alert.refresh_from_db(fields=['triggered_at'])
+        return alert
+    
+    @staticmethod
+    def match(medicine_ids: Iterable[int], using: str = 'default', chunk_size: int = 5000) -> int:
+        """
+        Queue a notification for every active alert on ``medicine_ids`` whose
+        medicine now sells at or below its target, and retire those alerts.
+        Each chunk of medicines costs at most two statements however many
+        alerts they have: an INSERT ... SELECT seeking each medicine's
+        summary and then its active alerts at or above the price (a range
+        scan of their partial index), and an UPDATE retiring the alerts that
+        meet the same condition and were just queued. Call it after the
+        summaries have been refreshed, in the same transaction.
+        Returns: number of notifications queued
+        """
+        medicine_ids = sorted(set(medicine_ids))
+        if not medicine_ids:
+            return 0
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        alerts = quote(PriceAlert._meta.db_table)
+        summaries = quote(MedicinePriceSummary._meta.db_table)
+        outbox = quote(PriceAlertNotification._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        queued = 0
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            for start in range(0, len(medicine_ids), chunk_size):
+                chunk = medicine_ids[start:start + chunk_size]
+                placeholders = ', '.join(['%s'] * len(chunk))
+                # Filtering the summaries (not the alerts) lets the planner drive the join from them
+                cursor.execute(
+                    f'INSERT INTO {outbox} (alert_id, price, pharmacy_id, created_at, attempts, last_error) '
+                    f'SELECT a.id, s.lowest_price, s.lowest_pharmacy_id, %s, 0, %s '
+                    f'FROM {summaries} s INNER JOIN {alerts} a ON a.medicine_id = s.medicine_id '
+                    f'WHERE s.medicine_id IN ({placeholders}) AND a.triggered_at IS NULL '
+                    f'AND a.target_price >= s.lowest_price',
+                    [now, '', *chunk],
+                )
+                if not cursor.rowcount:
+                    continue
+                queued += cursor.rowcount
+                # The same condition, restricted to alerts queued just now so
+                # one committed in between by another connection stays active
+                cursor.execute(
+                    f'UPDATE {alerts} SET triggered_at = %s '
+                    f'WHERE medicine_id IN ({placeholders}) AND triggered_at IS NULL '
+                    f'AND target_price >= (SELECT s.lowest_price FROM {summaries} s '
+                    f'WHERE s.medicine_id = {alerts}.medicine_id) '
+                    f'AND EXISTS (SELECT 1 FROM {outbox} o WHERE o.alert_id = {alerts}.id AND o.created_at = %s)',
+                    [now, *chunk, now],
+                )
+        return queued
+    
+    @staticmethod
+    def results_url(medicine: Medicine) -> str:
+        """
+        Absolute URL of the medicine's results page, for links in emails
+        """
+        return f'{settings.SITE_URL.rstrip("/")}{reverse("results", args=[medicine.pk])}'
+    
+    @staticmethod
+    def message(notification: PriceAlertNotification) -> EmailMessage:
+        medicine = notification.alert.medicine
+        where = f' at {notification.pharmacy.name}' if notification.pharmacy else ''
+        return EmailMessage(
+            subject=f'{medicine.brand_name} is now ₹{notification.price}',
+            body=(
+                f'{medicine.brand_name} ({medicine.composition}) is now available for '
+                f'₹{notification.price}{where}, at or below your target of ₹{notification.alert.target_price}.\n\n'
+                f'Compare prices and alternatives: {PriceAlertService.results_url(medicine)}\n'
+            ),
+            to=[notification.alert.email],
+        )
+    
+    @staticmethod
+    def send_pending(batch_size: int = 500, using: str = 'default') -> Tuple[int, int]:
+        """
+        Email one batch of pending notifications, oldest first, over a single
+        mail connection. Failed sends are retried by later batches until
+        they reach PriceAlertNotification.MAX_ATTEMPTS.
+        Returns: (sent, failed)
+        """
+        pending = list(
+            PriceAlertNotification.objects.using(using)
+            .filter(sent_at__isnull=True, attempts__lt=PriceAlertNotification.MAX_ATTEMPTS)
+            .select_related('alert__medicine', 'pharmacy').order_by('pk')[:batch_size]
+        )
+        if not pending:
+            return 0, 0
+        sent = failed = 0
+        with get_connection() as mail:
+            for notification in pending:
+                notification.attempts += 1
+                try:
+                    mail.send_messages([PriceAlertService.message(notification)])
+                except Exception as exc:
+                    notification.last_error = f'{type(exc).__name__}: {exc}'
+                    failed += 1
+                else:
+                    notification.sent_at = timezone.now()
+                    notification.last_error = ''
+                    sent += 1
+        PriceAlertNotification.objects.using(using).bulk_update(pending, ['attempts', 'sent_at', 'last_error'])
+        return sent, failed
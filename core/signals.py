@@ -0,0 +1,151 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import autocomplete, cache, compositions, search
+from .models import GenericBenefit, Medicine, Pharmacy, Price
+from .services import AlternativeGroupService, PriceAlertService, PriceHistoryService, PriceSummaryService
+
+
+@receiver(post_save, sender=Medicine)
+def index_saved_medicine(sender, instance, using, **kwargs):
+    search.index_medicines([instance.pk], using=using)
+    autocomplete.medicine_saved(instance, using=using)
+
+
+@receiver(post_delete, sender=Medicine)
+def unindex_deleted_medicine(sender, instance, using, **kwargs):
+    search.remove_medicines([instance.pk], using=using)
+    autocomplete.medicine_deleted(instance.pk, using=using)
+
+
+def _deleted_with(origin, model) -> bool:
+    """Whether a delete started from ``model``, given its origin instance or queryset"""
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+@receiver(post_save, sender=Price)
+def refresh_price_summary(sender, instance, using, **kwargs):
+    # Price.save wraps the save in a transaction, and deletes run inside the
+    # deletion collector's transaction, so the summary never lags its prices
+    PriceSummaryService.refresh(instance.medicine_id, using=using)
+    AlternativeGroupService.refresh_members([instance.medicine_id], using=using)
+
+
+@receiver(post_delete, sender=Price)
+def refresh_deleted_price(sender, instance, using, origin=None, **kwargs):
+    # Prices cascading from a medicine or pharmacy delete are refreshed once
+    # for the whole delete rather than once per price
+    if _deleted_with(origin, Medicine):
+        # The summary goes with the medicine, whose own receivers drop it
+        # from its group and invalidate its results
+        return
+    if _deleted_with(origin, Pharmacy):
+        if not hasattr(origin, '_deleted_price_medicines'):
+            origin._deleted_price_medicines = set()
+        origin._deleted_price_medicines.add(instance.medicine_id)
+        return
+    refresh_price_summary(sender, instance, using)
+    invalidate_price_results(sender, instance, using)
+
+
+@receiver(post_delete, sender=Pharmacy)
+def refresh_pharmacy_medicines(sender, instance, using, origin=None, **kwargs):
+    # The collector deletes prices before their pharmacies, so the first
+    # pharmacy's signal already knows every medicine the delete touched
+    medicine_ids = getattr(origin, '_deleted_price_medicines', None)
+    if not medicine_ids:
+        return
+    del origin._deleted_price_medicines
+    PriceSummaryService.rebuild(medicine_ids, using=using)
+    AlternativeGroupService.rebuild_for_medicines(medicine_ids, using=using)
+    cache.invalidate_medicines(medicine_ids, using=using)
+
+
+@receiver(post_save, sender=Price)
+def match_price_alerts(sender, instance, using, **kwargs):
+    # Runs after refresh_price_summary, which is connected first
+    PriceAlertService.match([instance.medicine_id], using=using)
+
+
+@receiver(pre_save, sender=Price)
+def remember_previous_price(sender, instance, using, **kwargs):
+    instance._previous_price = None
+    if instance.pk:
+        instance._previous_price = Price.objects.using(using).filter(
+            pk=instance.pk
+        ).values_list('price', flat=True).first()
+
+
+@receiver(post_save, sender=Price)
+def record_price_change(sender, instance, using, **kwargs):
+    if instance.price != getattr(instance, '_previous_price', None):
+        PriceHistoryService.record(
+            [(instance.medicine_id, instance.pharmacy_id, instance.price)], at=instance.last_updated, using=using
+        )
+
+
+@receiver(post_save, sender=Medicine)
+def register_composition(sender, instance, using, **kwargs):
+    compositions.register([(instance.composition, instance.strength)], using=using)
+
+
+@receiver(pre_save, sender=Medicine)
+def remember_previous_composition(sender, instance, using, **kwargs):
+    instance._previous_composition_key = None
+    if instance.pk:
+        instance._previous_composition_key = Medicine.objects.using(using).filter(
+            pk=instance.pk
+        ).values_list('composition_key', flat=True).first()
+
+
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def refresh_alternative_group(sender, instance, using, **kwargs):
+    previous = [getattr(instance, '_previous_composition_key', None), instance.composition_key]
+    AlternativeGroupService.refresh_members([instance.pk], previous_keys=previous, using=using)
+
+
+@receiver(post_save, sender=Pharmacy)
+def refresh_pharmacy_groups(sender, instance, using, created, **kwargs):
+    # Groups show each medicine's cheapest pharmacy by name, and cached
+    # comparisons every pharmacy that prices it
+    if created:
+        return
+    medicines = Medicine.objects.using(using)
+    AlternativeGroupService.rebuild(
+        medicines.filter(price_summary__lowest_pharmacy=instance)
+        .values_list('composition_key', flat=True).distinct(),
+        using=using,
+    )
+    for composition_key in (
+        medicines.filter(prices__pharmacy=instance).values_list('composition_key', flat=True).distinct()
+    ):
+        cache.invalidate_composition(composition_key, using=using)
+
+
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def invalidate_medicine_results(sender, instance, using, **kwargs):
+    cache.invalidate_composition(instance.composition_key, using=using)
+    previous = getattr(instance, '_previous_composition_key', None)
+    if previous is not None and previous != instance.composition_key:
+        cache.invalidate_composition(previous, using=using)
+
+
+@receiver(post_save, sender=Price)
+def invalidate_price_results(sender, instance, using, **kwargs):
+    if Price.medicine.is_cached(instance):
+        cache.invalidate_composition(instance.medicine.composition_key, using=using)
+        return
+    found = Medicine.objects.using(using).filter(pk=instance.medicine_id).values_list('composition_key', flat=True)
+    for composition_key in found:
+        cache.invalidate_composition(composition_key, using=using)
+
+
+@receiver(post_save, sender=GenericBenefit)
+@receiver(post_delete, sender=GenericBenefit)
+def invalidate_generic_benefits(sender, instance, using, **kwargs):
+    cache.invalidate_generic_benefits(using=using)
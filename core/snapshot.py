@@ -0,0 +1,682 @@
+"""
+Immutable snapshot of the whole catalogue and price list, so searches,
+price comparisons and alternatives can be answered without the ORM.
+
+Everything is stored column-wise in flat buffers. Prices are sorted by
+(medicine, price, price id): price id, pharmacy id, price in paise, price
+type code and last update (microseconds since the epoch). Medicine ids are
+kept once per medicine, sorted, with the offset of each medicine's run of
+prices, so a medicine's prices are one binary search away and its cheapest
+price is the first of its run. A second ordering lists the priced medicines
+by composition key in alternatives order (generics first, then by lowest
+price), so a composition's alternatives are one run too. Text is UTF-8 in
+one buffer per column addressed by offsets; compositions, strengths and
+manufacturers, shared by many medicines, are stored once and referenced by
+code.
+
+Snapshots are never modified, and each carries a ``version``. They come
+from one of two places:
+
+- built in the process (``refresh()``): with ``PRICE_SNAPSHOT`` on,
+  ``current()`` rebuilds snapshots older than ``PRICE_SNAPSHOT_MAX_AGE``
+  seconds in a background thread while the previous one keeps answering.
+  Every worker holds its own copy.
+- exported to ``PRICE_SNAPSHOT_FILE`` by ``manage.py export_price_snapshot``
+  (``export()``), which every worker maps read-only: the columns are
+  memoryviews of the mapping, so all workers share the page cache's single
+  copy and opening a snapshot only parses its header. A new export replaces
+  the file by rename, never in place, so mapped versions stay valid;
+  ``current()`` stats the file at most every
+  ``PRICE_SNAPSHOT_CHECK_INTERVAL`` seconds and maps the new one when it
+  changed.
+
+Either way the module's reference is swapped in a single assignment, so
+readers see one snapshot whole.
+
+Answers are never staler than the results cache: a snapshot records the
+version counter of every composition (see ``core.cache``) before reading
+the prices, and a medicine whose composition has been invalidated since
+is answered from the database until the next snapshot. Workers can only
+vouch for an exported snapshot when they share the results cache with the
+exporting process (memcached or Redis, not the per-process LocMemCache);
+otherwise every lookup falls back to the database.
+"""
+import bisect
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import count
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .basket import to_rupees
+from .models import Medicine, MedicinePriceSummary, Pharmacy, Price
+
+logger = logging.getLogger('core.snapshot')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+PRICE_TYPES = [value for value, _ in Price.PRICE_TYPE_CHOICES]
+PRICE_TYPE_CODES = {value: code for code, value in enumerate(PRICE_TYPES)}
+MEDICINE_TYPES = [value for value, _ in Medicine.MEDICINE_TYPE_CHOICES]
+MEDICINE_FIELDS = [field.attname for field in Medicine._meta.concrete_fields]
+PRICE_FIELDS = [field.attname for field in Price._meta.concrete_fields]
+PHARMACY_FIELDS = [field.attname for field in Pharmacy._meta.concrete_fields]
+SUMMARY_FIELDS = [field.attname for field in MedicinePriceSummary._meta.concrete_fields]
+# The fields alternatives carry, as in AlternativeGroup.MEMBER_COLUMNS
+ALTERNATIVE_FIELDS = ['id', 'brand_name', 'composition', 'strength', 'manufacturer', 'medicine_type']
+
+# Bits of a medicine's flags column: which of its nullable fields are null
+NO_COMPOSITION_KEY = 1
+NO_DESCRIPTION = 2
+NO_USES = 4
+NO_SIDE_EFFECTS = 8
+
+# Numeric columns and their array typecodes, in file order
+COLUMNS = {
+    '_medicine_ids': 'q', '_offsets': 'q', '_composition_keys': 'q', '_flags': 'b', '_medicine_types': 'b',
+    '_created': 'q', '_composition_codes': 'i', '_strength_codes': 'i', '_manufacturer_codes': 'i',
+    '_price_ids': 'q', '_pharmacy_ids': 'q', '_paise': 'q', '_price_types': 'b', '_updated': 'q',
+    '_alternative_keys': 'q', '_alternatives': 'q', '_version_keys': 'q', '_versions': 'q',
+}
+# Text columns: one string per medicine, or per code for the shared ones
+STRING_COLUMNS = (
+    '_brand_names', '_descriptions', '_uses', '_side_effects', '_compositions', '_strengths', '_manufacturers',
+)
+MAGIC = b'MCSNAP01'
+ALIGNMENT = 8
+
+Alternative = Tuple[Medicine, Decimal, str]
+
+
+def to_micros(moment: datetime) -> int:
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def _aligned(position: int) -> int:
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+class PackedStrings:
+    """
+    A column of strings stored as one UTF-8 buffer and the offset of each
+    string's end, written to and mapped from snapshot files as is
+    """
+    __slots__ = ('blob', 'offsets')
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def pack(cls, values: Iterable[str]) -> 'PackedStrings':
+        offsets = array('q', [0])
+        parts = []
+        end = 0
+        for value in values:
+            data = value.encode('utf-8')
+            parts.append(data)
+            end += len(data)
+            offsets.append(end)
+        return cls(b''.join(parts), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+
+class PriceSnapshot:
+    """
+    Every medicine and price at one point in time. Lookups return model
+    instances built from the columns (never saved), in the orders the ORM
+    queries of the search, PriceComparisonService and
+    AlternativeFinderService use.
+    """
+    __slots__ = (
+        'version', 'built_at', 'using', 'path', 'source', '_mapping', '_keyless_version', '_pharmacies',
+        *COLUMNS, *STRING_COLUMNS,
+    )
+
+    def __init__(self, version: int, using: str = DEFAULT_DB_ALIAS):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.using = using
+        # The file and its (device, inode, mtime, size) for mapped snapshots
+        self.path: Optional[str] = None
+        self.source: Optional[tuple] = None
+        self._mapping: Optional[mmap.mmap] = None
+        self._keyless_version: Optional[int] = None
+        self._pharmacies: Dict[int, tuple] = {}
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, array(typecode))
+        self._offsets.append(0)
+
+    @classmethod
+    def build(cls, version: int = 0, using: str = DEFAULT_DB_ALIAS, chunk_size: int = 5000) -> 'PriceSnapshot':
+        """
+        Read every medicine and price in one transaction, after recording
+        the current composition versions
+        """
+        from . import cache as results_cache  # core.cache imports the services, which use this module
+
+        snapshot = cls(version, using)
+        medicines = Medicine.objects.using(using)
+        # Versions are read before the transaction's first read, so a change
+        # committed in between leaves its composition marked as changed
+        versions = results_cache.composition_versions(
+            medicines.order_by().values_list('composition_key', flat=True).distinct()
+        )
+        snapshot._keyless_version = versions.pop(None, None)
+        for composition_key in sorted(versions):
+            snapshot._version_keys.append(composition_key)
+            snapshot._versions.append(versions[composition_key])
+        texts = {name: [] for name in STRING_COLUMNS}
+        codes = {'_compositions': {}, '_strengths': {}, '_manufacturers': {}}
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            snapshot._pharmacies = {row[0]: row for row in Pharmacy.objects.using(using).values_list(*PHARMACY_FIELDS)}
+            # Read without the ORM's per-row converters, prices already in paise
+            cursor.execute(
+                f'SELECT medicine_id, id, pharmacy_id, CAST(ROUND(price * 100) AS BIGINT), price_type, last_updated '
+                f'FROM {quote(Price._meta.db_table)} ORDER BY medicine_id, price, id'
+            )
+            prices = snapshot._rows(cursor, chunk_size)
+            pending = next(prices, None)
+            for row in medicines.order_by('pk').values_list(*MEDICINE_FIELDS).iterator(chunk_size=chunk_size):
+                snapshot._add_medicine(row, texts, codes)
+                while pending is not None and pending[0] <= row[0]:
+                    if pending[0] == row[0]:
+                        snapshot._add_price(pending)
+                    pending = next(prices, None)
+                snapshot._offsets.append(len(snapshot._price_ids))
+        for name, values in codes.items():
+            texts[name] = list(values)
+        for name, values in texts.items():
+            setattr(snapshot, name, PackedStrings.pack(values))
+        snapshot._index_alternatives()
+        return snapshot
+
+    def _add_medicine(self, row: tuple, texts: Dict[str, list], codes: Dict[str, dict]):
+        values = dict(zip(MEDICINE_FIELDS, row))
+        flags = 0
+        for field, flag in (
+            ('composition_key', NO_COMPOSITION_KEY), ('description', NO_DESCRIPTION), ('uses', NO_USES),
+            ('side_effects', NO_SIDE_EFFECTS),
+        ):
+            if values[field] is None:
+                flags |= flag
+        self._medicine_ids.append(values['id'])
+        self._composition_keys.append(values['composition_key'] or 0)
+        self._flags.append(flags)
+        self._medicine_types.append(MEDICINE_TYPES.index(values['medicine_type']))
+        self._created.append(to_micros(values['created_at']))
+        for column, field in (('_composition_codes', 'composition'), ('_strength_codes', 'strength'),
+                              ('_manufacturer_codes', 'manufacturer')):
+            known = codes[f'_{field}s']
+            getattr(self, column).append(known.setdefault(values[field], len(known)))
+        texts['_brand_names'].append(values['brand_name'])
+        texts['_descriptions'].append(values['description'] or '')
+        texts['_uses'].append(values['uses'] or '')
+        texts['_side_effects'].append(values['side_effects'] or '')
+
+    def _rows(self, cursor, chunk_size: int):
+        """
+        The cursor's price rows with last_updated in microseconds
+        """
+        connection = connections[self.using]
+        micros = {}
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            for row in rows:
+                # Prices written together share a timestamp, so each is parsed once
+                stamp = micros.get(row[5])
+                if stamp is None:
+                    moment = row[5] if isinstance(row[5], datetime) else parse_datetime(row[5])
+                    if timezone.is_naive(moment):
+                        moment = timezone.make_aware(moment, connection.timezone)
+                    stamp = micros[row[5]] = to_micros(moment)
+                yield row[0], row[1], row[2], row[3], row[4], stamp
+
+    def _add_price(self, row: tuple):
+        _, price_id, pharmacy_id, paise, price_type, updated = row
+        self._price_ids.append(price_id)
+        self._pharmacy_ids.append(pharmacy_id)
+        self._paise.append(paise)
+        self._price_types.append(PRICE_TYPE_CODES[price_type])
+        self._updated.append(updated)
+
+    def _index_alternatives(self):
+        generic = MEDICINE_TYPES.index('generic')
+        positions = sorted(
+            (
+                position for position in range(len(self._medicine_ids))
+                if not self._flags[position] & NO_COMPOSITION_KEY
+                and self._offsets[position] < self._offsets[position + 1]
+            ),
+            key=lambda position: (
+                self._composition_keys[position], self._medicine_types[position] != generic,
+                self._paise[self._offsets[position]], self._medicine_ids[position],
+            ),
+        )
+        self._alternatives = array('q', positions)
+        self._alternative_keys = array('q', (self._composition_keys[position] for position in positions))
+
+    def _buffers(self):
+        """
+        (name, typecode, buffer) of every column, in file order
+        """
+        for name, typecode in COLUMNS.items():
+            yield name, typecode, getattr(self, name)
+        for name in STRING_COLUMNS:
+            strings = getattr(self, name)
+            yield f'{name}.offsets', 'q', strings.offsets
+            yield f'{name}.blob', 'B', strings.blob
+
+    def write(self, path: str):
+        """
+        Publish the snapshot as ``path``: written to a temporary file next to
+        it and renamed over it, so processes that mapped the previous file
+        keep reading it unchanged
+        """
+        columns = []
+        position = 0
+        for name, typecode, buffer in self._buffers():
+            nbytes = memoryview(buffer).nbytes
+            columns.append([name, typecode, position, nbytes])
+            position = _aligned(position + nbytes)
+        header = json.dumps({
+            'version': self.version,
+            'byteorder': sys.byteorder,
+            'keyless_version': self._keyless_version,
+            'pharmacies': [
+                [pharmacy_id, name, website_url, to_micros(created_at)]
+                for pharmacy_id, name, website_url, created_at in self._pharmacies.values()
+            ],
+            'columns': columns,
+        }, separators=(',', ':')).encode('utf-8')
+        start = _aligned(len(MAGIC) + 8 + len(header))
+        temporary = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+                for (_, _, buffer), (_, _, offset, _) in zip(self._buffers(), columns):
+                    file.seek(start + offset)
+                    file.write(buffer)
+                file.truncate(start + position)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+
+    @classmethod
+    def open(cls, path: str, using: str = DEFAULT_DB_ALIAS) -> 'PriceSnapshot':
+        """
+        Map a snapshot file written by write() read-only; only the header is
+        read, the columns are views of the mapping
+        Raises: ValueError if ``path`` is not a snapshot file of this format
+        """
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_size < len(MAGIC) + 8:
+                raise ValueError(f'{path} is not a price snapshot file')
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapping[:len(MAGIC)] != MAGIC:
+            mapping.close()
+            raise ValueError(f'{path} is not a price snapshot file')
+        length = int.from_bytes(mapping[len(MAGIC):len(MAGIC) + 8], 'little')
+        header = json.loads(mapping[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+        if header['byteorder'] != sys.byteorder:
+            mapping.close()
+            raise ValueError(f'{path} was written on a {header["byteorder"]}-endian machine')
+
+        snapshot = cls(header['version'], using)
+        snapshot.path = path
+        snapshot.source = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        snapshot._mapping = mapping
+        snapshot._keyless_version = header['keyless_version']
+        snapshot._pharmacies = {
+            pharmacy_id: (pharmacy_id, name, website_url, from_micros(created))
+            for pharmacy_id, name, website_url, created in header['pharmacies']
+        }
+        start = _aligned(len(MAGIC) + 8 + length)
+        view = memoryview(mapping)
+        columns = {}
+        for name, typecode, offset, nbytes in header['columns']:
+            column = view[start + offset:start + offset + nbytes]
+            columns[name] = column if typecode == 'B' else column.cast(typecode)
+        for name in COLUMNS:
+            setattr(snapshot, name, columns[name])
+        for name in STRING_COLUMNS:
+            setattr(snapshot, name, PackedStrings(columns[f'{name}.blob'], columns[f'{name}.offsets']))
+        return snapshot
+
+    def __len__(self):
+        return len(self._price_ids)
+
+    def nbytes(self) -> int:
+        """
+        Size of the columns, the same in memory and on disk
+        """
+        return sum(memoryview(buffer).nbytes for _, _, buffer in self._buffers())
+
+    def _position(self, medicine_id: int) -> Optional[int]:
+        position = bisect.bisect_left(self._medicine_ids, medicine_id)
+        if position < len(self._medicine_ids) and self._medicine_ids[position] == medicine_id:
+            return position
+        return None
+
+    def _composition_key(self, position: int) -> Optional[int]:
+        return None if self._flags[position] & NO_COMPOSITION_KEY else self._composition_keys[position]
+
+    def _composition_version(self, composition_key: Optional[int]) -> Optional[int]:
+        if composition_key is None:
+            return self._keyless_version
+        index = bisect.bisect_left(self._version_keys, composition_key)
+        if index < len(self._version_keys) and self._version_keys[index] == composition_key:
+            return self._versions[index]
+        return None
+
+    def _text(self, column: str, position: int, null: int) -> Optional[str]:
+        return None if self._flags[position] & null else getattr(self, column)[position]
+
+    def _medicine(self, position: int) -> Medicine:
+        columns = {
+            'id': self._medicine_ids[position],
+            'brand_name': self._brand_names[position],
+            'composition': self._compositions[self._composition_codes[position]],
+            'composition_key': self._composition_key(position),
+            'strength': self._strengths[self._strength_codes[position]],
+            'manufacturer': self._manufacturers[self._manufacturer_codes[position]],
+            'medicine_type': MEDICINE_TYPES[self._medicine_types[position]],
+            'description': self._text('_descriptions', position, NO_DESCRIPTION),
+            'uses': self._text('_uses', position, NO_USES),
+            'side_effects': self._text('_side_effects', position, NO_SIDE_EFFECTS),
+            'created_at': from_micros(self._created[position]),
+        }
+        medicine = Medicine.from_db(self.using, MEDICINE_FIELDS, [columns[field] for field in MEDICINE_FIELDS])
+        summary = self._summary(position)
+        if summary is None:
+            # Cached as missing, so reading it raises without a query
+            Medicine.price_summary.related.set_cached_value(medicine, None)
+        else:
+            medicine.price_summary = summary
+        return medicine
+
+    def _summary(self, position: int) -> Optional[MedicinePriceSummary]:
+        """
+        The medicine's price summary, derived from its run of prices
+        """
+        from .services import savings_percentage
+
+        start, end = self._offsets[position], self._offsets[position + 1]
+        if start == end:
+            return None
+        lowest, highest = to_rupees(self._paise[start]), to_rupees(self._paise[end - 1])
+        columns = {
+            'medicine_id': self._medicine_ids[position],
+            'lowest_price': lowest,
+            'highest_price': highest,
+            'lowest_pharmacy_id': self._pharmacy_ids[start],
+            'price_count': end - start,
+            'savings_percentage': savings_percentage(lowest, highest),
+            'last_changed': from_micros(max(self._updated[start:end])),
+        }
+        return MedicinePriceSummary.from_db(self.using, SUMMARY_FIELDS, [columns[field] for field in SUMMARY_FIELDS])
+
+    def _alternative(self, position: int) -> Medicine:
+        return Medicine.from_db(self.using, ALTERNATIVE_FIELDS, [
+            self._medicine_ids[position], self._brand_names[position],
+            self._compositions[self._composition_codes[position]], self._strengths[self._strength_codes[position]],
+            self._manufacturers[self._manufacturer_codes[position]], MEDICINE_TYPES[self._medicine_types[position]],
+        ])
+
+    def _price(self, row: int, medicine: Medicine) -> Price:
+        price = Price.from_db(self.using, PRICE_FIELDS, [
+            self._price_ids[row], medicine.pk, self._pharmacy_ids[row], to_rupees(self._paise[row]),
+            PRICE_TYPES[self._price_types[row]], from_micros(self._updated[row]),
+        ])
+        price.medicine = medicine
+        price.pharmacy = Pharmacy.from_db(self.using, PHARMACY_FIELDS, self._pharmacies[self._pharmacy_ids[row]])
+        return price
+
+    def _current(self, composition_keys: Iterable[Optional[int]]) -> Dict[Optional[int], bool]:
+        """
+        Whether each composition is unchanged since the snapshot was read,
+        in one cache round trip
+        """
+        from . import cache as results_cache
+
+        versions = results_cache.composition_versions(composition_keys)
+        return {key: self._composition_version(key) == version for key, version in versions.items()}
+
+    def _current_positions(self, medicine_ids: Iterable[int]) -> Dict[int, int]:
+        """
+        The positions of the medicines that are in the snapshot and current
+        Returns: {medicine id: position}
+        """
+        positions = {}
+        for medicine_id in medicine_ids:
+            position = self._position(medicine_id)
+            if position is not None:
+                positions[medicine_id] = position
+        current = self._current({self._composition_key(position) for position in positions.values()})
+        return {
+            medicine_id: position for medicine_id, position in positions.items()
+            if current[self._composition_key(position)]
+        }
+
+    def composition_key(self, medicine_id: int) -> Optional[int]:
+        """
+        The medicine's composition key, or None when it has none or the
+        snapshot cannot vouch for it (unknown medicine, changed composition)
+        """
+        position = self._position(medicine_id)
+        if position is None or self._composition_key(position) is None:
+            return None
+        composition_key = self._composition_keys[position]
+        return composition_key if self._current([composition_key])[composition_key] else None
+
+    def medicines(self, medicine_ids: Iterable[int]) -> Dict[int, Medicine]:
+        """
+        The medicines that are in the snapshot and current, each with its
+        ``price_summary`` (None when unpriced) already set
+        Returns: {medicine id: Medicine}
+        """
+        return {
+            medicine_id: self._medicine(position)
+            for medicine_id, position in self._current_positions(medicine_ids).items()
+        }
+
+    def prices(self, medicine_ids: Iterable[int]) -> Dict[int, Tuple[Medicine, List[Price]]]:
+        """
+        The medicines, as medicines() gives them, and their prices, cheapest
+        first, for the ids that are in the snapshot and current
+        Returns: {medicine id: (Medicine, List[Price])}
+        """
+        found = {}
+        for medicine_id, position in self._current_positions(medicine_ids).items():
+            medicine = self._medicine(position)
+            found[medicine_id] = (medicine, [
+                self._price(row, medicine) for row in range(self._offsets[position], self._offsets[position + 1])
+            ])
+        return found
+
+    def alternatives(self, medicine_id: int) -> Optional[Tuple[Optional[Decimal], List[Alternative]]]:
+        """
+        The priced medicines sharing ``medicine_id``'s composition, generics
+        first and then by lowest price, without the medicine itself
+        Returns: (the medicine's lowest price or None,
+                  [(Medicine, lowest price, cheapest pharmacy name)]),
+                 or None when the medicine is unknown, has no composition
+                 key or its composition changed since the snapshot
+        """
+        position = self._position(medicine_id)
+        if position is None or self._composition_key(position) is None:
+            return None
+        composition_key = self._composition_keys[position]
+        if not self._current([composition_key])[composition_key]:
+            return None
+        start = bisect.bisect_left(self._alternative_keys, composition_key)
+        end = bisect.bisect_right(self._alternative_keys, composition_key, start)
+        original_price = None
+        if self._offsets[position] < self._offsets[position + 1]:
+            original_price = to_rupees(self._paise[self._offsets[position]])
+        members = []
+        for member in self._alternatives[start:end]:
+            if member == position:
+                continue
+            cheapest = self._offsets[member]
+            members.append((
+                self._alternative(member), to_rupees(self._paise[cheapest]),
+                self._pharmacies[self._pharmacy_ids[cheapest]][1],
+            ))
+        return original_price, members
+
+
+_snapshot: Optional[PriceSnapshot] = None
+_versions = count(1)
+_refresh_lock = threading.Lock()
+# Held by the background refresh thread for as long as it runs
+_refreshing = threading.Lock()
+_checked_at = 0.0
+
+
+def refresh(using: str = DEFAULT_DB_ALIAS) -> PriceSnapshot:
+    """
+    Build a new snapshot and make it the process-wide one
+    """
+    global _snapshot
+    with _refresh_lock:
+        started = time.perf_counter()
+        snapshot = PriceSnapshot.build(next(_versions), using)
+        _snapshot = snapshot
+    logger.info(
+        'Price snapshot %d: %d prices, %.1f MB in %.2fs', snapshot.version, len(snapshot),
+        snapshot.nbytes() / 2 ** 20, time.perf_counter() - started,
+    )
+    return snapshot
+
+
+def file_version(path: str) -> int:
+    """
+    Version of the snapshot file at ``path``, 0 if there is none
+    """
+    try:
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                return 0
+            length = int.from_bytes(file.read(8), 'little')
+            return json.loads(file.read(length))['version']
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def export(path: str, using: str = DEFAULT_DB_ALIAS) -> PriceSnapshot:
+    """
+    Build a snapshot and publish it as the file at ``path``, one version
+    after the file it replaces
+    """
+    snapshot = PriceSnapshot.build(file_version(path) + 1, using)
+    snapshot.write(path)
+    return snapshot
+
+
+def _mapped(path: str) -> Optional[PriceSnapshot]:
+    """
+    The snapshot mapped from ``path``, remapped when the file was replaced
+    """
+    global _snapshot, _checked_at
+    snapshot = _snapshot if _snapshot is not None and _snapshot.path == path else None
+    now = time.monotonic()
+    if snapshot is not None and now - _checked_at < getattr(settings, 'PRICE_SNAPSHOT_CHECK_INTERVAL', 1.0):
+        return snapshot
+    _checked_at = now
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # Keep answering from the mapping until a file appears again
+        return snapshot
+    if snapshot is not None and snapshot.source == (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size):
+        return snapshot
+    with _refresh_lock:
+        try:
+            mapped = PriceSnapshot.open(path)
+        except (OSError, ValueError):
+            logger.exception('Price snapshot %s could not be mapped', path)
+            return snapshot
+        _snapshot = mapped
+    logger.info('Price snapshot %d mapped from %s: %d prices, %.1f MB', mapped.version, path, len(mapped),
+                mapped.nbytes() / 2 ** 20)
+    return mapped
+
+
+def _refresh_in_background():
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh()
+        except Exception:
+            logger.exception('Price snapshot refresh failed')
+        finally:
+            # This thread's connections are not closed by any request
+            connections.close_all()
+            _refreshing.release()
+
+    try:
+        threading.Thread(target=run, name='price-snapshot', daemon=True).start()
+    except BaseException:
+        _refreshing.release()
+        raise
+
+
+def current() -> Optional[PriceSnapshot]:
+    """
+    The process-wide snapshot, or None while ``PRICE_SNAPSHOT`` is off or
+    there is none yet. With ``PRICE_SNAPSHOT_FILE`` set it is the file's,
+    else missing and expired snapshots are rebuilt in the background.
+    """
+    if not getattr(settings, 'PRICE_SNAPSHOT', False):
+        return None
+    path = getattr(settings, 'PRICE_SNAPSHOT_FILE', '')
+    if path:
+        return _mapped(path)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.path is not None:
+        snapshot = None
+    if snapshot is None or time.monotonic() - snapshot.built_at > getattr(settings, 'PRICE_SNAPSHOT_MAX_AGE', 300):
+        _refresh_in_background()
+    return snapshot
+
+
+def reset():
+    """
+    Drop the process-wide snapshot
+    """
+    global _snapshot, _checked_at
+    with _refresh_lock:
+        _snapshot = None
+        _checked_at = 0.0
@@ -0,0 +1,255 @@
+"""
+Deterministic synthetic catalogues for load tests and benchmarks.
+
+Medicines are drawn from composition clusters of very uneven size (a few
+salts have hundreds of brands, most have a handful), about one in five is a
+generic priced well below its cluster's branded base price, and each
+medicine is stocked by a random subset of pharmacies. The same seed always
+produces the same catalogue.
+"""
+import random
+import time
+from itertools import accumulate, islice
+from typing import Iterable, Iterator, List, Tuple
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import cache, compositions, search
+from .models import (
+    AlternativeGroup, CompositionSavings, Medicine, MedicinePriceSummary, Pharmacy, Price, PriceAlert,
+    PriceAlertNotification, PriceDailyAggregate, PriceFeedSnapshot, PriceHistory, SavingsLeaderboardRun,
+)
+from .services import AlternativeGroupService, PriceSummaryService
+
+SYLLABLES = [
+    'ab', 'al', 'am', 'ar', 'ce', 'cip', 'cor', 'da', 'do', 'fen', 'ga', 'in',
+    'lo', 'ma', 'mox', 'na', 'nol', 'pa', 'pan', 'ra', 'ri', 'sol', 'ta', 'tor',
+    'va', 'vi', 'xa', 'zi', 'zol',
+]
+SALTS = [
+    'Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Azithromycin', 'Cetirizine',
+    'Metformin', 'Atorvastatin', 'Omeprazole', 'Pantoprazole', 'Amlodipine',
+    'Losartan', 'Montelukast', 'Diclofenac', 'Ciprofloxacin', 'Levocetirizine',
+]
+STRENGTHS = ['5mg', '10mg', '20mg', '40mg', '100mg', '250mg', '500mg', '650mg']
+MANUFACTURERS = [
+    'Cipla', 'Sun Pharma', 'Lupin', 'Mankind', 'Torrent', 'Alkem', 'Zydus',
+    'Dr. Reddys', 'Glenmark', 'Intas', 'Micro Labs', 'Abbott India',
+]
+PHARMACY_NAMES = [
+    'Apollo Pharmacy', 'MedPlus', 'Netmeds', 'PharmEasy', '1mg',
+    'Jan Aushadhi Kendra', 'Local Medical Store',
+]
+GENERIC_SHARE = 0.2
+PRICE_TYPES = [choice for choice, _ in Price.PRICE_TYPE_CHOICES]
+
+
+def synthetic_brand_name(rng: random.Random) -> str:
+    name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return f'{name.capitalize()} {rng.choice(STRENGTHS)}'
+
+
+def synthetic_medicines(count: int, rng: random.Random) -> Iterator[Medicine]:
+    """
+    ``count`` unsaved medicines with uniformly drawn compositions
+    """
+    for _ in range(count):
+        salt = rng.choice(SALTS)
+        strength = rng.choice(STRENGTHS)
+        yield Medicine(
+            brand_name=synthetic_brand_name(rng),
+            composition=f'{salt} {strength}',
+            composition_key=compositions.composition_key(f'{salt} {strength}', strength),
+            strength=strength,
+            manufacturer=rng.choice(MANUFACTURERS),
+            medicine_type='generic' if rng.random() < GENERIC_SHARE else 'branded',
+        )
+
+
+def add_medicines(count: int, rng: random.Random, batch_size: int = 5000):
+    """
+    Bulk insert ``count`` synthetic medicines (bypassing signals)
+    """
+    Medicine.objects.bulk_create(synthetic_medicines(count, rng), batch_size=batch_size)
+    cache.invalidate_autocomplete()
+
+
+def search_terms(count: int, rng: random.Random) -> List[str]:
+    """
+    Typeahead-style queries: 3-6 character prefixes of synthetic brand names
+    plus a few composition words
+    """
+    terms = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            terms.append(rng.choice(SALTS)[:rng.randint(4, 8)].lower())
+        else:
+            terms.append(synthetic_brand_name(rng)[:rng.randint(3, 6)].lower())
+    return terms
+
+
+class CatalogueGenerator:
+    """
+    Clustered medicine and price rows. Every (salt, strength) pair is a
+    cluster with its own base price; cluster popularity follows a Zipf-like
+    1/rank curve so alternatives lists range from one to hundreds of entries.
+    """
+    MEDICINE_COLUMNS = [
+        'brand_name', 'composition', 'composition_key', 'strength', 'manufacturer', 'medicine_type', 'created_at',
+    ]
+    PRICE_COLUMNS = ['medicine_id', 'pharmacy_id', 'price', 'price_type', 'last_updated']
+
+    def __init__(self, seed: int, pharmacies: int = 20):
+        # Separate streams keep the output independent of the batch size
+        self.rng = random.Random(seed)
+        self.price_rng = random.Random(f'{seed}-prices')
+        clusters = [f'{salt} {strength}' for salt in SALTS for strength in STRENGTHS]
+        self.rng.shuffle(clusters)
+        self.base_cents = {composition: self.rng.randint(500, 50_000) for composition in clusters}
+        self.clusters = clusters
+        self.composition_keys = {
+            composition: compositions.composition_key(composition, composition.rsplit(' ', 1)[1])
+            for composition in clusters
+        }
+        self.cumulative_weights = list(accumulate(1 / rank for rank in range(1, len(clusters) + 1)))
+        self.pharmacy_count = pharmacies
+
+    def pharmacies(self) -> Iterator[Pharmacy]:
+        for i in range(self.pharmacy_count):
+            if i < len(PHARMACY_NAMES):
+                yield Pharmacy(name=PHARMACY_NAMES[i])
+            else:
+                yield Pharmacy(name=f'Pharmacy {i + 1:05d}')
+
+    def medicines(self, count: int, created_at) -> Iterator[tuple]:
+        """
+        Rows in ``MEDICINE_COLUMNS`` order
+        """
+        rng = self.rng
+        for composition in rng.choices(self.clusters, cum_weights=self.cumulative_weights, k=count):
+            strength = composition.rsplit(' ', 1)[1]
+            name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            yield (
+                f'{name.capitalize()} {strength}', composition, self.composition_keys[composition], strength,
+                rng.choice(MANUFACTURERS),
+                'generic' if rng.random() < GENERIC_SHARE else 'branded', created_at,
+            )
+
+    def prices(self, medicines: Iterable[Tuple[int, str, str]], pharmacy_ids: List[int],
+               last_updated) -> Iterator[tuple]:
+        """
+        Rows in ``PRICE_COLUMNS`` order for saved (id, composition, medicine_type)
+        medicines: 4-16 pharmacies each, generics at 30-60% of the cluster base
+        price, branded at 85-125%
+        """
+        rng = self.price_rng
+        stocked = min(len(pharmacy_ids), 4), min(len(pharmacy_ids), 16)
+        for medicine_id, composition, medicine_type in medicines:
+            base = self.base_cents[composition]
+            low, high = (30, 60) if medicine_type == 'generic' else (85, 125)
+            for pharmacy_id in rng.sample(pharmacy_ids, rng.randint(*stocked)):
+                cents = max(1, base * rng.randint(low, high) // 100)
+                yield (
+                    medicine_id, pharmacy_id, f'{cents // 100}.{cents % 100:02d}',
+                    rng.choice(PRICE_TYPES), last_updated,
+                )
+
+
+def clear_catalogue(using: str = 'default'):
+    """
+    Delete all prices, medicines and pharmacies with plain DELETE statements,
+    skipping the per-row signals a queryset delete would send
+    """
+    with connections[using].cursor() as cursor:
+        for model in (Price, PriceHistory, PriceDailyAggregate, PriceAlertNotification, PriceAlert,
+                      MedicinePriceSummary, AlternativeGroup, CompositionSavings, SavingsLeaderboardRun,
+                      PriceFeedSnapshot, Medicine, Pharmacy):
+            cursor.execute(f'DELETE FROM {model._meta.db_table}')
+
+
+def insert_rows(model, columns: List[str], rows: Iterable[tuple], using: str = 'default',
+                batch_size: int = 5000) -> int:
+    """
+    Insert pre-adapted row tuples with executemany, one statement per batch.
+    Much cheaper than bulk_create for millions of rows since no model
+    instances are built and no per-value field conversion runs.
+    Returns: number of rows inserted
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} ({", ".join(quote(c) for c in columns)}) '
+        f'VALUES ({", ".join(["%s"] * len(columns))})'
+    )
+    rows = iter(rows)
+    inserted = 0
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return inserted
+            cursor.executemany(sql, batch)
+            inserted += len(batch)
+
+
+def seed_catalogue(scale: int, seed: int = 42, pharmacies: int = 20, batch_size: int = 5000,
+                   using: str = 'default', stdout=None) -> dict:
+    """
+    Replace the catalogue with ``scale`` synthetic medicines and their
+    prices in one transaction, then rebuild the derived tables that bulk
+    inserts bypass (search index, price summaries, alternative groups,
+    cached results)
+    Returns: {'medicines', 'pharmacies', 'prices', 'seconds'}
+    """
+    def report(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    started = time.perf_counter()
+    connection = connections[using]
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    generator = CatalogueGenerator(seed, pharmacies)
+    created = {'medicines': 0, 'pharmacies': 0, 'prices': 0}
+    with transaction.atomic(using=using):
+        clear_catalogue(using)
+        pharmacy_ids = [
+            pharmacy.pk for pharmacy in
+            Pharmacy.objects.using(using).bulk_create(generator.pharmacies(), batch_size=batch_size)
+        ]
+        created['pharmacies'] = len(pharmacy_ids)
+
+        medicines = generator.medicines(scale, now)
+        last_id = 0
+        while True:
+            inserted = insert_rows(
+                Medicine, generator.MEDICINE_COLUMNS, islice(medicines, batch_size), using, batch_size
+            )
+            if not inserted:
+                break
+            created['medicines'] += inserted
+            saved = list(
+                Medicine.objects.using(using).filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', 'composition', 'medicine_type')
+            )
+            last_id = saved[-1][0]
+            created['prices'] += insert_rows(
+                Price, generator.PRICE_COLUMNS, generator.prices(saved, pharmacy_ids, now), using, batch_size
+            )
+        report(f"Inserted {created['medicines']:,} medicines and {created['prices']:,} prices "
+               f"in {time.perf_counter() - started:.1f}s")
+
+        search.rebuild_index(using)
+        PriceSummaryService.rebuild(using=using, batch_size=batch_size)
+        AlternativeGroupService.rebuild(using=using)
+        compositions.register(
+            [(composition, composition.rsplit(' ', 1)[1]) for composition in generator.clusters], using=using
+        )
+        for composition_key in generator.composition_keys.values():
+            cache.invalidate_composition(composition_key, using=using)
+        cache.invalidate_autocomplete(using=using)
+        cache.invalidate_savings_leaderboard(using=using)
+
+    created['seconds'] = time.perf_counter() - started
+    report(f"Rebuilt search index and price summaries ({created['seconds']:.1f}s total)")
+    return created
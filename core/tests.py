@@ -1,8 +1,42 @@
-from django.test import TestCase, Client
+import asyncio
+import csv
+import json
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
+from io import StringIO
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import Count
+from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.test import TestCase, AsyncClient, AsyncRequestFactory, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
-from .models import Medicine, Pharmacy, Price
-from .services import MedicineSearchService, PriceComparisonService, AlternativeFinderService
+from . import (
+    api, autocomplete, basket, cache, compositions, db, loadtest, profiling, routers, search, snapshot, views,
+)
+from .autocomplete import AutocompleteIndex
+from .middleware import ReplicaRoutingMiddleware
+from .importers import QUEUED_BATCHES, PriceBatch, PriceImporter, PriceSyncer, parse_feeds, validate_batch
+from .models import (
+    AlternativeGroup, Composition, CompositionSavings, GenericBenefit, Medicine, MedicinePriceSummary, Pharmacy, Price,
+    PriceAlert, PriceAlertNotification, PriceDailyAggregate, PriceFeedSnapshot, PriceHistory, SavingsLeaderboardRun,
+)
+from .services import (
+    MedicineSearchService, PriceComparisonService, AlternativeFinderService, PriceSummaryService,
+    AlternativeGroupService, BasketOptimizerService, PriceAlertService, PriceHistoryService, SavingsLeaderboardService,
+)
 
 
 class MedicineModelTest(TestCase):
@@ -71,6 +105,219 @@ class MedicineSearchServiceTest(TestCase):
     def test_search_empty_query(self):
         results = MedicineSearchService.search_medicines('')
         self.assertEqual(results.count(), 0)
+    
+    def test_search_matches_composition_and_manufacturer(self):
+        self.assertEqual(MedicineSearchService.search_medicines('ibupro').first().brand_name, 'Advil')
+        self.assertEqual(MedicineSearchService.search_medicines('pfizer').first().brand_name, 'Advil')
+    
+    def test_search_every_word_must_match(self):
+        self.assertEqual(MedicineSearchService.search_medicines('paracetamol 500').count(), 1)
+        self.assertEqual(MedicineSearchService.search_medicines('paracetamol 400').count(), 0)
+    
+    def test_search_ranks_brand_name_matches_first(self):
+        Medicine.objects.create(
+            brand_name='Paracip',
+            composition='Acetaminophen 650mg',
+            strength='650mg',
+            manufacturer='Cipla'
+        )
+        results = MedicineSearchService.search_medicines('para')
+        self.assertEqual([m.brand_name for m in results], ['Paracip', 'Tylenol'])
+    
+    def test_search_ignores_punctuation_only_query(self):
+        self.assertEqual(MedicineSearchService.search_medicines('%"*').count(), 0)
+    
+    def test_index_follows_saves_and_deletes(self):
+        medicine = Medicine.objects.get(brand_name='Advil')
+        medicine.brand_name = 'Brufen'
+        medicine.save()
+        self.assertEqual(MedicineSearchService.search_medicines('advil').count(), 0)
+        self.assertEqual(MedicineSearchService.search_medicines('brufen').count(), 1)
+        
+        medicine.delete()
+        self.assertEqual(MedicineSearchService.search_medicines('brufen').count(), 0)
+    
+    def test_rebuild_index_covers_bulk_created_medicines(self):
+        Medicine.objects.bulk_create([
+            Medicine(brand_name='Zerodol', composition='Aceclofenac 100mg', strength='100mg', manufacturer='Ipca')
+        ])
+        self.assertEqual(MedicineSearchService.search_medicines('zerodol').count(), 0)
+        self.assertEqual(search.rebuild_index(), 3)
+        self.assertEqual(MedicineSearchService.search_medicines('zerodol').count(), 1)
+
+
+class SearchPaginationTest(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        # Equal ranks (same brand name length and fields) exercise the
+        # brand name and id tie-breakers
+        for name in ['Paracip', 'Paracin', 'Paracin', 'Paradol', 'Parafen', 'Paramax', 'Parazen']:
+            Medicine.objects.create(
+                brand_name=name, composition='Paracetamol 500mg', strength='500mg', manufacturer='Cipla'
+            )
+        Medicine.objects.create(brand_name='Crocin', composition='Paracetamol 650mg', strength='650mg', manufacturer='GSK')
+        self.ordered = list(search.search_medicines(Medicine.objects.all(), 'para').values_list('id', flat=True))
+    
+    def test_pages_cover_every_match_once_in_order(self):
+        seen, cursor = [], None
+        while True:
+            page = MedicineSearchService.search_page('para', cursor, page_size=3)
+            seen.extend(medicine.id for medicine in page.medicines)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(len(self.ordered), 8)
+        self.assertEqual(seen, self.ordered)
+        self.assertEqual((page.count, page.count_exact), (8, True))
+    
+    def test_deep_page_query_is_a_keyset_seek(self):
+        first = MedicineSearchService.search_page('para', page_size=3)
+        with CaptureQueriesContext(connection) as queries:
+            MedicineSearchService.search_page('para', first.next_cursor, page_size=3)
+        # The count is cached by the first page; the page itself has no OFFSET
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+    
+    def test_large_counts_are_capped(self):
+        with mock.patch.object(MedicineSearchService, 'COUNT_LIMIT', 5):
+            page = MedicineSearchService.search_page('para', page_size=3)
+        self.assertEqual((page.count, page.count_exact), (5, False))
+    
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            MedicineSearchService.search_page('para', 'not-a-cursor')
+        response = self.client.get(reverse('api_search'), {'q': 'para', 'after': 'WzEsMl0'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_api_and_page_links(self):
+        data = self.client.get(reverse('api_search'), {'q': 'para', 'limit': 5}).json()
+        self.assertEqual([result['id'] for result in data['results']], self.ordered[:5])
+        data = self.client.get(data['next_url']).json()
+        self.assertEqual([result['id'] for result in data['results']], self.ordered[5:])
+        self.assertIsNone(data['next'])
+        
+        response = self.client.get(reverse('search'), {'q': 'para'})
+        self.assertContains(response, 'Found 8 medicine(s)')
+        self.assertNotContains(response, 'More results')
+
+
+class AutocompleteIndexTest(TestCase):
+    def setUp(self):
+        self.index = AutocompleteIndex.build([
+            (1, 'Dolo 650', 'Paracetamol 650mg'),
+            (2, 'Crocin', 'Paracetamol 500mg'),
+            (3, 'Paracip', 'Paracetamol 500mg'),
+        ])
+    
+    def labels(self, query, limit=8):
+        return [result['label'] for result in self.index.lookup(query, limit)]
+    
+    def test_label_start_matches_rank_before_word_matches(self):
+        self.assertEqual(
+            self.labels('para'),
+            ['Paracetamol 500mg', 'Paracetamol 650mg', 'Paracip']
+        )
+        self.assertEqual(self.labels('650'), ['Dolo 650', 'Paracetamol 650mg'])
+    
+    def test_lookup_is_case_and_whitespace_insensitive(self):
+        self.assertEqual(self.labels('  DOLO   6'), ['Dolo 650'])
+        self.assertEqual(self.index.lookup('dolo')[0]['medicine_id'], 1)
+        self.assertEqual(self.index.lookup('paracetamol 5')[0]['kind'], 'composition')
+    
+    def test_limit_and_empty_query(self):
+        self.assertEqual(len(self.labels('para', limit=1)), 1)
+        self.assertEqual(self.labels('   '), [])
+    
+    def test_update_and_remove(self):
+        self.index.update(2, 'Crocin Advance', 'Paracetamol 500mg')
+        self.index.update(4, 'Brufen', 'Ibuprofen 400mg')
+        self.assertEqual(self.labels('croc'), ['Crocin Advance'])
+        self.assertEqual(self.labels('ibu'), ['Ibuprofen 400mg'])
+        
+        self.index.remove(4)
+        self.assertEqual(self.labels('ibu'), [])
+        self.assertEqual(self.labels('bru'), [])
+        self.assertEqual(len(self.index), 5)
+    
+    def test_shared_composition_survives_until_last_medicine_removed(self):
+        self.index.remove(2)
+        self.assertIn('Paracetamol 500mg', self.labels('paracetamol'))
+        self.index.remove(3)
+        self.assertNotIn('Paracetamol 500mg', self.labels('paracetamol'))
+    
+    def test_merge_keeps_results(self):
+        for medicine_id in range(10, 10 + autocomplete.MERGE_THRESHOLD):
+            self.index.update(medicine_id, f'Brand {medicine_id}', 'Cetirizine 10mg')
+        self.assertGreater(len(self.index._packed), autocomplete.MERGE_THRESHOLD)
+        self.assertEqual(self.labels('dolo'), ['Dolo 650'])
+        self.assertEqual(self.labels('brand 2047'), ['Brand 2047'])
+
+    def test_merge_reclaims_removed_entries(self):
+        for i in range(3 * autocomplete.MERGE_THRESHOLD):
+            self.index.update(1, f'Dolo {i}', 'Paracetamol 650mg')
+        self.assertLess(len(self.index._labels), 2 * autocomplete.MERGE_THRESHOLD)
+        self.assertNotIn(None, self.index._labels)
+        self.assertEqual(self.labels('dolo'), [f'Dolo {3 * autocomplete.MERGE_THRESHOLD - 1}'])
+        self.assertEqual(len(self.index), 5)
+
+
+class AutocompleteViewTest(TestCase):
+    def setUp(self):
+        autocomplete.reset_index()
+        self.addCleanup(autocomplete.reset_index)
+        self.medicine = Medicine.objects.create(
+            brand_name='Tylenol',
+            composition='Paracetamol 500mg',
+            strength='500mg',
+            manufacturer='Johnson & Johnson'
+        )
+    
+    def test_autocomplete_view(self):
+        response = self.client.get(reverse('autocomplete'), {'q': 'tyl'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'label': 'Tylenol', 'kind': 'medicine', 'medicine_id': self.medicine.id}
+        ])
+    
+    @override_settings(AUTOCOMPLETE_CHECK_INTERVAL=0)
+    def test_lookups_do_not_query_and_follow_signals(self):
+        index = autocomplete.get_index()
+        with self.assertNumQueries(0):
+            self.client.get(reverse('autocomplete'), {'q': 'tyl'})
+        
+        self.medicine.brand_name = 'Calpol'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.medicine.save()
+        # Applied in place: the worker that made the change does not rebuild
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('autocomplete'), {'q': 'tyl'}).json()['results'], [])
+            self.assertEqual(len(self.client.get(reverse('autocomplete'), {'q': 'calp'}).json()['results']), 1)
+        self.assertIs(autocomplete.get_index(), index)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.medicine.delete()
+        self.assertEqual(self.client.get(reverse('autocomplete'), {'q': 'calp'}).json()['results'], [])
+        self.assertIs(autocomplete.get_index(), index)
+
+    def test_uncommitted_changes_are_not_indexed(self):
+        autocomplete.get_index()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.medicine.brand_name = 'Calpol'
+            self.medicine.save()
+        self.assertEqual(self.client.get(reverse('autocomplete'), {'q': 'calp'}).json()['results'], [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.client.get(reverse('autocomplete'), {'q': 'calp'}).json()['results']), 1)
+
+    @override_settings(AUTOCOMPLETE_CHECK_INTERVAL=0)
+    def test_rebuilt_after_writes_that_skip_signals(self):
+        autocomplete.get_index()
+        Medicine.objects.bulk_create([Medicine(brand_name='Calpol', composition='Paracetamol 500mg',
+                                               strength='500mg', manufacturer='GSK')])
+        self.assertEqual(self.client.get(reverse('autocomplete'), {'q': 'calp'}).json()['results'], [])
+        
+        cache.invalidate_autocomplete()
+        self.assertEqual(len(self.client.get(reverse('autocomplete'), {'q': 'calp'}).json()['results']), 1)
 
 
 class PriceComparisonServiceTest(TestCase):
@@ -94,6 +341,107 @@ class PriceComparisonServiceTest(TestCase):
         self.assertEqual(result['savings_percentage'], Decimal('33.33'))
 
 
+class PriceSummaryTest(TestCase):
+    def setUp(self):
+        self.medicine = Medicine.objects.create(
+            brand_name='Test Medicine',
+            composition='Test Composition',
+            strength='100mg',
+            manufacturer='Test Manufacturer'
+        )
+        self.pharmacies = [Pharmacy.objects.create(name=f'Pharmacy {i}') for i in range(4)]
+    
+    def summary(self):
+        return MedicinePriceSummary.objects.get(medicine=self.medicine)
+    
+    def test_summary_follows_price_saves_and_deletes(self):
+        cheap = Price.objects.create(medicine=self.medicine, pharmacy=self.pharmacies[0], price=Decimal('8.00'))
+        Price.objects.create(medicine=self.medicine, pharmacy=self.pharmacies[1], price=Decimal('10.00'))
+        summary = self.summary()
+        self.assertEqual((summary.lowest_price, summary.highest_price), (Decimal('8.00'), Decimal('10.00')))
+        self.assertEqual(summary.lowest_pharmacy, self.pharmacies[0])
+        self.assertEqual(summary.price_count, 2)
+        self.assertEqual(summary.savings_percentage, Decimal('20.00'))
+        
+        cheap.price = Decimal('12.00')
+        cheap.save()
+        summary = self.summary()
+        self.assertEqual((summary.lowest_price, summary.highest_price), (Decimal('10.00'), Decimal('12.00')))
+        self.assertEqual(summary.lowest_pharmacy, self.pharmacies[1])
+        
+        Price.objects.filter(medicine=self.medicine).delete()
+        self.assertFalse(MedicinePriceSummary.objects.filter(medicine=self.medicine).exists())
+    
+    def test_deleting_pharmacy_or_medicine_keeps_summaries_consistent(self):
+        for pharmacy, price in zip(self.pharmacies, ['5.00', '6.00', '7.00']):
+            Price.objects.create(medicine=self.medicine, pharmacy=pharmacy, price=Decimal(price))
+        self.pharmacies[0].delete()
+        self.assertEqual(self.summary().lowest_pharmacy, self.pharmacies[1])
+        self.assertEqual(self.summary().price_count, 2)
+        
+        self.medicine.delete()
+        self.assertEqual(MedicinePriceSummary.objects.count(), 0)
+
+    def test_cascading_deletes_refresh_once_per_delete(self):
+        def priced(count):
+            pharmacy = Pharmacy.objects.create(name=f'Closing {count}')
+            for i in range(count):
+                medicine = Medicine.objects.create(brand_name=f'Brand {count}-{i}', composition='Test Composition',
+                                                   strength='100mg', manufacturer='Maker')
+                Price.objects.create(medicine=medicine, pharmacy=self.pharmacies[0], price=Decimal('9.00'))
+                Price.objects.create(medicine=medicine, pharmacy=pharmacy, price=Decimal('4.00'))
+            return pharmacy
+
+        few, many = priced(2), priced(12)
+        with CaptureQueriesContext(connection) as small:
+            few.delete()
+        with CaptureQueriesContext(connection) as large:
+            many.delete()
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(MedicinePriceSummary.objects.filter(lowest_price=Decimal('9.00')).count(), 14)
+        self.assertEqual(PriceSummaryService.verify(), [])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.pharmacies[0].delete()
+        self.assertLessEqual(len(queries), len(large))
+        self.assertFalse(MedicinePriceSummary.objects.exists())
+
+    def test_summaries_match_live_aggregates_after_random_edits(self):
+        rng = random.Random(7)
+        medicines = [self.medicine] + [
+            Medicine.objects.create(brand_name=f'Brand {i}', composition='Test Composition',
+                                    strength='100mg', manufacturer='Maker')
+            for i in range(5)
+        ]
+        for _ in range(60):
+            medicine = rng.choice(medicines)
+            pharmacy = rng.choice(self.pharmacies)
+            existing = Price.objects.filter(medicine=medicine, pharmacy=pharmacy).first()
+            if existing and rng.random() < 0.3:
+                existing.delete()
+            elif existing:
+                existing.price = Decimal(rng.randint(100, 5000)) / 100
+                existing.save()
+            else:
+                Price.objects.create(medicine=medicine, pharmacy=pharmacy,
+                                     price=Decimal(rng.randint(100, 5000)) / 100)
+        self.assertEqual(PriceSummaryService.verify(), [])
+    
+    def test_rebuild_fixes_summaries_after_bulk_writes(self):
+        Price.objects.bulk_create([
+            Price(medicine=self.medicine, pharmacy=pharmacy, price=Decimal(10 + i))
+            for i, pharmacy in enumerate(self.pharmacies)
+        ])
+        self.assertEqual(PriceSummaryService.verify(), [self.medicine.id])
+        
+        out = StringIO()
+        call_command('rebuild_price_summaries', stdout=out)
+        self.assertIn('Rebuilt 1 price summaries', out.getvalue())
+        self.assertEqual(self.summary().highest_price, Decimal('13.00'))
+        call_command('rebuild_price_summaries', '--verify', stdout=out)
+        self.assertIn('All price summaries match', out.getvalue())
+
+
 class AlternativeFinderServiceTest(TestCase):
     def setUp(self):
         self.medicine1 = Medicine.objects.create(
@@ -115,10 +463,99 @@ class AlternativeFinderServiceTest(TestCase):
         alternatives = AlternativeFinderService.find_alternatives(self.medicine1.id)
         self.assertEqual(len(alternatives), 1)
         self.assertEqual(alternatives[0]['medicine'].brand_name, 'Panadol')
+    
+    def test_generics_first_then_lowest_price(self):
+        pharmacy = Pharmacy.objects.get(name='Test Pharmacy')
+        generic = Medicine.objects.create(
+            brand_name='Paracetamol Generic',
+            composition='Paracetamol 500mg',
+            strength='500mg',
+            manufacturer='Jan Aushadhi',
+            medicine_type='generic'
+        )
+        cheaper = Medicine.objects.create(
+            brand_name='Calpol',
+            composition='Paracetamol 500mg',
+            strength='500mg',
+            manufacturer='GSK'
+        )
+        Medicine.objects.create(
+            brand_name='Unpriced',
+            composition='Paracetamol 500mg',
+            strength='500mg',
+            manufacturer='Nobody'
+        )
+        Price.objects.create(medicine=generic, pharmacy=pharmacy, price=Decimal('9.00'))
+        Price.objects.create(medicine=cheaper, pharmacy=pharmacy, price=Decimal('5.00'))
+        
+        alternatives = AlternativeFinderService.find_alternatives(self.medicine1.id)
+        self.assertEqual(
+            [alt['medicine'].brand_name for alt in alternatives],
+            ['Paracetamol Generic', 'Calpol', 'Panadol']
+        )
+        self.assertEqual(alternatives[0]['lowest_price'], Decimal('9.00'))
+        self.assertEqual(alternatives[0]['pharmacy_name'], 'Test Pharmacy')
+    
+    def test_savings_against_original_lowest_price(self):
+        pharmacy = Pharmacy.objects.get(name='Test Pharmacy')
+        Price.objects.create(medicine=self.medicine1, pharmacy=pharmacy, price=Decimal('10.00'))
+        
+        alternatives = AlternativeFinderService.find_alternatives(self.medicine1.id)
+        self.assertEqual(alternatives[0]['savings_amount'], Decimal('2.00'))
+        self.assertEqual(alternatives[0]['savings_percentage'], Decimal('20.00'))
+
+
+class ResultsQueryCountTest(TestCase):
+    """
+    The results page must not issue a query per alternative medicine
+    """
+    def setUp(self):
+        django_cache.clear()
+        self.medicine = Medicine.objects.create(
+            brand_name='Crocin',
+            composition='Paracetamol 500mg',
+            strength='500mg',
+            manufacturer='GSK'
+        )
+        self.pharmacies = [Pharmacy.objects.create(name=f'Pharmacy {i}') for i in range(3)]
+        for pharmacy in self.pharmacies:
+            Price.objects.create(medicine=self.medicine, pharmacy=pharmacy, price=Decimal('30.00'))
+    
+    def add_alternatives(self, count):
+        for i in range(count):
+            alt = Medicine.objects.create(
+                brand_name=f'Paracetamol Brand {Medicine.objects.count()}',
+                composition='Paracetamol 500mg',
+                strength='500mg',
+                manufacturer='Generic Labs',
+                medicine_type='generic' if i % 2 else 'branded'
+            )
+            for pharmacy in self.pharmacies:
+                Price.objects.create(medicine=alt, pharmacy=pharmacy, price=Decimal(10 + i))
+    
+    def count_results_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('results', args=[self.medicine.id]))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+    
+    def test_find_alternatives_query_count(self):
+        self.add_alternatives(25)
+        with self.assertNumQueries(1):
+            alternatives = AlternativeFinderService.find_alternatives(self.medicine.id)
+        self.assertEqual(len(alternatives), 25)
+    
+    def test_results_page_constant_queries(self):
+        cache.get_generic_benefits()
+        self.add_alternatives(2)
+        baseline = self.count_results_queries()
+        self.add_alternatives(30)
+        self.assertEqual(self.count_results_queries(), baseline)
 
 
 class ViewsTest(TestCase):
     def setUp(self):
+        django_cache.clear()
         self.client = Client()
         self.medicine = Medicine.objects.create(
             brand_name='Tylenol',
@@ -141,3 +578,1487 @@ class ViewsTest(TestCase):
         response = self.client.get(reverse('results', args=[self.medicine.id]))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Tylenol')
+
+
+class ResultsCacheTest(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        cache.reset_stats()
+        self.pharmacy = Pharmacy.objects.create(name='Test Pharmacy')
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.generic = Medicine.objects.create(
+            brand_name='Paracetamol', composition='Paracetamol 500mg', strength='500mg',
+            manufacturer='Jan Aushadhi', medicine_type='generic'
+        )
+        self.brufen = Medicine.objects.create(
+            brand_name='Brufen', composition='Ibuprofen 400mg', strength='400mg', manufacturer='Abbott'
+        )
+        Price.objects.create(medicine=self.crocin, pharmacy=self.pharmacy, price=Decimal('30.00'))
+        self.generic_price = Price.objects.create(medicine=self.generic, pharmacy=self.pharmacy, price=Decimal('8.00'))
+        Price.objects.create(medicine=self.brufen, pharmacy=self.pharmacy, price=Decimal('45.00'))
+    
+    def test_repeat_requests_are_served_from_cache(self):
+        cache.find_alternatives(self.crocin.id)
+        with self.assertNumQueries(0):
+            alternatives = cache.find_alternatives(self.crocin.id)
+        self.assertEqual(alternatives[0]['lowest_price'], Decimal('8.00'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+    
+    def test_sibling_price_edit_invalidates(self):
+        cache.find_alternatives(self.crocin.id)
+        cache.get_price_comparison(self.crocin.id)
+        
+        self.generic_price.price = Decimal('6.00')
+        self.generic_price.save()
+        self.assertEqual(cache.find_alternatives(self.crocin.id)[0]['lowest_price'], Decimal('6.00'))
+        self.assertEqual(cache.stats()['misses'], 3)
+        
+        # Only the edited composition is invalidated
+        cache.get_price_comparison(self.crocin.id)
+        cache.get_price_comparison(self.brufen.id)
+        Price.objects.filter(medicine=self.brufen).delete()
+        cache.get_price_comparison(self.crocin.id)
+        self.assertEqual(cache.stats()['hits'], 1)
+    
+    def test_pharmacy_rename_invalidates_every_medicine_it_prices(self):
+        apollo = Pharmacy.objects.create(name='Apollo')
+        Price.objects.create(medicine=self.crocin, pharmacy=apollo, price=Decimal('40.00'))
+        cache.get_price_comparison(self.crocin.id)
+
+        apollo.name = 'Apollo Pharmacy'
+        apollo.save()
+        prices = cache.get_price_comparison(self.crocin.id)['prices']
+        self.assertEqual([price.pharmacy.name for price in prices], ['Test Pharmacy', 'Apollo Pharmacy'])
+
+    def test_sibling_delete_and_composition_change_invalidate(self):
+        self.assertEqual(len(cache.find_alternatives(self.crocin.id)), 1)
+        self.generic.composition = 'Ibuprofen 400mg'
+        self.generic.save()
+        self.assertEqual(cache.find_alternatives(self.crocin.id), [])
+        self.assertEqual(len(cache.find_alternatives(self.brufen.id)), 1)
+        
+        self.generic.delete()
+        self.assertEqual(cache.find_alternatives(self.brufen.id), [])
+    
+    def test_generic_benefits_invalidated_on_edit(self):
+        benefit = GenericBenefit.objects.create(title='Cheaper', description='Costs less')
+        self.assertEqual([b.title for b in cache.get_generic_benefits()], ['Cheaper'])
+        benefit.is_active = False
+        benefit.save()
+        self.assertEqual(cache.get_generic_benefits(), [])
+    
+    def test_missing_medicine_is_not_cached(self):
+        with self.assertRaises(Medicine.DoesNotExist):
+            cache.get_price_comparison(999999)
+    
+    def test_evicted_version_counter_is_a_miss(self):
+        cache.get_price_comparison(self.crocin.id)
+        django_cache.delete(cache.composition_version_key(self.crocin.composition_key))
+        cache.get_price_comparison(self.crocin.id)
+        self.assertEqual(cache.stats()['hits'], 0)
+    
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            file_cache = {'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location
+            }}
+            with override_settings(CACHES=file_cache):
+                cache.find_alternatives(self.crocin.id)
+                cache.find_alternatives(self.crocin.id)
+                self.generic_price.price = Decimal('7.00')
+                self.generic_price.save()
+                self.assertEqual(cache.find_alternatives(self.crocin.id)[0]['lowest_price'], Decimal('7.00'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'hit_ratio': 0.3333})
+    
+    def test_cache_stats_view_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 302)
+
+
+class PageCachingTest(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        pharmacy = Pharmacy.objects.create(name='Test Pharmacy')
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.generic = Medicine.objects.create(
+            brand_name='Paracetamol', composition='Paracetamol 500mg', strength='500mg',
+            manufacturer='Jan Aushadhi', medicine_type='generic'
+        )
+        Price.objects.create(medicine=self.crocin, pharmacy=pharmacy, price=Decimal('30.00'))
+        self.generic_price = Price.objects.create(medicine=self.generic, pharmacy=pharmacy, price=Decimal('8.00'))
+        self.benefit = GenericBenefit.objects.create(title='Cost Effective', description='Cheaper', order=1)
+        self.url = reverse('results', args=[self.crocin.id])
+    
+    def test_repeat_visits_get_304_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        
+        # A price change on an alternative changes the page
+        self.generic_price.price = Decimal('7.00')
+        self.generic_price.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '7.00')
+    
+    def test_fragments_follow_benefit_edits(self):
+        self.assertContains(self.client.get(reverse('home')), 'Cost Effective')
+        # Updates that bypass signals leave the cached fragment in place...
+        GenericBenefit.objects.filter(pk=self.benefit.pk).update(title='Saves Money')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Cost Effective')
+        etag = response['ETag']
+        
+        # ...while admin edits bump the benefits version
+        self.benefit.title = 'Saves Money'
+        self.benefit.save()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Saves Money')
+    
+    def test_price_table_fragment_is_reused(self):
+        self.client.get(self.url)
+        cached = django_cache.get(make_template_fragment_key(
+            'price_table', [self.crocin.pk, cache.fragment_context([self.crocin.composition_key])['compositions']]
+        ))
+        self.assertIn('30.00', cached)
+
+
+class ImportPricesTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.dolo = Medicine.objects.create(
+            brand_name='Dolo 650', composition='Paracetamol 650mg', strength='650mg', manufacturer='Micro Labs'
+        )
+        Medicine.objects.create(
+            brand_name='Dolo 650', composition='Paracetamol 650mg', strength='650mg', manufacturer='Other'
+        )
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.medplus = Pharmacy.objects.create(name='MedPlus')
+        Price.objects.create(medicine=self.crocin, pharmacy=self.apollo, price=Decimal('35.00'))
+    
+    def write_feed(self, name, content):
+        path = f'{self.directory.name}/{name}'
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+    
+    def test_csv_import_upserts_and_rejects(self):
+        feed = self.write_feed('feed.csv', (
+            'medicine_id,brand_name,pharmacy,price,price_type\n'
+            f'{self.crocin.id},,Apollo Pharmacy,28.50,online\n'
+            ',crocin,MedPlus,31.00,\n'
+            ',Dolo 650,MedPlus,20.00,\n'
+            f'{self.crocin.id},,Unknown Store,10.00,\n'
+            f'{self.crocin.id},,MedPlus,-1,\n'
+            f'{self.crocin.id},,MedPlus,1.234,\n'
+            f'{self.crocin.id},,MedPlus,12.00,wholesale\n'
+        ))
+        out = StringIO()
+        call_command('import_prices', feed, '--batch-size', '3', stdout=out)
+        
+        self.assertIn('7 rows: 2 upserted, 5 rejected', out.getvalue())
+        prices = {p.pharmacy.name: p for p in Price.objects.filter(medicine=self.crocin).select_related('pharmacy')}
+        self.assertEqual(prices['Apollo Pharmacy'].price, Decimal('28.50'))
+        self.assertEqual(prices['Apollo Pharmacy'].price_type, 'online')
+        self.assertEqual(prices['MedPlus'].price, Decimal('31.00'))
+        self.assertEqual(prices['MedPlus'].price_type, 'average')
+        self.assertEqual(PriceSummaryService.verify(), [])
+        
+        with open(f'{feed}.rejected.csv', encoding='utf-8') as handle:
+            reasons = [line['reason'] for line in csv.DictReader(handle)]
+        self.assertEqual(reasons, [
+            'unknown or ambiguous medicine',
+            'unknown pharmacy',
+            "invalid price '-1'",
+            "invalid price '1.234'",
+            "unknown price_type 'wholesale'",
+        ])
+    
+    def test_jsonl_import_invalidates_cached_results(self):
+        django_cache.clear()
+        self.assertEqual(cache.get_price_comparison(self.crocin.id)['lowest_price'], Decimal('35.00'))
+        feed = self.write_feed('feed.jsonl', (
+            f'{{"medicine_id": {self.crocin.id}, "pharmacy_id": {self.medplus.id}, "price": "19.99"}}\n'
+            '\n'
+            'not json\n'
+        ))
+        out = StringIO()
+        call_command('import_prices', feed, stdout=out)
+        self.assertIn('2 rows: 1 upserted, 1 rejected', out.getvalue())
+        self.assertEqual(cache.get_price_comparison(self.crocin.id)['lowest_price'], Decimal('19.99'))
+    
+    def test_duplicate_keys_in_batch_keep_last_value(self):
+        feed = self.write_feed('feed.csv', (
+            'brand_name,pharmacy,price\n'
+            'Crocin,MedPlus,10.00\n'
+            'Crocin,MedPlus,11.00\n'
+        ))
+        call_command('import_prices', feed, stdout=StringIO())
+        self.assertEqual(Price.objects.get(medicine=self.crocin, pharmacy=self.medplus).price, Decimal('11.00'))
+    
+    def test_worker_pool_streams_a_bounded_number_of_batches(self):
+        feed = self.write_feed('large.csv', 'medicine_id,pharmacy,price\n' + ''.join(
+            f'{self.crocin.id},Apollo Pharmacy,{price}.00\n' for price in range(1, 41)
+        ))
+        feeds = parse_feeds([feed], None, batch_size=1, workers=1)
+        source, parsed = next(feeds)
+        batches = iter(parsed)
+        next(batches)
+        time.sleep(0.5)
+        # The worker waits for the writer instead of parsing the whole file
+        self.assertFalse(parsed._future.done())
+        self.assertEqual(1 + sum(1 for _ in batches), 40)
+        self.assertEqual((source, parsed.rows), (feed, 40))
+        self.assertEqual(list(feeds), [])
+        self.assertGreater(40, QUEUED_BATCHES + 1)
+    
+    def test_worker_pool_import_matches_in_process_import(self):
+        apollo = self.write_feed('apollo.csv', (
+            'medicine_id,pharmacy,price\n'
+            f'{self.crocin.id},Apollo Pharmacy,28.50\n'
+            f'{self.crocin.id},Apollo Pharmacy,1.234\n'
+        ))
+        medplus = self.write_feed('medplus.jsonl', (
+            '{"brand_name": "Crocin", "pharmacy": "MedPlus", "price": "31.00", "price_type": "online"}\n'
+            '{"brand_name": "Dolo 650", "pharmacy": "MedPlus", "price": "20.00"}\n'
+        ))
+        out = StringIO()
+        call_command('import_prices', apollo, medplus, '--workers', '2', '--batch-size', '1', stdout=out)
+        
+        self.assertIn('Parsing 2 files in 2 worker processes', out.getvalue())
+        self.assertIn('apollo.csv: 2 rows: 1 upserted, 1 rejected', out.getvalue())
+        self.assertIn('medplus.jsonl: 2 rows: 1 upserted, 1 rejected', out.getvalue())
+        self.assertRegex(out.getvalue(), r'4 rows in [\d.]+s .*; parse .*, resolve .*, write ')
+        self.assertEqual(
+            sorted(Price.objects.filter(medicine=self.crocin).values_list('pharmacy__name', 'price', 'price_type')),
+            [('Apollo Pharmacy', Decimal('28.50'), 'average'), ('MedPlus', Decimal('31.00'), 'online')],
+        )
+        with open(f'{apollo}.rejected.csv', encoding='utf-8') as handle:
+            rejected = [(line['source'], line['reason'], json.loads(line['row'])) for line in csv.DictReader(handle)]
+        self.assertEqual(rejected, [
+            (apollo, "invalid price '1.234'", {'medicine_id': str(self.crocin.id), 'pharmacy': 'Apollo Pharmacy',
+                                               'price': '1.234'}),
+            (medplus, 'unknown or ambiguous medicine', {'brand_name': 'Dolo 650', 'pharmacy': 'MedPlus',
+                                                        'price': '20.00', 'price_type': 'average'}),
+        ])
+    
+    def test_packed_batch_round_trip(self):
+        batch, _ = validate_batch([(2, {'medicine_id': '7', 'pharmacy': 'MedPlus', 'price': '12.5'})])
+        unpacked = PriceBatch.unpack(batch.pack())
+        self.assertEqual((unpacked.medicine_keys, unpacked.pharmacy_keys, unpacked.prices, unpacked.price_types),
+                         ([7], [('name', 'MedPlus')], [Decimal('12.50')], ['average']))
+        self.assertEqual(str(unpacked.prices[0]), '12.50')
+
+
+class PriceSyncTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.dolo = Medicine.objects.create(
+            brand_name='Dolo 650', composition='Paracetamol 650mg', strength='650mg', manufacturer='Micro Labs'
+        )
+        self.calpol = Medicine.objects.create(
+            brand_name='Calpol', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.medplus = Pharmacy.objects.create(name='MedPlus')
+        Price.objects.create(medicine=self.crocin, pharmacy=self.apollo, price=Decimal('35.00'))
+        Price.objects.create(medicine=self.dolo, pharmacy=self.apollo, price=Decimal('30.00'))
+        Price.objects.create(medicine=self.calpol, pharmacy=self.medplus, price=Decimal('25.00'))
+    
+    def write_feed(self, name, content):
+        path = f'{self.directory.name}/{name}'
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+    
+    def sync(self, feed, *args):
+        out = StringIO()
+        call_command('import_prices', feed, '--sync', *args, stdout=out)
+        return out.getvalue()
+    
+    def test_sync_writes_only_changes_and_logs_them(self):
+        untouched = Price.objects.get(medicine=self.crocin, pharmacy=self.apollo).last_updated
+        feed = self.write_feed('apollo.csv', (
+            'medicine_id,pharmacy,price\n'
+            f'{self.crocin.id},Apollo Pharmacy,35.00\n'
+            f'{self.calpol.id},Apollo Pharmacy,22.00\n'
+        ))
+        changelog = f'{self.directory.name}/changes.jsonl'
+        output = self.sync(feed, '--changelog', changelog)
+        
+        self.assertIn('1 inserted, 0 updated, 1 deleted, 1 unchanged', output)
+        self.assertEqual(Price.objects.get(medicine=self.crocin, pharmacy=self.apollo).last_updated, untouched)
+        self.assertFalse(Price.objects.filter(medicine=self.dolo).exists())
+        self.assertFalse(MedicinePriceSummary.objects.filter(medicine=self.dolo).exists())
+        # Pharmacies absent from the feed are left alone
+        self.assertTrue(Price.objects.filter(medicine=self.calpol, pharmacy=self.medplus).exists())
+        self.assertEqual(PriceSummaryService.verify(), [])
+        
+        with open(changelog, encoding='utf-8') as handle:
+            changes = sorted((change['action'], change['medicine_id']) for change in map(json.loads, handle))
+        self.assertEqual(changes, [('delete', self.dolo.id), ('insert', self.calpol.id)])
+    
+    def test_unchanged_feed_is_skipped_by_digest(self):
+        feed = self.write_feed('apollo.csv', (
+            'medicine_id,pharmacy,price\n'
+            f'{self.crocin.id},Apollo Pharmacy,33.00\n'
+            f'{self.dolo.id},Apollo Pharmacy,30.00\n'
+        ))
+        self.assertIn('0 inserted, 1 updated, 0 deleted, 1 unchanged', self.sync(feed))
+        self.assertEqual(PriceFeedSnapshot.objects.get(pharmacy=self.apollo).row_count, 2)
+        
+        with CaptureQueriesContext(connection) as queries:
+            output = self.sync(feed)
+        self.assertIn('1 of 1 pharmacies unchanged', output)
+        self.assertFalse(any(q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) for q in queries.captured_queries))
+        
+        # A stale digest is ignored with --full-diff
+        Price.objects.filter(medicine=self.crocin, pharmacy=self.apollo).update(price=Decimal('40.00'))
+        self.assertIn('0 of 1 pharmacies unchanged', self.sync(feed, '--full-diff'))
+        self.assertEqual(Price.objects.get(medicine=self.crocin, pharmacy=self.apollo).price, Decimal('33.00'))
+    
+    def test_sync_invalidates_cached_results(self):
+        django_cache.clear()
+        self.assertEqual(cache.get_price_comparison(self.crocin.id)['lowest_price'], Decimal('35.00'))
+        feed = self.write_feed('apollo.jsonl', (
+            f'{{"medicine_id": {self.crocin.id}, "pharmacy_id": {self.apollo.id}, "price": "29.00"}}\n'
+            f'{{"medicine_id": {self.dolo.id}, "pharmacy_id": {self.apollo.id}, "price": "30.00"}}\n'
+        ))
+        self.sync(feed)
+        self.assertEqual(cache.get_price_comparison(self.crocin.id)['lowest_price'], Decimal('29.00'))
+    
+    def test_sync_with_worker_pool(self):
+        apollo = self.write_feed('apollo.csv', (
+            'medicine_id,pharmacy,price\n'
+            f'{self.crocin.id},Apollo Pharmacy,33.00\n'
+        ))
+        medplus = self.write_feed('medplus.csv', (
+            'medicine_id,pharmacy,price\n'
+            f'{self.calpol.id},MedPlus,25.00\n'
+            f'{self.crocin.id},MedPlus,31.00\n'
+        ))
+        out = StringIO()
+        call_command('import_prices', apollo, medplus, '--sync', '--workers', '2', stdout=out)
+        output = out.getvalue()
+        self.assertIn('apollo.csv: 1 rows: 0 inserted, 1 updated, 1 deleted', output)
+        self.assertIn('medplus.csv: 2 rows: 1 inserted, 0 updated, 0 deleted, 1 unchanged', output)
+        self.assertEqual(
+            sorted(Price.objects.values_list('medicine__brand_name', 'pharmacy__name', 'price')),
+            [('Calpol', 'MedPlus', Decimal('25.00')), ('Crocin', 'Apollo Pharmacy', Decimal('33.00')),
+             ('Crocin', 'MedPlus', Decimal('31.00'))],
+        )
+
+
+class SeedDataTest(TestCase):
+    def snapshot(self):
+        return (
+            list(Medicine.objects.order_by('pk').values_list('brand_name', 'composition', 'medicine_type')),
+            list(Price.objects.order_by('medicine__brand_name', 'medicine_id', 'pharmacy__name')
+                 .values_list('pharmacy__name', 'price', 'price_type')),
+        )
+    
+    def test_scaled_catalogue_is_deterministic_and_consistent(self):
+        Medicine.objects.create(brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK')
+        out = StringIO()
+        call_command('seed_data', '--scale', '300', '--seed', '7', '--pharmacies', '9', '--batch-size', '64', stdout=out)
+        self.assertIn('Created 300 medicines, 9 pharmacies', out.getvalue())
+        self.assertFalse(Medicine.objects.filter(brand_name='Crocin').exists())
+        self.assertEqual(Pharmacy.objects.count(), 9)
+        self.assertGreaterEqual(Price.objects.count(), 300 * 4)
+        self.assertEqual(PriceSummaryService.verify(), [])
+        self.assertEqual(MedicinePriceSummary.objects.count(), 300)
+        
+        # Clusters are uneven, so most medicines have alternatives
+        largest = Medicine.objects.values('composition').annotate(n=Count('id')).order_by('-n').first()
+        self.assertGreater(largest['n'], 300 // 10)
+        medicine = Medicine.objects.filter(composition=largest['composition']).first()
+        self.assertIn(medicine, list(MedicineSearchService.search_medicines(medicine.brand_name)))
+        
+        first = self.snapshot()
+        call_command('seed_data', '--scale', '300', '--seed', '7', '--pharmacies', '9', stdout=StringIO())
+        self.assertEqual(self.snapshot(), first)
+        call_command('seed_data', '--scale', '300', '--seed', '8', '--pharmacies', '9', stdout=StringIO())
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_reseeding_clears_the_savings_leaderboard(self):
+        call_command('seed_data', '--scale', '200', '--seed', '7', '--pharmacies', '5', stdout=StringIO())
+        SavingsLeaderboardService.refresh()
+        self.assertTrue(CompositionSavings.objects.exists())
+        call_command('seed_data', '--scale', '200', '--seed', '8', '--pharmacies', '5', stdout=StringIO())
+        self.assertFalse(CompositionSavings.objects.exists())
+        self.assertFalse(SavingsLeaderboardRun.objects.exists())
+        connection.check_constraints()
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_hot_paths_report_is_written_and_rolled_back(self):
+        Medicine.objects.create(brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK')
+        with tempfile.TemporaryDirectory() as directory:
+            output = f'{directory}/report.json'
+            call_command(
+                'benchmark', 'hot_paths', '--sizes', '40', '--queries', '3', '--output', output, stdout=StringIO()
+            )
+            with open(output, encoding='utf-8') as handle:
+                report = json.load(handle)
+        
+        rows = {row['path']: row for row in report['results']}
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(rows['service.price_comparison']['queries_max'], 2)
+        self.assertEqual(rows['service.alternatives']['queries_max'], 1)
+        self.assertEqual(rows['view.results.warm']['queries_max'], 0)
+        self.assertEqual(rows['view.results.304']['queries_max'], 0)
+        self.assertEqual(list(Medicine.objects.values_list('brand_name', flat=True)), ['Crocin'])
+
+    def test_runs_every_benchmark_by_default_and_rejects_unknown_ones(self):
+        ran = []
+        benchmarks = {name: (lambda options, stdout, name=name: ran.append(name) or []) for name in ('b', 'a')}
+        with mock.patch('core.management.commands.benchmark.BENCHMARKS', benchmarks):
+            call_command('benchmark', stdout=StringIO())
+            self.assertEqual(ran, ['a', 'b'])
+            with self.assertRaisesMessage(CommandError, 'Unknown benchmark c'):
+                call_command('benchmark', 'a', 'c', stdout=StringIO())
+        self.assertEqual(ran, ['a', 'b'])
+
+
+class SQLiteProfileTest(TestCase):
+    def test_production_profile_pragmas_are_applied_to_new_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = DatabaseWrapper({
+                **connection.settings_dict, 'NAME': f'{directory}/production.sqlite3',
+                **settings.SQLITE_PROFILES['production'],
+            })
+            try:
+                pragmas = db.current_pragmas(
+                    wrapper, ['journal_mode', 'synchronous', 'cache_size', 'temp_store', 'busy_timeout']
+                )
+            finally:
+                wrapper.close()
+        
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal', 'synchronous': 1, 'cache_size': -64 * 1024, 'temp_store': 2, 'busy_timeout': 20000,
+        })
+        self.assertEqual(settings.SQLITE_PROFILES['production']['CONN_MAX_AGE'], 600)
+    
+    def test_pragmas_are_validated(self):
+        self.assertEqual(db.pragma_statements({'cache_size': -2000}), ['PRAGMA cache_size = -2000'])
+        with self.assertRaises(ValueError):
+            db.pragma_statements({'journal_mode': 'wal; DROP TABLE core_price'})
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A second SQLite file stands in for a replica that has the schema
+        # but lags behind every write the tests make on the primary. It is
+        # only ever read, so it is added after TestCase has set up its
+        # per-database transactions.
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings['replica'] = {**connections.settings['default'], 'NAME': f'{cls.directory.name}/replica.sqlite3'}
+        call_command('sync_replicas', stdout=StringIO())
+    
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.directory.cleanup()
+        super().tearDownClass()
+    
+    def setUp(self):
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.price = Price.objects.create(medicine=self.crocin, pharmacy=self.apollo, price=Decimal('30.00'))
+        self.url = f"{reverse('api_batch_comparison')}?ids={self.crocin.id}"
+    
+    def test_request_reads_go_to_the_replica(self):
+        self.assertEqual(self.client.get(self.url).json()['missing'], [self.crocin.id])
+        # Outside a request (commands, imports) reads stay on the primary
+        self.assertIn(self.crocin.id, PriceComparisonService.get_price_comparisons([self.crocin.id]))
+    
+    def test_reads_after_a_write_stick_to_the_primary(self):
+        def update_price(request):
+            self.assertNotIn(self.crocin.id, PriceComparisonService.get_price_comparisons([self.crocin.id]))
+            self.price.price = Decimal('28.00')
+            self.price.save()
+            comparison = PriceComparisonService.get_price_comparisons([self.crocin.id])[self.crocin.id]
+            return HttpResponse(comparison['lowest_price'])
+        
+        middleware = ReplicaRoutingMiddleware(update_price)
+        response = middleware(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'28.00')
+        self.assertEqual(response.cookies['primary_reads']['max-age'], 10)
+        
+        self.client.cookies['primary_reads'] = '1'
+        self.assertEqual(self.client.get(self.url).json()['missing'], [])
+        self.assertIsNone(routers.current())
+    
+    def empty_replica(self, models):
+        with connections['replica'].cursor() as cursor:
+            for model in reversed(models):
+                cursor.execute(f'DELETE FROM {model._meta.db_table}')
+    
+    def test_cache_fills_read_the_replica_unless_it_may_lag(self):
+        # The replica catches up with setUp's rows but not the price change
+        models = [Pharmacy, Medicine, MedicinePriceSummary, Price]
+        for model in models:
+            model.objects.using('replica').bulk_create(model.objects.all())
+        self.addCleanup(self.empty_replica, models)
+        self.price.price = Decimal('28.00')
+        self.price.save()
+        url = reverse('api_comparison', args=[self.crocin.id])
+        # Crocin's composition was just invalidated, so the primary answers
+        self.assertEqual(self.client.get(url).json()['lowest_price'], '28.00')
+        # Past the lag window the (still lagging) replica does
+        django_cache.clear()
+        self.assertEqual(self.client.get(url).json()['lowest_price'], '30.00')
+    
+    async def test_primary_reads_are_scoped_to_each_task(self):
+        router = routers.PrimaryReplicaRouter()
+        entered, exited = asyncio.Event(), asyncio.Event()
+        
+        async def short():
+            with routers.primary_reads():
+                await entered.wait()
+            exited.set()
+        
+        async def long():
+            with routers.primary_reads():
+                entered.set()
+                await exited.wait()
+                return router.db_for_read(Medicine)
+        
+        token = routers.activate(routers.RoutingState())
+        try:
+            # The block that ends first leaves the other one's reads pinned
+            _, alias = await asyncio.gather(short(), long())
+            self.assertEqual(alias, 'default')
+            self.assertEqual(router.db_for_read(Medicine), 'replica')
+        finally:
+            routers.deactivate(token)
+
+
+@override_settings(REQUEST_PROFILING=True)
+class RequestProfilingTest(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        profiling.reset_stats()
+        self.addCleanup(profiling.reset_stats)
+        pharmacy = Pharmacy.objects.create(name='Test Pharmacy')
+        self.medicine = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        Price.objects.create(medicine=self.medicine, pharmacy=pharmacy, price=Decimal('30.00'))
+    
+    def test_server_timing_and_per_view_stats(self):
+        response = self.client.get(reverse('results', args=[self.medicine.id]))
+        timing = dict(part.split(';', 1)[0:2] for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'total', 'db', 'tpl', 'prof'})
+        # Cold: the page validators, comparison and alternatives each miss the
+        # cache, sharing one composition key lookup
+        self.assertIn('desc="6 queries"', response['Server-Timing'])
+        
+        self.client.get(reverse('results', args=[self.medicine.id]))
+        stats = profiling.stats()['results']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['mean_queries'], 3.0)
+        self.assertEqual(stats['duplicate_sql'], [])
+        self.assertGreater(stats['mean_template_ms'], 0)
+        self.assertEqual(sum(stats['histogram'].values()), 2)
+    
+    def test_repeated_sql_is_flagged(self):
+        profile = profiling.RequestProfile()
+        with connection.execute_wrapper(profile):
+            for medicine_id in range(4):
+                list(Price.objects.filter(medicine_id=medicine_id))
+            Medicine.objects.count()
+        self.assertEqual(profile.queries, 5)
+        self.assertEqual(list(profile.duplicates(3).values()), [4])
+        self.assertEqual(profile.duplicates(5), {})
+    
+    def test_request_stats_view_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('request_stats')).status_code, 302)
+    
+    @override_settings(REQUEST_PROFILING=False)
+    def test_disabled_by_setting(self):
+        response = Client().get(reverse('home'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(profiling.stats(), {})
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.factory = AsyncRequestFactory()
+        pharmacy = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.generic = Medicine.objects.create(
+            brand_name='Paracetamol', composition='Paracetamol 500mg', strength='500mg',
+            manufacturer='Jan Aushadhi', medicine_type='generic'
+        )
+        Price.objects.create(medicine=self.crocin, pharmacy=pharmacy, price=Decimal('30.00'))
+        Price.objects.create(medicine=self.generic, pharmacy=pharmacy, price=Decimal('8.00'))
+        GenericBenefit.objects.create(title='Cost Effective', description='Cheaper', order=1)
+    
+    async def test_async_services_match_sync(self):
+        comparison = await PriceComparisonService.aget_price_comparison(self.crocin.id)
+        alternatives = await AlternativeFinderService.afind_alternatives(self.crocin.id)
+        page = await MedicineSearchService.asearch_page('para')
+        
+        expected = await sync_to_async(PriceComparisonService.get_price_comparison)(self.crocin.id)
+        self.assertEqual(comparison, expected)
+        self.assertEqual(alternatives, await sync_to_async(AlternativeFinderService.find_alternatives)(self.crocin.id))
+        self.assertEqual(page, await sync_to_async(MedicineSearchService.search_page)('para'))
+    
+    async def test_async_results_view(self):
+        response = await views.aresults(self.factory.get('/'), self.crocin.id)
+        self.assertContains(response, 'Crocin')
+        self.assertContains(response, 'Cost Effective')
+        self.assertContains(response, '8.00')
+        
+        missing = await views.aresults(self.factory.get('/'), 999999)
+        self.assertEqual(missing.status_code, 302)
+    
+    async def test_async_home_and_search_views(self):
+        self.assertContains(await views.ahome(self.factory.get('/')), 'Cost Effective')
+        response = await views.asearch(self.factory.get('/search/', {'q': 'croc'}))
+        self.assertContains(response, 'Crocin')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await views.asearch(self.factory.get('/search/'))).status_code, 302)
+
+    async def test_async_views_render_cached_fragments_off_the_event_loop(self):
+        original, on_loop = views.render, []
+
+        def render(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+            return original(*args, **kwargs)
+
+        with mock.patch.object(views, 'render', render):
+            self.assertContains(await views.ahome(self.factory.get('/')), 'Cost Effective')
+            self.assertContains(await views.aresults(self.factory.get('/'), self.crocin.id), 'Crocin')
+        self.assertEqual(on_loop, [False, False])
+    
+    @override_settings(ROOT_URLCONF=loadtest.urlconf(async_views=True), REQUEST_PROFILING=True)
+    async def test_profiling_middleware_under_asgi(self):
+        # AsyncClient sends request_started from a worker thread rather than
+        # the thread the async ORM uses, so wrap that thread's connection here
+        await sync_to_async(profiling.wrap_open_connections)()
+        response = await AsyncClient().get(f'/results/{self.crocin.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.medplus = Pharmacy.objects.create(name='MedPlus')
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.generic = Medicine.objects.create(
+            brand_name='Paracetamol', composition='Paracetamol 500mg', strength='500mg',
+            manufacturer='Jan Aushadhi', medicine_type='generic'
+        )
+        self.crocin_price = Price.objects.create(medicine=self.crocin, pharmacy=self.apollo, price=Decimal('30.00'))
+        Price.objects.create(medicine=self.crocin, pharmacy=self.medplus, price=Decimal('25.00'))
+        Price.objects.create(medicine=self.generic, pharmacy=self.medplus, price=Decimal('8.00'))
+    
+    def add_medicines(self, count):
+        ids = []
+        for i in range(count):
+            medicine = Medicine.objects.create(
+                brand_name=f'Brand {i}', composition=f'Salt {i} 10mg', strength='10mg', manufacturer='Cipla'
+            )
+            Price.objects.create(medicine=medicine, pharmacy=self.apollo, price=Decimal('10.00') + i)
+            Price.objects.create(medicine=medicine, pharmacy=self.medplus, price=Decimal('12.00') + i)
+            ids.append(medicine.id)
+        return ids
+    
+    def test_comparison(self):
+        response = self.client.get(reverse('api_comparison', args=[self.crocin.id]))
+        data = response.json()
+        self.assertEqual(data['medicine']['brand_name'], 'Crocin')
+        self.assertEqual([p['pharmacy'] for p in data['prices']], ['MedPlus', 'Apollo Pharmacy'])
+        self.assertEqual(data['lowest_price'], '25.00')
+        self.assertEqual(self.client.get(reverse('api_comparison', args=[999999])).status_code, 404)
+    
+    def test_conditional_requests(self):
+        url = reverse('api_comparison', args=[self.crocin.id])
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        
+        with self.assertNumQueries(1):
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+        
+        self.crocin_price.price = Decimal('20.00')
+        self.crocin_price.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['lowest_price'], '20.00')
+        
+        # Medicine edits change the ETag even though no price changed
+        self.crocin.manufacturer = 'Haleon'
+        self.crocin.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=changed['ETag']).status_code, 200)
+    
+    def test_alternatives(self):
+        url = reverse('api_alternatives', args=[self.crocin.id])
+        response = self.client.get(url)
+        data = response.json()['alternatives']
+        self.assertEqual([alt['medicine']['brand_name'] for alt in data], ['Paracetamol'])
+        self.assertTrue(data[0]['is_generic'])
+        self.assertEqual(data[0]['savings_amount'], '17.00')
+        
+        Price.objects.create(medicine=self.generic, pharmacy=self.apollo, price=Decimal('7.00'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+    
+    def test_batch_comparison_uses_constant_queries(self):
+        few = self.add_medicines(2)
+        many = self.add_medicines(20)
+        url = reverse('api_batch_comparison')
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url, {'ids': ','.join(map(str, few))})
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url, {'ids': ','.join(map(str, many))})
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(len(response.json()['comparisons']), 20)
+    
+    def test_batch_comparison_order_and_errors(self):
+        url = reverse('api_batch_comparison')
+        data = self.client.get(f'{url}?ids={self.generic.id},999999&ids={self.crocin.id},{self.generic.id}').json()
+        self.assertEqual([c['medicine']['brand_name'] for c in data['comparisons']], ['Paracetamol', 'Crocin'])
+        self.assertEqual(data['missing'], [999999])
+        self.assertEqual(data['comparisons'][1]['lowest_price'], '25.00')
+        
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': 'abc'}).status_code, 400)
+        too_many = ','.join(str(i) for i in range(1, api.MAX_BATCH + 2))
+        self.assertEqual(self.client.get(url, {'ids': too_many}).status_code, 400)
+    
+    def test_search(self):
+        results = self.client.get(reverse('api_search'), {'q': 'para'}).json()['results']
+        self.assertEqual([r['brand_name'] for r in results], ['Paracetamol', 'Crocin'])
+        self.assertEqual(results[0]['lowest_price'], '8.00')
+        self.assertEqual(self.client.get(reverse('api_search')).json()['results'], [])
+
+
+class BasketOptimizerTest(TestCase):
+    def setUp(self):
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.medplus = Pharmacy.objects.create(name='MedPlus')
+        self.netmeds = Pharmacy.objects.create(name='Netmeds')
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.generic = Medicine.objects.create(
+            brand_name='Paracetamol', composition='Paracetamol 500mg', strength='500mg',
+            manufacturer='Jan Aushadhi', medicine_type='generic'
+        )
+        self.mox = Medicine.objects.create(
+            brand_name='Mox', composition='Amoxicillin 250mg', strength='250mg', manufacturer='Sun Pharma'
+        )
+        self.unpriced = Medicine.objects.create(
+            brand_name='Rare', composition='Rare Salt 1mg', strength='1mg', manufacturer='Cipla'
+        )
+        for medicine, pharmacy, price in [
+            (self.crocin, self.apollo, '30.00'), (self.crocin, self.medplus, '25.00'),
+            (self.generic, self.medplus, '8.00'), (self.generic, self.netmeds, '7.00'),
+            (self.mox, self.apollo, '100.00'), (self.mox, self.netmeds, '120.00'),
+        ]:
+            Price.objects.create(medicine=medicine, pharmacy=pharmacy, price=Decimal(price))
+    
+    def test_single_pharmacy_and_split(self):
+        with self.assertNumQueries(3):
+            result = BasketOptimizerService.optimize({self.crocin.id: 2, self.mox.id: 1}, max_pharmacies=2)
+        self.assertEqual(result['lowest_total'], Decimal('150.00'))
+        
+        single = result['single_pharmacy']
+        self.assertEqual(single['pharmacies'], [self.apollo])
+        self.assertEqual(single['total'], Decimal('160.00'))
+        
+        split = result['split']
+        self.assertEqual(split['total'], Decimal('150.00'))
+        self.assertTrue(split['exact'])
+        self.assertEqual({p.name for p in split['pharmacies']}, {'Apollo Pharmacy', 'MedPlus'})
+        line = split['lines'][0]
+        self.assertEqual((line['medicine'], line['pharmacy'], line['quantity']), (self.crocin, self.medplus, 2))
+        self.assertEqual((line['unit_price'], line['subtotal']), (Decimal('25.00'), Decimal('50.00')))
+        
+        # With one pharmacy the split is the single pharmacy plan
+        self.assertEqual(BasketOptimizerService.optimize({self.crocin.id: 2, self.mox.id: 1}, 1)['split']['total'],
+                         Decimal('160.00'))
+    
+    def test_substitutes(self):
+        result = BasketOptimizerService.optimize({self.crocin.id: 2, self.mox.id: 1}, 2, substitutes=True)
+        self.assertEqual(result['single_pharmacy']['pharmacies'], [self.netmeds])
+        self.assertEqual(result['single_pharmacy']['total'], Decimal('134.00'))
+        self.assertEqual(result['split']['total'], Decimal('114.00'))
+        line = result['split']['lines'][0]
+        self.assertEqual((line['requested'], line['medicine'], line['pharmacy']), (self.crocin, self.generic, self.netmeds))
+
+    def test_medicines_without_composition_key_have_no_substitutes(self):
+        Medicine.objects.filter(pk__in=[self.mox.pk, self.unpriced.pk]).update(composition_key=None)
+        Price.objects.create(medicine=self.unpriced, pharmacy=self.medplus, price=Decimal('5.00'))
+        with self.assertNumQueries(3):
+            result = BasketOptimizerService.optimize({self.mox.id: 1}, 2, substitutes=True)
+        self.assertEqual(result['unavailable'], [])
+        self.assertEqual(result['single_pharmacy']['pharmacies'], [self.apollo])
+        self.assertEqual([line['medicine'] for line in result['split']['lines']], [self.mox])
+
+    def test_missing_and_unavailable(self):
+        result = BasketOptimizerService.optimize({999999: 1, self.unpriced.id: 1, self.generic.id: 1, self.mox.id: 1}, 2)
+        self.assertEqual(result['missing'], [999999])
+        self.assertEqual(result['unavailable'], [self.unpriced])
+        self.assertEqual([item['medicine'] for item in result['items']], [self.generic, self.mox])
+        self.assertEqual(result['single_pharmacy']['total'], Decimal('127.00'))
+        self.assertEqual(result['split']['total'], Decimal('107.00'))
+        
+        # Nobody stocks both, but two pharmacies together do
+        result = BasketOptimizerService.optimize({self.crocin.id: 1, self.generic.id: 1, self.mox.id: 1}, 1)
+        self.assertIsNone(result['single_pharmacy'])
+        self.assertIsNone(result['split'])
+        self.assertEqual(
+            BasketOptimizerService.optimize({self.crocin.id: 1, self.generic.id: 1, self.mox.id: 1}, 2)['split']['total'],
+            Decimal('133.00')
+        )
+        
+        empty = BasketOptimizerService.optimize({999999: 1})
+        self.assertIsNone(empty['split'])
+        self.assertIsNone(empty['lowest_total'])
+        with self.assertRaises(ValueError):
+            BasketOptimizerService.optimize({self.mox.id: 1}, max_pharmacies=0)
+    
+    def test_heuristic_split(self):
+        rng = random.Random(7)
+        for _ in range(20):
+            matrix = basket.PriceMatrix(12)
+            for pharmacy_id in range(1, 16):
+                for item in rng.sample(range(12), rng.randint(4, 12)):
+                    matrix.add(item, pharmacy_id, rng.randint(100, 10_000))
+            exact, is_exact = matrix.best_split(3)
+            with mock.patch.object(basket, 'EXACT_EVALUATIONS', 0):
+                heuristic, heuristic_exact = matrix.best_split(3)
+            self.assertTrue(is_exact)
+            self.assertFalse(heuristic_exact)
+            self.assertLessEqual(len(heuristic), 3)
+            self.assertGreaterEqual(matrix.cost(heuristic), matrix.cost(exact))
+    
+    def test_api(self):
+        url = reverse('api_basket')
+        data = self.client.get(url, {'items': f'{self.crocin.id}x2,{self.mox.id}', 'substitutes': '1'}).json()
+        self.assertEqual(data['split']['total'], '114.00')
+        self.assertEqual(data['split']['lines'][0]['medicine']['brand_name'], 'Paracetamol')
+        self.assertEqual(data['single_pharmacy']['pharmacies'], [{'id': self.netmeds.id, 'name': 'Netmeds'}])
+        
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'items': f'{self.crocin.id}x0'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'items': self.crocin.id, 'pharmacies': 9}).status_code, 400)
+
+
+class CompositionTest(TestCase):
+    def test_canonical_forms(self):
+        same = ['Paracetamol 500mg', 'Paracetamol 500 mg', 'Acetaminophen 500mg', 'PARACETAMOL (0.5 g)']
+        self.assertEqual({compositions.canonical(text) for text in same}, {'paracetamol 500mg'})
+        self.assertEqual(
+            compositions.composition_key('Amoxycillin 500 mg + Clavulanate Potassium 125mg'),
+            compositions.composition_key('Clavulanic Acid 125mg, Amoxicillin 500mg'),
+        )
+        self.assertEqual(compositions.canonical('Metformin Hydrochloride 500mg'), 'metformin 500mg')
+        self.assertEqual(compositions.canonical('Paracetamol 250mg/5ml'), 'paracetamol 50mg/ml')
+        self.assertEqual(compositions.canonical('Paracetamol', '500 mg'), 'paracetamol 500mg')
+        self.assertEqual(compositions.canonical('Potassium Chloride 600mg'), 'potassium chloride 600mg')
+        self.assertNotEqual(
+            compositions.composition_key('Paracetamol 500mg'), compositions.composition_key('Paracetamol 650mg')
+        )
+    
+    def test_alternatives_across_spellings(self):
+        pharmacy = Pharmacy.objects.create(name='Apollo Pharmacy')
+        crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        tylenol = Medicine.objects.create(
+            brand_name='Tylenol', composition='Acetaminophen 500 mg', strength='500 mg', manufacturer='J&J'
+        )
+        Price.objects.create(medicine=crocin, pharmacy=pharmacy, price=Decimal('30.00'))
+        Price.objects.create(medicine=tylenol, pharmacy=pharmacy, price=Decimal('20.00'))
+        
+        self.assertEqual(crocin.composition_key, tylenol.composition_key)
+        self.assertEqual([alt['medicine'] for alt in cache.find_alternatives(crocin.id)], [tylenol])
+        
+        composition = Composition.objects.get(key=crocin.composition_key)
+        self.assertEqual(composition.name, 'Paracetamol 500mg')
+        component = composition.components.get()
+        self.assertEqual((component.ingredient.name, component.strength, component.unit),
+                         ('paracetamol', Decimal('500'), 'mg'))
+        
+        # Changing the composition moves the medicine between alternative groups
+        tylenol.composition = 'Ibuprofen 400mg'
+        tylenol.save()
+        self.assertEqual(cache.find_alternatives(crocin.id), [])
+    
+    def test_backfill(self):
+        medicine = Medicine.objects.create(
+            brand_name='Augmentin', composition='Amoxycillin 500mg + Clavulanate Potassium 125mg',
+            strength='625mg', manufacturer='GSK'
+        )
+        key = medicine.composition_key
+        Medicine.objects.update(composition_key=None)
+        Composition.objects.all().delete()
+        
+        out = StringIO()
+        call_command('backfill_compositions', stdout=out)
+        self.assertIn('re-keyed 1 medicines', out.getvalue())
+        medicine.refresh_from_db()
+        self.assertEqual(medicine.composition_key, key)
+        self.assertEqual(
+            sorted(Composition.objects.get(key=key).ingredients.values_list('name', flat=True)),
+            ['amoxicillin', 'clavulanic acid'],
+        )
+        call_command('backfill_compositions', stdout=out)
+        self.assertIn('re-keyed 0 medicines', out.getvalue())
+
+    def test_backfill_moves_alternative_groups(self):
+        pharmacy = Pharmacy.objects.create(name='Apollo Pharmacy')
+        crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        generic = Medicine.objects.create(
+            brand_name='Paracetamol', composition='Paracetamol 500mg', strength='500mg',
+            manufacturer='Jan Aushadhi', medicine_type='generic'
+        )
+        Price.objects.create(medicine=crocin, pharmacy=pharmacy, price=Decimal('30.00'))
+        Price.objects.create(medicine=generic, pharmacy=pharmacy, price=Decimal('8.00'))
+        key = crocin.composition_key
+        # Keys from an older parser, with groups built for them
+        Medicine.objects.update(composition_key=42)
+        AlternativeGroupService.rebuild()
+        started = timezone.now()
+
+        call_command('backfill_compositions', stdout=StringIO())
+        self.assertEqual(list(AlternativeGroup.objects.values_list('pk', flat=True)), [key])
+        self.assertGreaterEqual(AlternativeGroup.objects.get().updated_at, started)
+        self.assertEqual([alt['medicine'] for alt in cache.find_alternatives(crocin.id)], [generic])
+
+
+@override_settings(PRICE_SNAPSHOT=True, PRICE_SNAPSHOT_MAX_AGE=3600)
+class PriceSnapshotTest(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy', website_url='https://apollo.example')
+        self.medplus = Pharmacy.objects.create(name='MedPlus')
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK',
+            description='Pain reliever', uses='Fever',
+        )
+        self.dolo = Medicine.objects.create(
+            brand_name='Dolo', composition='Paracetamol 500 mg', strength='500mg', manufacturer='Micro Labs'
+        )
+        self.generic = Medicine.objects.create(
+            brand_name='Paracetamol', composition='Paracetamol 500mg', strength='500mg',
+            manufacturer='Jan Aushadhi', medicine_type='generic'
+        )
+        self.unpriced = Medicine.objects.create(
+            brand_name='Calpol', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.brufen = Medicine.objects.create(
+            brand_name='Brufen', composition='Ibuprofen 400mg', strength='400mg', manufacturer='Abbott'
+        )
+        self.crocin_price = Price.objects.create(medicine=self.crocin, pharmacy=self.apollo, price=Decimal('30.00'))
+        Price.objects.create(medicine=self.crocin, pharmacy=self.medplus, price=Decimal('27.50'), price_type='online')
+        Price.objects.create(medicine=self.dolo, pharmacy=self.medplus, price=Decimal('25.00'), price_type='mrp')
+        Price.objects.create(medicine=self.generic, pharmacy=self.apollo, price=Decimal('9.00'))
+        self.brufen_price = Price.objects.create(medicine=self.brufen, pharmacy=self.apollo, price=Decimal('40.00'))
+        self.ids = [self.crocin.pk, self.dolo.pk, self.generic.pk, self.unpriced.pk, self.brufen.pk]
+    
+    def tearDown(self):
+        snapshot.reset()
+    
+    def comparison(self, comparison):
+        medicine = comparison['medicine']
+        return (
+            [getattr(medicine, field) for field in snapshot.MEDICINE_FIELDS],
+            [
+                (price.pk, price.pharmacy.name, price.pharmacy.website_url, price.price, price.price_type,
+                 price.last_updated)
+                for price in comparison['prices']
+            ],
+            comparison['lowest_price'], comparison['highest_price'], comparison['savings_percentage'],
+        )
+    
+    def alternatives(self, alternatives):
+        return [
+            (alt['medicine'].pk, alt['medicine'].brand_name, alt['medicine'].manufacturer, alt['lowest_price'],
+             alt['pharmacy_name'], alt['is_generic'], alt['savings_amount'], alt['savings_percentage'])
+            for alt in alternatives
+        ]
+    
+    def answers(self):
+        return (
+            [self.comparison(PriceComparisonService.get_price_comparison(medicine_id)) for medicine_id in self.ids],
+            [self.alternatives(AlternativeFinderService.find_alternatives(medicine_id)) for medicine_id in self.ids],
+            {medicine_id: self.comparison(comparison)
+             for medicine_id, comparison in PriceComparisonService.get_price_comparisons(self.ids).items()},
+        )
+    
+    def test_answers_match_the_database_without_queries(self):
+        with self.settings(PRICE_SNAPSHOT=False):
+            expected = self.answers()
+        built = snapshot.refresh()
+        self.assertEqual(len(built), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.answers(), expected)
+            self.assertEqual(cache.get_price_comparison(self.crocin.pk)['lowest_price'], Decimal('27.50'))
+        with self.assertRaises(Medicine.DoesNotExist):
+            PriceComparisonService.get_price_comparison(0)
+    
+    async def test_async_answers(self):
+        await sync_to_async(snapshot.refresh)()
+        comparison = await PriceComparisonService.aget_price_comparison(self.dolo.pk)
+        alternatives = await AlternativeFinderService.afind_alternatives(self.dolo.pk)
+        self.assertEqual(comparison['prices'][0].price_type, 'mrp')
+        self.assertEqual([alt['medicine'].brand_name for alt in alternatives], ['Paracetamol', 'Crocin'])
+    
+    def test_changed_compositions_are_read_from_the_database(self):
+        first = snapshot.refresh()
+        self.crocin_price.price = Decimal('20.00')
+        self.crocin_price.save()
+        
+        comparison = PriceComparisonService.get_price_comparison(self.crocin.pk)
+        self.assertEqual(comparison['lowest_price'], Decimal('20.00'))
+        self.assertEqual(
+            AlternativeFinderService.find_alternatives(self.dolo.pk)[1]['lowest_price'], Decimal('20.00')
+        )
+        # Other compositions are still answered from the snapshot
+        with self.assertNumQueries(0):
+            PriceComparisonService.get_price_comparison(self.brufen.pk)
+        
+        second = snapshot.refresh()
+        self.assertGreater(second.version, first.version)
+        with self.assertNumQueries(0):
+            comparison = PriceComparisonService.get_price_comparison(self.crocin.pk)
+        self.assertEqual(comparison['lowest_price'], Decimal('20.00'))
+        self.assertIs(snapshot.current(), second)
+        # The replaced snapshot no longer vouches for the changed composition
+        self.assertEqual(first.prices([self.crocin.pk]), {})
+        self.assertEqual(set(first.prices([self.brufen.pk])), {self.brufen.pk})
+
+    def search(self):
+        page = MedicineSearchService.search_page('paracetamol', select_related=('price_summary',))
+        return [
+            (medicine.pk, medicine.brand_name, medicine.description, medicine.search_rank,
+             *[getattr(getattr(medicine, 'price_summary', None), field, None)
+               for field in ('lowest_price', 'highest_price', 'lowest_pharmacy_id', 'price_count',
+                             'savings_percentage')])
+            for medicine in page.medicines
+        ]
+
+    def test_exported_file_answers_match_the_database(self):
+        with self.settings(PRICE_SNAPSHOT=False):
+            expected = self.answers()
+            expected_search = self.search()
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/prices.snapshot'
+            out = StringIO()
+            call_command('export_price_snapshot', output=path, stdout=out)
+            self.assertIn('Exported price snapshot 1', out.getvalue())
+            with self.settings(PRICE_SNAPSHOT_FILE=path):
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.answers(), expected)
+                mapped = snapshot.current()
+                self.assertEqual((mapped.path, mapped.version, len(mapped)), (path, 1, 5))
+                # Only the search query itself; the medicines come from the file
+                with self.assertNumQueries(1):
+                    self.assertEqual(self.search(), expected_search)
+
+    def test_new_exports_are_mapped_when_the_file_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/prices.snapshot'
+            snapshot.export(path)
+            with self.settings(PRICE_SNAPSHOT_FILE=path, PRICE_SNAPSHOT_CHECK_INTERVAL=0):
+                first = snapshot.current()
+                self.assertIs(snapshot.current(), first)
+                self.crocin_price.price = Decimal('20.00')
+                self.crocin_price.save()
+                self.assertEqual(snapshot.export(path).version, 2)
+
+                second = snapshot.current()
+                self.assertEqual(second.version, 2)
+                with self.assertNumQueries(0):
+                    comparison = PriceComparisonService.get_price_comparison(self.crocin.pk)
+                self.assertEqual(comparison['lowest_price'], Decimal('20.00'))
+                # The replaced file stays mapped for readers still holding it
+                self.assertEqual(first.prices([self.brufen.pk])[self.brufen.pk][1][0].price, Decimal('40.00'))
+
+                with open(path, 'wb') as file:
+                    file.write(b'not a snapshot')
+                with self.assertLogs('core.snapshot', 'ERROR'):
+                    self.assertIs(snapshot.current(), second)
+
+    def test_concurrent_callers_start_one_background_refresh(self):
+        release = threading.Event()
+        with mock.patch.object(snapshot, 'refresh', side_effect=lambda: release.wait(5)) as refresh:
+            callers = [threading.Thread(target=snapshot._refresh_in_background) for _ in range(16)]
+            for caller in callers:
+                caller.start()
+            for caller in callers:
+                caller.join()
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == 'price-snapshot':
+                    thread.join()
+        self.assertEqual(refresh.call_count, 1)
+        self.assertFalse(snapshot._refreshing.locked())
+
+
+class SavingsLeaderboardTest(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.pharmacy = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.crocin = self.priced('Crocin', 'Paracetamol 500mg', '100.00')
+        self.dolo = self.priced('Dolo', 'Paracetamol 500mg', '80.00')
+        self.paracetamol = self.priced('Paracetamol', 'Paracetamol 500mg', '30.00', 'generic')
+        self.priced('Pacimol', 'Paracetamol 500mg', '40.00', 'generic')
+        self.brufen = self.priced('Brufen', 'Ibuprofen 400mg', '50.00')
+        self.ibuprofen = self.priced('Ibuprofen', 'Ibuprofen 400mg', '45.00', 'generic')
+        # Branded only, and a generic dearer than the brand: no savings
+        self.priced('Allegra', 'Fexofenadine 120mg', '90.00')
+        self.priced('Zyrtec', 'Cetirizine 10mg', '20.00')
+        self.priced('Cetirizine', 'Cetirizine 10mg', '25.00', 'generic')
+    
+    def priced(self, brand_name, composition, price, medicine_type='branded'):
+        medicine = Medicine.objects.create(
+            brand_name=brand_name, composition=composition, strength=composition.split()[-1],
+            manufacturer='Test', medicine_type=medicine_type,
+        )
+        medicine.test_price = Price.objects.create(medicine=medicine, pharmacy=self.pharmacy, price=Decimal(price))
+        return medicine
+    
+    def leaderboard(self, order='amount'):
+        return [
+            (entry.branded_medicine.brand_name, entry.generic_medicine.brand_name, entry.savings_amount,
+             entry.savings_percentage)
+            for entry in SavingsLeaderboardService.top(order)
+        ]
+    
+    def test_full_refresh(self):
+        run = SavingsLeaderboardService.refresh()
+        self.assertEqual((run.full, run.groups, run.entries), (True, 4, 2))
+        # The cheapest brand is the reference, as on the results page
+        self.assertEqual(self.leaderboard(), [
+            ('Dolo', 'Paracetamol', Decimal('50.00'), Decimal('62.50')),
+            ('Brufen', 'Ibuprofen', Decimal('5.00'), Decimal('10.00')),
+        ])
+        entry = CompositionSavings.objects.get(composition_key=self.crocin.composition_key)
+        self.assertEqual((entry.branded_price, entry.generic_price), (Decimal('80.00'), Decimal('30.00')))
+        self.assertEqual((entry.branded_count, entry.generic_count), (2, 2))
+        with self.assertRaises(ValueError):
+            SavingsLeaderboardService.top('price')
+    
+    def test_incremental_refresh_only_recomputes_changed_groups(self):
+        SavingsLeaderboardService.refresh()
+        with override_settings(SAVINGS_LEADERBOARD_OVERLAP_SECONDS=0):
+            self.ibuprofen.test_price.price = Decimal('10.00')
+            self.ibuprofen.test_price.save()
+            run = SavingsLeaderboardService.refresh()
+            self.assertEqual((run.full, run.groups, run.entries), (False, 1, 1))
+            self.assertEqual(self.leaderboard('percentage'), [
+                ('Brufen', 'Ibuprofen', Decimal('40.00'), Decimal('80.00')),
+                ('Dolo', 'Paracetamol', Decimal('50.00'), Decimal('62.50')),
+            ])
+            
+            # The cheapest generic loses its price, the ibuprofen group all of its prices
+            self.paracetamol.test_price.delete()
+            Price.objects.filter(medicine__composition_key=self.brufen.composition_key).delete()
+            run = SavingsLeaderboardService.refresh()
+        self.assertEqual((run.groups, run.entries), (2, 1))
+        self.assertEqual(self.leaderboard(), [('Dolo', 'Pacimol', Decimal('40.00'), Decimal('50.00'))])
+        self.assertEqual(SavingsLeaderboardRun.objects.count(), 3)
+    
+    def test_api_is_cached_until_refreshed(self):
+        call_command('refresh_savings_leaderboard', stdout=StringIO())
+        url = reverse('api_savings_leaderboard')
+        response = self.client.get(url, {'order': 'percentage', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['order'], 'percentage')
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['results'][0]['branded']['brand_name'], 'Dolo')
+        self.assertEqual(data['results'][0]['generic']['id'], self.paracetamol.pk)
+        self.assertEqual(data['results'][0]['savings_percentage'], '62.50')
+        
+        etag = response['ETag']
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        
+        self.dolo.test_price.price = Decimal('90.00')
+        self.dolo.test_price.save()
+        self.assertEqual(self.client.get(url).json()['results'][0]['savings_amount'], '50.00')
+        call_command('refresh_savings_leaderboard', stdout=StringIO())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['savings_amount'], '60.00')
+        
+        self.assertEqual(self.client.get(url, {'order': 'name'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 500}).status_code, 400)
+
+
+class AlternativeGroupTest(TestCase):
+    def setUp(self):
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.medplus = Pharmacy.objects.create(name='MedPlus')
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.dolo = Medicine.objects.create(
+            brand_name='Dolo', composition='Paracetamol 500 mg', strength='500mg', manufacturer='Micro Labs'
+        )
+        self.generic = Medicine.objects.create(
+            brand_name='Paracetamol', composition='Paracetamol 500mg', strength='500mg',
+            manufacturer='Jan Aushadhi', medicine_type='generic'
+        )
+        Price.objects.create(medicine=self.crocin, pharmacy=self.apollo, price=Decimal('30.00'))
+        self.dolo_price = Price.objects.create(medicine=self.dolo, pharmacy=self.medplus, price=Decimal('25.00'))
+        Price.objects.create(medicine=self.generic, pharmacy=self.medplus, price=Decimal('9.00'))
+    
+    def members(self):
+        group = AlternativeGroup.objects.get(composition_key=self.crocin.composition_key)
+        return [(member[1], member[6]) for member in group.members]
+    
+    def live(self, medicine):
+        medicine = Medicine.objects.select_related('price_summary').get(pk=medicine.pk)
+        return AlternativeFinderService._results(medicine, AlternativeFinderService._alternatives(medicine))
+    
+    def test_group_is_maintained_incrementally(self):
+        self.assertEqual(self.members(), [('Paracetamol', '9.00'), ('Dolo', '25.00'), ('Crocin', '30.00')])
+        
+        self.dolo_price.price = Decimal('35.00')
+        self.dolo_price.save()
+        self.assertEqual(self.members(), [('Paracetamol', '9.00'), ('Crocin', '30.00'), ('Dolo', '35.00')])
+        
+        self.dolo.medicine_type = 'generic'
+        self.dolo.save()
+        self.assertEqual(self.members()[:2], [('Paracetamol', '9.00'), ('Dolo', '35.00')])
+        
+        self.generic.composition = 'Ibuprofen 400mg'
+        self.generic.save()
+        self.dolo_price.delete()
+        self.assertEqual(self.members(), [('Crocin', '30.00')])
+        
+        self.medplus.name = 'MedPlus Mart'
+        self.medplus.save()
+        group = AlternativeGroup.objects.get(composition_key=self.generic.composition_key)
+        self.assertEqual(group.members[0][7], 'MedPlus Mart')
+        
+        self.crocin.delete()
+        self.assertFalse(AlternativeGroup.objects.filter(composition_key=self.dolo.composition_key).exists())
+    
+    def test_group_results_match_live_query(self):
+        for medicine in (self.crocin, self.dolo, self.generic):
+            grouped = AlternativeFinderService.find_alternatives(medicine.id)
+            self.assertEqual(grouped, self.live(medicine))
+            self.assertEqual([alt['medicine'].brand_name for alt in grouped],
+                             [alt['medicine'].brand_name for alt in self.live(medicine)])
+        self.assertEqual(AlternativeFinderService.find_alternatives(self.crocin.id)[0]['savings_amount'],
+                         Decimal('21.00'))
+    
+    def test_missing_group_falls_back_to_live_query(self):
+        AlternativeGroup.objects.all().delete()
+        with self.assertNumQueries(3):
+            alternatives = AlternativeFinderService.find_alternatives(self.crocin.id)
+        self.assertEqual([alt['medicine'] for alt in alternatives], [self.generic, self.dolo])
+        with self.assertRaises(Medicine.DoesNotExist):
+            AlternativeFinderService.find_alternatives(999999)
+    
+    def test_rebuild_command(self):
+        AlternativeGroup.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_alternative_groups', stdout=out)
+        self.assertIn('Rebuilt 1 alternative groups (3 medicines)', out.getvalue())
+        self.assertEqual(self.members(), [('Paracetamol', '9.00'), ('Dolo', '25.00'), ('Crocin', '30.00')])
+
+
+class PriceHistoryTest(TestCase):
+    def setUp(self):
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.medplus = Pharmacy.objects.create(name='MedPlus')
+    
+    def history(self):
+        return list(PriceHistory.objects.order_by('pk').values_list('pharmacy_id', 'price_paise'))
+    
+    def test_only_changes_are_recorded(self):
+        price = Price.objects.create(medicine=self.crocin, pharmacy=self.apollo, price=Decimal('30.00'))
+        price.save()
+        price.price = Decimal('32.50')
+        price.save()
+        rows = [{'medicine_id': str(self.crocin.id), 'pharmacy_id': str(self.apollo.id), 'price': '32.50'},
+                {'medicine_id': str(self.crocin.id), 'pharmacy_id': str(self.medplus.id), 'price': '28.00'}]
+        PriceImporter().import_rows(enumerate(rows, 2))
+        rows[1]['price'] = '27.00'
+        PriceSyncer().sync_rows(enumerate(rows, 2))
+        
+        self.assertEqual(self.history(), [
+            (self.apollo.id, 3000), (self.apollo.id, 3250), (self.medplus.id, 2800), (self.medplus.id, 2700),
+        ])
+        entry = PriceHistory.objects.first()
+        self.assertEqual(entry.month, PriceHistory.month_of(entry.recorded_at))
+    
+    def record(self, days_ago, pharmacy, price, hour=12):
+        moment = (timezone.now() - timedelta(days=days_ago)).replace(hour=hour, minute=0, second=0, microsecond=0)
+        PriceHistoryService.record([(self.crocin.id, pharmacy.id, Decimal(price))], at=moment)
+    
+    def test_stats_survive_compaction(self):
+        self.record(200, self.apollo, '50.00')
+        self.record(60, self.apollo, '30.00', hour=9)
+        self.record(60, self.apollo, '36.00', hour=15)
+        self.record(40, self.medplus, '24.00')
+        self.record(1, self.apollo, '33.00')
+        expected = {'lowest': Decimal('24.00'), 'highest': Decimal('36.00'), 'average': Decimal('30.75'), 'changes': 4}
+        self.assertEqual(PriceHistoryService.stats(medicine_id=self.crocin.id, days=90), expected)
+        
+        removed, written = PriceHistoryService.compact(timezone.now().date() - timedelta(days=30))
+        self.assertEqual((removed, written), (4, 3))
+        self.assertEqual(self.history(), [(self.apollo.id, 3300)])
+        day = PriceDailyAggregate.objects.get(changes=2)
+        self.assertEqual((day.low_paise, day.high_paise, day.close_paise, day.total_paise), (3000, 3600, 3600, 6600))
+        
+        self.assertEqual(PriceHistoryService.stats(medicine_id=self.crocin.id, days=90), expected)
+        self.assertEqual(PriceHistoryService.stats(pharmacy_id=self.medplus.id)['average'], Decimal('24.00'))
+        self.assertIsNone(PriceHistoryService.stats(medicine_id=self.crocin.id, days=7, pharmacy_id=self.medplus.id))
+        by_pharmacy = PriceHistoryService.stats_by_pharmacy(self.crocin.id, days=365)
+        self.assertEqual(by_pharmacy[self.apollo.id]['changes'], 4)
+        self.assertEqual(by_pharmacy[self.apollo.id]['highest'], Decimal('50.00'))
+        
+        # Compacting again merges late changes into the existing day
+        self.record(60, self.apollo, '20.00', hour=18)
+        PriceHistoryService.compact(timezone.now().date() - timedelta(days=30))
+        day.refresh_from_db()
+        self.assertEqual((day.low_paise, day.close_paise, day.changes), (2000, 2000, 3))
+    
+    def test_compact_command_and_api(self):
+        self.record(400, self.apollo, '50.00')
+        self.record(100, self.apollo, '40.00')
+        self.record(3, self.medplus, '35.00')
+        out = StringIO()
+        call_command('compact_price_history', '--keep-days', '30', '--keep-daily-days', '365', stdout=out)
+        self.assertIn('Rolled 2 price changes into 2 daily aggregates and dropped 1 old aggregates', out.getvalue())
+        
+        data = self.client.get(reverse('api_price_history', args=[self.crocin.id]), {'days': 180}).json()
+        self.assertEqual(data['overall']['changes'], 2)
+        self.assertEqual([row['pharmacy_id'] for row in data['pharmacies']], [self.apollo.id, self.medplus.id])
+        self.assertEqual(data['pharmacies'][0]['average'], '40.00')
+        self.assertEqual(self.client.get(reverse('api_price_history', args=[self.crocin.id]), {'days': 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_price_history', args=[999999])).status_code, 404)
+
+
+@override_settings(SITE_URL='http://localhost:8000/')
+class PriceAlertTest(TestCase):
+    def setUp(self):
+        self.crocin = Medicine.objects.create(
+            brand_name='Crocin', composition='Paracetamol 500mg', strength='500mg', manufacturer='GSK'
+        )
+        self.brufen = Medicine.objects.create(
+            brand_name='Brufen', composition='Ibuprofen 400mg', strength='400mg', manufacturer='Abbott'
+        )
+        self.apollo = Pharmacy.objects.create(name='Apollo Pharmacy')
+        self.medplus = Pharmacy.objects.create(name='MedPlus')
+        self.crocin_price = Price.objects.create(medicine=self.crocin, pharmacy=self.apollo, price=Decimal('30.00'))
+        Price.objects.create(medicine=self.brufen, pharmacy=self.apollo, price=Decimal('45.00'))
+        self.cheap = PriceAlertService.subscribe('asha@example.com', self.crocin.id, Decimal('25.00'))
+        self.cheaper = PriceAlertService.subscribe('ravi@example.com', self.crocin.id, Decimal('20.00'))
+        self.brufen_alert = PriceAlertService.subscribe('asha@example.com', self.brufen.id, Decimal('40.00'))
+    
+    def test_price_drop_triggers_alert_once(self):
+        self.crocin_price.price = Decimal('24.00')
+        self.crocin_price.save()
+        notification = PriceAlertNotification.objects.get()
+        self.assertEqual((notification.alert, notification.price, notification.pharmacy),
+                         (self.cheap, Decimal('24.00'), self.apollo))
+        self.cheap.refresh_from_db()
+        self.cheaper.refresh_from_db()
+        self.assertIsNotNone(self.cheap.triggered_at)
+        self.assertIsNone(self.cheaper.triggered_at)
+        
+        Price.objects.create(medicine=self.crocin, pharmacy=self.medplus, price=Decimal('22.00'))
+        self.assertEqual(PriceAlertNotification.objects.count(), 1)
+    
+    def test_subscribing_below_the_current_price_triggers_at_once(self):
+        alert = PriceAlertService.subscribe('meera@example.com', self.crocin.id, Decimal('30.00'))
+        self.assertIsNotNone(alert.triggered_at)
+        self.assertEqual(
+            list(PriceAlertNotification.objects.values_list('alert_id', 'price')), [(alert.id, Decimal('30.00'))]
+        )
+        # The older alerts on the medicine are still above the price
+        self.assertEqual(PriceAlert.objects.filter(triggered_at__isnull=True).count(), 3)
+    
+    def test_bulk_import_matches_in_one_pass(self):
+        rows = [{'medicine_id': str(self.crocin.id), 'pharmacy_id': str(self.medplus.id), 'price': '19.50'},
+                {'medicine_id': str(self.brufen.id), 'pharmacy_id': str(self.medplus.id), 'price': '39.00'}]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(PriceAlertService.match([self.crocin.id, self.brufen.id]), 0)
+        # One INSERT ... SELECT, plus savepoints; nothing to retire
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 1)
+        PriceImporter().import_rows(enumerate(rows, 2))
+        
+        self.assertEqual(
+            sorted(PriceAlertNotification.objects.values_list('alert_id', 'price')),
+            [(self.cheap.id, Decimal('19.50')), (self.cheaper.id, Decimal('19.50')),
+             (self.brufen_alert.id, Decimal('39.00'))],
+        )
+        self.assertFalse(PriceAlert.objects.filter(triggered_at__isnull=True).exists())
+    
+    def test_worker_sends_outbox_and_retries_failures(self):
+        self.crocin_price.price = Decimal('18.00')
+        self.crocin_price.save()
+        
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            out = StringIO()
+            call_command('send_price_alerts', stdout=out)
+        self.assertIn('Sent 0 price alerts (2 failed)', out.getvalue())
+        self.assertEqual(set(PriceAlertNotification.objects.values_list('attempts', 'last_error')), {(1, 'OSError: down')})
+        
+        out = StringIO()
+        call_command('send_price_alerts', stdout=out)
+        self.assertIn('Sent 2 price alerts (0 failed)', out.getvalue())
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['asha@example.com', 'ravi@example.com'])
+        self.assertIn('Crocin is now ₹18.00', mail.outbox[0].subject)
+        self.assertIn(f"http://localhost:8000{reverse('results', args=[self.crocin.id])}\n", mail.outbox[0].body)
+        self.assertFalse(PriceAlertNotification.objects.filter(sent_at__isnull=True).exists())
@@ -1,8 +1,33 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
 
-urlpatterns = [
-    path('', views.home, name='home'),
-    path('search/', views.search, name='search'),
-    path('results/<int:medicine_id>/', views.results, name='results'),
-]
+
+def patterns(async_views: bool) -> list:
+    """
+    The app's URL patterns, with the home, search and results pages served
+    by their sync or async views
+    """
+    if async_views:
+        home, search, results = views.ahome, views.asearch, views.aresults
+    else:
+        home, search, results = views.home, views.search, views.results
+    return [
+        path('', home, name='home'),
+        path('search/', search, name='search'),
+        path('autocomplete/', views.autocomplete, name='autocomplete'),
+        path('results/<int:medicine_id>/', results, name='results'),
+        path('stats/cache/', views.cache_stats, name='cache_stats'),
+        path('stats/requests/', views.request_stats, name='request_stats'),
+        path('api/search/', api.search, name='api_search'),
+        path('api/medicines/<int:medicine_id>/comparison/', api.comparison, name='api_comparison'),
+        path('api/medicines/<int:medicine_id>/alternatives/', api.alternatives, name='api_alternatives'),
+        path('api/medicines/<int:medicine_id>/history/', api.price_history, name='api_price_history'),
+        path('api/comparisons/', api.batch_comparison, name='api_batch_comparison'),
+        path('api/basket/', api.basket, name='api_basket'),
+        path('api/savings/', api.savings_leaderboard, name='api_savings_leaderboard'),
+    ]
+
+
+# Under ASGI the pages are served by their async views
+urlpatterns = patterns(settings.ASYNC_VIEWS)
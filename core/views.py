@@ -1,16 +1,73 @@
+import asyncio
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Q
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
-from .models import Medicine, GenericBenefit
-from .services import MedicineSearchService, PriceComparisonService, AlternativeFinderService
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import urlencode
+from . import autocomplete as autocomplete_index
+from . import cache as results_cache
+from . import profiling
+from .conditional import composition_key, conditional_page, medicines_freshness, templates_stamp
+from .models import Medicine
+from .services import MedicineSearchService
 from .forms import MedicineSearchForm
 
 
+def _home_freshness(request):
+    return f'home-{results_cache.benefits_version()}-{templates_stamp()}', None
+
+
+def _medicine_page_freshness(request, medicine_id):
+    """
+    Validators of the medicine and its alternatives (everything sharing its
+    composition)
+    """
+    medicines = Q(pk=medicine_id)
+    key = composition_key(request, medicine_id)
+    if key is not None:
+        medicines |= Q(composition_key=key)
+    return medicines_freshness(Medicine.objects.filter(medicines))
+
+
+def _results_freshness(request, medicine_id):
+    try:
+        etag, last_modified = results_cache.get_page_freshness(
+            medicine_id, partial(_medicine_page_freshness, request), partial(composition_key, request, medicine_id)
+        )
+    except Medicine.DoesNotExist:
+        return None
+    # The generic benefits are shown alongside
+    return f'{etag}-{results_cache.benefits_version()}-{templates_stamp()}', last_modified
+
+
+def _search_context(request, query, page):
+    return {
+        'query': query,
+        'medicines': page.medicines,
+        'count': page.count,
+        'count_exact': page.count_exact,
+        'is_first_page': not request.GET.get('after'),
+        'next_url': f"{reverse('search')}?{urlencode({'q': query, 'after': page.next_cursor})}"
+        if page.next_cursor else None,
+    }
+
+
+@conditional_page(_home_freshness)
 def home(request):
     """
     Display the search homepage
     """
     form = MedicineSearchForm()
-    generic_benefits = GenericBenefit.objects.filter(is_active=True)
-    return render(request, 'home.html', {'form': form, 'generic_benefits': generic_benefits})
+    # Only looked up if the cached benefits fragment has to be rendered
+    generic_benefits = SimpleLazyObject(results_cache.get_generic_benefits)
+    return render(request, 'home.html', {
+        'form': form, 'generic_benefits': generic_benefits, 'fragments': results_cache.fragment_context(),
+    })
 
 
 def search(request):
@@ -22,25 +79,25 @@ def search(request):
     if not query:
         return redirect('home')
     
-    medicines = MedicineSearchService.search_medicines(query)
-    
-    context = {
-        'query': query,
-        'medicines': medicines,
-        'count': medicines.count()
-    }
+    try:
+        page = MedicineSearchService.search_page(query, request.GET.get('after'))
+    except ValueError:
+        page = MedicineSearchService.search_page(query)
     
-    return render(request, 'search_results.html', context)
+    return render(request, 'search_results.html', _search_context(request, query, page))
 
 
+@conditional_page(_results_freshness)
 def results(request, medicine_id):
     """
     Display price comparison and alternatives for a specific medicine
     """
     try:
-        comparison_data = PriceComparisonService.get_price_comparison(medicine_id)
-        alternatives = AlternativeFinderService.find_alternatives(medicine_id)
-        generic_benefits = GenericBenefit.objects.filter(is_active=True)
+        # Looked up once for the validators and both lookups
+        lookup_key = partial(composition_key, request, medicine_id)
+        comparison_data = results_cache.get_price_comparison(medicine_id, lookup_key)
+        alternatives = results_cache.find_alternatives(medicine_id, lookup_key)
+        generic_benefits = results_cache.get_generic_benefits()
         
         # Check if there are generic alternatives
         has_generic_alternatives = any(alt['is_generic'] for alt in alternatives)
@@ -54,9 +111,106 @@ def results(request, medicine_id):
             'alternatives': alternatives,
             'generic_benefits': generic_benefits,
             'has_generic_alternatives': has_generic_alternatives,
+            'fragments': results_cache.fragment_context([comparison_data['medicine'].composition_key]),
         }
         
         return render(request, 'results.html', context)
     
     except Medicine.DoesNotExist:
         return redirect('home')
+
+
+@conditional_page(_home_freshness)
+async def ahome(request):
+    """
+    Async version of home
+    """
+    form = MedicineSearchForm()
+    generic_benefits = await results_cache.aget_generic_benefits()
+    # The version counters and the template's {% cache %} fragments use the
+    # blocking cache API, so both stay off the event loop
+    fragments = await sync_to_async(results_cache.fragment_context)()
+    return await sync_to_async(render)(request, 'home.html', {
+        'form': form, 'generic_benefits': generic_benefits, 'fragments': fragments,
+    })
+
+
+async def asearch(request):
+    """
+    Async version of search
+    """
+    query = request.GET.get('q', '').strip()
+    
+    if not query:
+        return redirect('home')
+    
+    try:
+        page = await MedicineSearchService.asearch_page(query, request.GET.get('after'))
+    except ValueError:
+        page = await MedicineSearchService.asearch_page(query)
+    
+    return render(request, 'search_results.html', _search_context(request, query, page))
+
+
+@conditional_page(_results_freshness)
+async def aresults(request, medicine_id):
+    """
+    Async version of results: the comparison, alternatives and benefits
+    lookups are awaited together
+    """
+    lookup_key = partial(composition_key, request, medicine_id)
+    try:
+        comparison_data, alternatives, generic_benefits = await asyncio.gather(
+            results_cache.aget_price_comparison(medicine_id, lookup_key),
+            results_cache.afind_alternatives(medicine_id, lookup_key),
+            results_cache.aget_generic_benefits(),
+        )
+    except Medicine.DoesNotExist:
+        return redirect('home')
+    
+    context = {
+        'medicine': comparison_data['medicine'],
+        'prices': comparison_data['prices'],
+        'lowest_price': comparison_data['lowest_price'],
+        'highest_price': comparison_data['highest_price'],
+        'savings_percentage': comparison_data['savings_percentage'],
+        'alternatives': alternatives,
+        'generic_benefits': generic_benefits,
+        'has_generic_alternatives': any(alt['is_generic'] for alt in alternatives),
+        'fragments': await sync_to_async(results_cache.fragment_context)(
+            [comparison_data['medicine'].composition_key]
+        ),
+    }
+    
+    return await sync_to_async(render)(request, 'results.html', context)
+
+
+def autocomplete(request):
+    """
+    Typeahead completions for the search box, answered from the in-memory index
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    
+    results = autocomplete_index.get_index().lookup(query, limit) if query else []
+    return JsonResponse({'query': query, 'results': results})
+
+
+@staff_member_required
+def cache_stats(request):
+    """
+    Hit/miss counters of the results cache in this worker process
+    """
+    return JsonResponse(results_cache.stats())
+
+
+@staff_member_required
+def request_stats(request):
+    """
+    Per-view timing histograms and repeated SQL recorded by the request
+    profiler in this worker process
+    """
+    return JsonResponse(profiling.stats())
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestProfilingMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,9 +55,14 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'medcompare.urls'
 
+# Serve the home, search and results pages with their async views.
+# medcompare/asgi.py turns this on; WSGI deployments keep the sync views.
+ASYNC_VIEWS = os.environ.get('MEDCOMPARE_ASYNC_VIEWS', '0') == '1'
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with render timing for the request profiler
+        'BACKEND': 'core.profiling.ProfilingDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,13 +82,122 @@ WSGI_APPLICATION = 'medcompare.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite profiles: connection lifetime plus PRAGMAS applied to every new
+# connection by core/db.py. Select one with MEDCOMPARE_DB_PROFILE.
+# production: WAL, so readers never wait for the import writer (and it
+# never waits for them); synchronous=NORMAL, which is durable across
+# application crashes and can only lose the last commits on power loss; a
+# 64 MiB page cache, 256 MiB of the file memory-mapped and in-memory temp
+# tables; connections kept for ten minutes and checked before reuse.
+# Both wait up to 20s on a locked database instead of failing at once.
+
+SQLITE_PROFILES = {
+    'development': {
+        'CONN_MAX_AGE': 0,
+        'PRAGMAS': {},
+    },
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'PRAGMAS': {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'cache_size': -64 * 1024,
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'memory',
+        },
+    },
+}
+DATABASE_PROFILE = os.environ.get('MEDCOMPARE_DB_PROFILE', 'development')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'timeout': 20},
+        **SQLITE_PROFILES[DATABASE_PROFILE],
+    }
+}
+
+# Read replicas: comma separated database file paths in
+# MEDCOMPARE_DB_REPLICAS become aliases replica_1, replica_2, ... Catalogue
+# reads made by requests go to a replica (see core/routers.py); a client
+# that writes reads from the primary for REPLICA_STICKY_SECONDS afterwards,
+# and paths under REPLICA_PRIMARY_PATHS always do. Copy the primary into
+# local SQLite stand-ins with `manage.py sync_replicas`.
+
+DATABASE_REPLICAS = []
+for _number, _name in enumerate(filter(None, os.environ.get('MEDCOMPARE_DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica_{_number}'] = {**DATABASES['default'], 'NAME': _name.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{_number}')
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.environ.get('MEDCOMPARE_REPLICA_STICKY_SECONDS', '10'))
+REPLICA_PRIMARY_PATHS = ['/admin/']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Results page entries are invalidated by version counters, not by expiry.
+# Use 'django.core.cache.backends.filebased.FileBasedCache' with a shared
+# LOCATION to share entries and counters between worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'medcompare',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
+RESULTS_CACHE_ALIAS = 'default'
+RESULTS_CACHE_TIMEOUT = 60 * 60 * 24
+# Search result counts are cached briefly and shown as approximate
+SEARCH_COUNT_CACHE_TIMEOUT = 300
+# Incremental savings leaderboard refreshes also recompute groups changed
+# this long before the previous run started (transactions still open then)
+SAVINGS_LEADERBOARD_OVERLAP_SECONDS = 300
+
+
+# Price snapshot
+# Searches, price comparisons and alternatives answered from an immutable
+# copy of the catalogue and all prices (see core.snapshot). Without
+# PRICE_SNAPSHOT_FILE every worker builds its own, in the background once it
+# is PRICE_SNAPSHOT_MAX_AGE seconds old. With it, workers map the file written
+# by `manage.py export_price_snapshot` and share it, checking for a new one
+# every PRICE_SNAPSHOT_CHECK_INTERVAL seconds; that needs a results cache
+# shared with the exporting process.
+
+PRICE_SNAPSHOT = os.environ.get('MEDCOMPARE_PRICE_SNAPSHOT', '0') == '1'
+PRICE_SNAPSHOT_MAX_AGE = int(os.environ.get('MEDCOMPARE_PRICE_SNAPSHOT_MAX_AGE', '300'))
+PRICE_SNAPSHOT_FILE = os.environ.get('MEDCOMPARE_PRICE_SNAPSHOT_FILE', '')
+PRICE_SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('MEDCOMPARE_PRICE_SNAPSHOT_CHECK_INTERVAL', '1'))
+
+
+# Autocomplete
+# Every worker keeps its own typeahead index and rebuilds it when another
+# process changed the catalogue, checking every AUTOCOMPLETE_CHECK_INTERVAL
+# seconds; that needs a results cache shared between the workers.
+
+AUTOCOMPLETE_CHECK_INTERVAL = float(os.environ.get('MEDCOMPARE_AUTOCOMPLETE_CHECK_INTERVAL', '1'))
+
+
+# Price alerts
+# Alert emails link back to the results page under SITE_URL, the public
+# scheme and host of the site (no trailing slash).
+
+SITE_URL = os.environ.get('MEDCOMPARE_SITE_URL', 'http://localhost:8000')
+
+
+# Request profiling
+# Per-view timings, query counts and repeated SQL, reported in Server-Timing
+# headers and at /stats/requests/. Off unless MEDCOMPARE_REQUEST_PROFILING=1;
+# when off the middleware removes itself entirely.
+
+REQUEST_PROFILING = os.environ.get('MEDCOMPARE_REQUEST_PROFILING', '0') == '1'
+REQUEST_PROFILING_SLOW_MS = 500
+REQUEST_PROFILING_DUPLICATE_THRESHOLD = 3
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
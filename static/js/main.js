@@ -1,5 +1,114 @@
 // Main JavaScript for Medicine Price Comparison
 
+const AUTOCOMPLETE_DELAY_MS = 150;
+
+function setupAutocomplete(input) {
+    const url = input.dataset.autocompleteUrl;
+    const menu = document.createElement('div');
+    menu.className = 'list-group autocomplete-menu d-none';
+    input.insertAdjacentElement('afterend', menu);
+
+    let timer = null;
+    let controller = null;
+    let activeIndex = -1;
+
+    function hide() {
+        menu.classList.add('d-none');
+        menu.innerHTML = '';
+        activeIndex = -1;
+    }
+
+    function targetUrl(item) {
+        if (item.kind === 'medicine') {
+            return `/results/${item.medicine_id}/`;
+        }
+        return `${input.form.action}?q=${encodeURIComponent(item.label)}`;
+    }
+
+    function render(results) {
+        menu.innerHTML = '';
+        activeIndex = -1;
+        if (!results.length) {
+            hide();
+            return;
+        }
+        results.forEach(item => {
+            const link = document.createElement('a');
+            link.className = 'list-group-item list-group-item-action';
+            link.href = targetUrl(item);
+            link.textContent = item.label;
+            if (item.kind === 'composition') {
+                const badge = document.createElement('span');
+                badge.className = 'badge bg-secondary ms-2';
+                badge.textContent = 'Composition';
+                link.appendChild(badge);
+            }
+            menu.appendChild(link);
+        });
+        menu.classList.remove('d-none');
+    }
+
+    function fetchCompletions() {
+        const query = input.value.trim();
+        if (controller) {
+            controller.abort();
+        }
+        if (!query) {
+            hide();
+            return;
+        }
+        controller = new AbortController();
+        fetch(`${url}?q=${encodeURIComponent(query)}`, { signal: controller.signal })
+            .then(response => response.json())
+            .then(data => {
+                // Ignore responses for text the user has already changed
+                if (data.query === input.value.trim()) {
+                    render(data.results);
+                }
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') {
+                    hide();
+                }
+            });
+    }
+
+    function highlight(index) {
+        const items = menu.querySelectorAll('.list-group-item');
+        if (!items.length) {
+            return;
+        }
+        activeIndex = (index + items.length) % items.length;
+        items.forEach((item, i) => item.classList.toggle('active', i === activeIndex));
+    }
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(fetchCompletions, AUTOCOMPLETE_DELAY_MS);
+    });
+
+    input.addEventListener('keydown', function(e) {
+        if (e.key === 'ArrowDown') {
+            e.preventDefault();
+            highlight(activeIndex + 1);
+        } else if (e.key === 'ArrowUp') {
+            e.preventDefault();
+            highlight(activeIndex - 1);
+        } else if (e.key === 'Enter' && activeIndex >= 0) {
+            e.preventDefault();
+            window.location.href = menu.querySelectorAll('.list-group-item')[activeIndex].href;
+        } else if (e.key === 'Escape') {
+            hide();
+        }
+    });
+
+    document.addEventListener('click', function(e) {
+        if (e.target !== input && !menu.contains(e.target)) {
+            hide();
+        }
+    });
+}
+
 document.addEventListener('DOMContentLoaded', function() {
     // Add smooth scrolling
     document.querySelectorAll('a[href^="#"]').forEach(anchor => {
@@ -19,4 +128,7 @@ document.addEventListener('DOMContentLoaded', function() {
     if (searchInput && window.location.pathname === '/') {
         searchInput.focus();
     }
+
+    // Typeahead suggestions for search inputs
+    document.querySelectorAll('input[data-autocomplete-url]').forEach(setupAutocomplete);
 });